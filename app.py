@@ -1,5 +1,5 @@
 # app.py
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file
+from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file, make_response, current_app, jsonify, g, has_request_context
 import os
 import requests
 import json
@@ -10,6 +10,33 @@ import sys # Import sys to check for PyInstaller frozen state
 import tempfile # Added for creating temporary files for service account key
 from openpyxl.styles import Font, PatternFill, Alignment # Import for Excel styling
 import csv # Import for CSV operations
+import gzip # For compressing large HTML/JSON responses
+import hashlib # For record data versions and ETags
+import re
+import bisect # Prefix lookups in the record search index
+import difflib # Fuzzy matching of misspelled search terms
+import numpy as np
+import threading # Guards the in-process record caches
+import time
+import tracemalloc # Allocation summaries for profiled requests
+import base64 # For opaque API pagination cursors
+import uuid # Background job ids
+import contextvars # Tracks the farm (tenant) a request or job works for
+import contextlib # Cross-process file locks
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+import openpyxl
+try:
+    import brotli # Optional: enables 'br' response compression when installed
+except ImportError:
+    brotli = None
+try:
+    import pyarrow # Optional: enables Parquet/Arrow record snapshots when installed
+    import pyarrow.feather
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 
 # Import Google Sheets libraries
 import gspread
@@ -34,25 +61,223 @@ ARKESEL_SENDER_ID = os.environ.get('ARKESEL_SENDER_ID', 'FarmApp') # Your regist
 # UPDATED GOOGLE_SHEET_ID to the latest one provided by you: 18NjH0VhNolUA3m_2JGvqR9oubcON92OVMQBxdf3Axi8
 GOOGLE_SHEET_ID = os.environ.get('GOOGLE_SHEET_ID', "18NjH0VhNolUA3m_2JGvqR9oubcON92OVMQBxdf3Axi8")
 # GOOGLE_SHEET_KEY_FILE is no longer used directly as key is reconstructed from env vars
+# Sends Sheets API calls to a local stand-in (such as loadtest.py's fake service) instead of Google,
+# without credentials. Leave unset in production.
+GOOGLE_SHEETS_API_URL = os.environ.get('GOOGLE_SHEETS_API_URL', '').rstrip('/')
+GOOGLE_SHEETS_API_ORIGIN = 'https://sheets.googleapis.com'
 
 # CSV Fallback Configuration
 # Set to 'true' (case-insensitive) in environment variables to enable CSV fallback
 USE_CSV_FALLBACK = os.environ.get('USE_CSV_FALLBACK', 'false').lower() == 'true'
 CSV_FILE_NAME = 'farm_records.csv'
-# Path for the CSV file. When bundled, sys._MEIPASS is the temp extraction dir.
-# When deployed on Render, root_path is typically the /app directory.
-# For local dev, it's the current directory.
-# This will be set more precisely in create_app().
-CSV_FILE_PATH = None 
+# The CSV file lives in the app's root_path (sys._MEIPASS when bundled, /app on Render,
+# the current directory for local dev), or in tenants/<farm>/ for additional farms.
+
+# Record Partitioning Configuration
+# 'year' (default) or 'month' stores records in one worksheet / CSV file per period, so reports
+# only read the periods they cover. 'none' keeps everything in sheet1 / farm_records.csv.
+RECORD_PARTITIONING = os.environ.get('RECORD_PARTITIONING', 'year').lower()
+# Partitions whose period ended more than this many days ago are compacted into read-only archives
+PARTITION_ARCHIVE_AFTER_DAYS = int(os.environ.get('PARTITION_ARCHIVE_AFTER_DAYS', '90'))
+# The pre-partitioning storage (sheet1 / farm_records.csv) is kept and read as the 'legacy' partition
+LEGACY_PARTITION_KEY = 'legacy'
+PARTITION_MANIFEST_WORKSHEET = 'Partitions'
+PARTITION_MANIFEST_HEADERS = ['Key', 'Worksheet', 'Min Date', 'Max Date', 'Archived', 'Generation']
+PARTITION_MANIFEST_FILE_NAME = 'manifest.json'
+# Local directory (per farm) for partition CSV files, the CSV manifest and archives
+PARTITION_DIR_NAME = 'partitions'
+# Appends, edits and compaction of one backend's records take a lock shared by all workers; a write
+# waits at most this many seconds for it
+FILE_LOCK_TIMEOUT_SECONDS = float(os.environ.get('FILE_LOCK_TIMEOUT_SECONDS', '30'))
+
+# Record Cache Configuration
+# Google Sheets partitions are re-fetched after this many seconds; CSV partitions are revalidated
+# by file modification time, and archived partitions never expire.
+RECORDS_CACHE_TTL_SECONDS = int(os.environ.get('RECORDS_CACHE_TTL_SECONDS', '30'))
+# Number of normalized DataFrames (one per data version) kept in memory
+FRAME_CACHE_SIZE = int(os.environ.get('FRAME_CACHE_SIZE', '8'))
+
+# Multi-Farm Tenancy Configuration
+# Additional farms served by this process come from FARM_TENANTS (a JSON string) or
+# FARM_TENANTS_FILE (a path to a JSON file), e.g.
+#   {"north": {"name": "North Farm", "sheet_id": "...", "admin_username": "...",
+#              "admin_password": "...", "hosts": ["north.example.com"]}}
+# The 'default' farm always exists and uses the settings above.
+DEFAULT_TENANT_ID = 'default'
+TENANTS_DIR_NAME = 'tenants'
+# Farms keeping a pooled Sheets client and record caches in memory; the least recently used is dropped
+MAX_ACTIVE_TENANTS = int(os.environ.get('MAX_ACTIVE_TENANTS', '8'))
+# Pooled Sheets clients are rebuilt after this many seconds
+SHEETS_CLIENT_MAX_AGE_SECONDS = int(os.environ.get('SHEETS_CLIENT_MAX_AGE_SECONDS', '1800'))
+# tenant_id -> farm settings. Built in create_app().
+TENANTS = {}
+
+# Response Compression Configuration
+COMPRESSIBLE_MIMETYPES = {'text/html', 'application/json', 'text/csv', 'text/plain'}
+COMPRESS_MIN_BYTES = 1024
+
+
+def notify(message, category='info'):
+    """Flashes a message to the user during a request; outside one (background jobs) it is only logged."""
+    if has_request_context():
+        flash(message, category)
+    else:
+        print(f"--- DEBUG: notify ({category}): {message}")
+
+
+# --- Multi-Farm Tenancy ---
+_current_tenant_id = contextvars.ContextVar('current_tenant_id', default=DEFAULT_TENANT_ID)
+_tenant_states = OrderedDict() # tenant_id -> pooled client and caches, bounded by MAX_ACTIVE_TENANTS
+_tenant_states_lock = threading.Lock()
+
+def make_tenant(tenant_id, config, root_path):
+    """Builds a farm's settings dictionary. The default farm keeps its files in root_path itself."""
+    base_dir = root_path if tenant_id == DEFAULT_TENANT_ID else os.path.join(root_path, TENANTS_DIR_NAME, tenant_id)
+    return {
+        'id': tenant_id,
+        'name': config.get('name') or tenant_id.replace('_', ' ').title(),
+        'sheet_id': config.get('sheet_id') or '',
+        'admin_username': config.get('admin_username') or '',
+        'admin_password': config.get('admin_password') or '',
+        'hosts': [host.lower() for host in config.get('hosts', [])],
+        'csv_file_path': os.path.join(base_dir, CSV_FILE_NAME),
+        'partition_dir': os.path.join(base_dir, PARTITION_DIR_NAME),
+        'jobs_dir': os.path.join(base_dir, JOBS_DIR_NAME),
+        'snapshot_dir': os.path.join(base_dir, SNAPSHOT_DIR_NAME),
+        'profiles_dir': os.path.join(base_dir, PROFILES_DIR_NAME),
+        'submissions_dir': os.path.join(base_dir, SUBMISSIONS_DIR_NAME),
+        'feed_ledger_path': os.path.join(base_dir, FEED_LEDGER_FILE_NAME),
+        'feed_balances_path': os.path.join(base_dir, FEED_BALANCES_FILE_NAME),
+    }
+
+def load_tenants(root_path):
+    """Returns all farms: the default one from the module settings plus FARM_TENANTS / FARM_TENANTS_FILE."""
+    tenants = {DEFAULT_TENANT_ID: make_tenant(DEFAULT_TENANT_ID, {
+        'name': os.environ.get('FARM_NAME', 'Uniquebence Farm'),
+        'sheet_id': GOOGLE_SHEET_ID,
+        'admin_username': ADMIN_USERNAME,
+        'admin_password': ADMIN_PASSWORD,
+        'hosts': [host for host in os.environ.get('FARM_HOSTS', '').split(',') if host],
+    }, root_path)}
+
+    raw_config = os.environ.get('FARM_TENANTS')
+    tenants_file = os.environ.get('FARM_TENANTS_FILE')
+    try:
+        if not raw_config and tenants_file:
+            with open(tenants_file, 'r', encoding='utf-8') as config_file:
+                raw_config = config_file.read()
+        for tenant_id, config in (json.loads(raw_config) if raw_config else {}).items():
+            if not tenant_id.replace('_', '').replace('-', '').isalnum():
+                print(f"--- DEBUG: load_tenants: Skipping farm with invalid id {tenant_id!r}.")
+                continue
+            tenants[tenant_id] = make_tenant(tenant_id, config, root_path)
+    except Exception as e:
+        print(f"--- DEBUG: load_tenants: ERROR reading farm configuration: {e}")
+    print(f"--- DEBUG: load_tenants: Serving farms: {sorted(tenants)}")
+    return tenants
+
+def current_tenant():
+    """Returns the settings of the farm the current request or job works for."""
+    return TENANTS.get(_current_tenant_id.get()) or TENANTS[DEFAULT_TENANT_ID]
+
+def set_current_tenant(tenant_id):
+    """Selects the farm for the rest of this request or job thread."""
+    _current_tenant_id.set(tenant_id if tenant_id in TENANTS else DEFAULT_TENANT_ID)
+
+def request_tenant():
+    """
+    Returns (tenant_id, session_valid) for the current request: a farm mapped to the request host wins,
+    otherwise the farm chosen at login. A session from another (or removed) farm is not valid here.
+    """
+    tenant_id = tenant_for_host(request.host) or session.get('tenant') or DEFAULT_TENANT_ID
+    if tenant_id not in TENANTS or (session.get('tenant') and session['tenant'] != tenant_id):
+        return tenant_for_host(request.host) or DEFAULT_TENANT_ID, False
+    return tenant_id, True
+
+def tenant_for_host(host):
+    """Returns the id of the farm mapped to a request Host (port ignored), or None."""
+    host = (host or '').split(':')[0].lower()
+    for tenant_id, tenant in TENANTS.items():
+        if host in tenant['hosts']:
+            return tenant_id
+    return None
+
+def tenant_state():
+    """
+    Returns the current farm's in-memory state (pooled Sheets client and record caches),
+    creating it on first use and evicting the least recently used farm beyond MAX_ACTIVE_TENANTS.
+    """
+    tenant_id = current_tenant()['id']
+    with _tenant_states_lock:
+        state = _tenant_states.get(tenant_id)
+        if state is None:
+            state = _tenant_states[tenant_id] = {
+                'lock': threading.Lock(),
+                'client': None,
+                'client_created_at': 0.0,
+                'spreadsheets': {}, # sheet_id -> gspread Spreadsheet opened with the pooled client
+                'partition_cache': {}, # (backend, partition_key) -> {'records', 'digest', 'stamp', 'generation', 'loaded_at'}
+                'manifest_cache': {}, # backend -> {'manifest', 'loaded_at'}
+                'frame_cache': OrderedDict(), # data_version -> {'df', 'loaded_at'}
+                'export_cache': {}, # data_version -> XLSX bytes of the last export
+                'analytics_cache': OrderedDict(), # (data_version, as_of) -> livestock analytics
+                'feed_balances_cache': {}, # backend -> {'balances', 'loaded_at'}
+                'search_index': None, # Item/Category search index, synced to the latest data version
+                'submissions': OrderedDict(), # submission key -> completed form/API submission (idempotency)
+                'validation_cache': {}, # (backend, partition_key) -> {'digest', 'valid_positions', 'quarantine', 'verdicts'}
+                'records_backend': None, # backend the records were last read from
+                'submissions_pruned_at': 0.0,
+            }
+        _tenant_states.move_to_end(tenant_id)
+        while len(_tenant_states) > MAX_ACTIVE_TENANTS:
+            evicted_id, _ = _tenant_states.popitem(last=False)
+            print(f"--- DEBUG: tenant_state: Evicted cached state of farm {evicted_id}.")
+    return state
+
+def get_sheets_client():
+    """Returns the current farm's pooled Google Sheets client, creating or refreshing it when needed."""
+    state = tenant_state()
+    with state['lock']:
+        if state['client'] is None or time.time() - state['client_created_at'] > SHEETS_CLIENT_MAX_AGE_SECONDS:
+            client = init_google_sheets_client()
+            if client is None:
+                return None
+            state['client'] = client
+            state['client_created_at'] = time.time()
+            state['spreadsheets'] = {}
+        return state['client']
+
+def open_spreadsheet(client, sheet_id):
+    """Opens a spreadsheet, reusing the handle opened earlier with the same pooled client."""
+    state = tenant_state()
+    if client is not state['client']:
+        return client.open_by_key(sheet_id)
+    with state['lock']:
+        spreadsheet = state['spreadsheets'].get(sheet_id)
+    if spreadsheet is None:
+        spreadsheet = client.open_by_key(sheet_id)
+        with state['lock']:
+            state['spreadsheets'][sheet_id] = spreadsheet
+    return spreadsheet
 
 
 # --- Google Sheets Integration ---
+class SheetsApiRedirectSession(requests.Session):
+    """A requests session that sends Google Sheets API calls to GOOGLE_SHEETS_API_URL."""
+    def request(self, method, url, *args, **kwargs):
+        if url.startswith(GOOGLE_SHEETS_API_ORIGIN):
+            url = GOOGLE_SHEETS_API_URL + url[len(GOOGLE_SHEETS_API_ORIGIN):]
+        return super().request(method, url, *args, **kwargs)
+
 def init_google_sheets_client():
     """
     Initializes Google Sheets client by reconstructing the service account key
     from individual environment variables. This is suitable for cloud deployments.
     """
     print("--- DEBUG: init_google_sheets_client: Attempting to initialize Google Sheets client...")
+    if GOOGLE_SHEETS_API_URL:
+        print(f"--- DEBUG: init_google_sheets_client: Using the Sheets API stand-in at {GOOGLE_SHEETS_API_URL}.")
+        return gspread.Client(None, session=SheetsApiRedirectSession())
 
     service_account_info = {}
     env_vars_to_check = [
@@ -109,8 +334,8 @@ def init_google_sheets_client():
 def get_sheet(client, sheet_id):
     """Gets a specific worksheet using the spreadsheet ID."""
     try:
-        # Open the spreadsheet by ID
-        spreadsheet = client.open_by_key(sheet_id)
+        # Open the spreadsheet by ID (pooled per farm)
+        spreadsheet = open_spreadsheet(client, sheet_id)
         # Get the first worksheet (default)
         worksheet = spreadsheet.sheet1
         print(f"--- DEBUG: get_sheet: Successfully opened sheet with ID: {sheet_id}")
@@ -132,6 +357,44 @@ def append_to_sheet(sheet, data):
         print(f"--- DEBUG: append_to_sheet: ERROR: Error appending data to sheet: {e}")
         return False
 
+def get_worksheet(client, sheet_id, title, create=False, headers=None):
+    """Gets a worksheet by title, optionally creating it (with a header row) when it does not exist."""
+    try:
+        spreadsheet = open_spreadsheet(client, sheet_id)
+        try:
+            return spreadsheet.worksheet(title)
+        except gspread.exceptions.WorksheetNotFound:
+            if not create:
+                print(f"--- DEBUG: get_worksheet: Worksheet '{title}' not found.")
+                return None
+            worksheet = spreadsheet.add_worksheet(title=title, rows=1000, cols=max(len(headers or []), 1))
+            if headers:
+                worksheet.append_row(headers)
+            print(f"--- DEBUG: get_worksheet: Created worksheet '{title}'.")
+            return worksheet
+    except Exception as e:
+        print(f"--- DEBUG: get_worksheet: ERROR: Failed to open worksheet '{title}' in sheet {sheet_id}: {e}")
+        return None
+
+def overwrite_worksheet(worksheet, rows):
+    """
+    Replaces a worksheet's contents with rows. The new rows are written over the old ones before the
+    rows left below them are deleted, so a failed call never leaves the worksheet empty.
+    """
+    worksheet.update('A1', rows)
+    if worksheet.row_count > len(rows):
+        worksheet.delete_rows(len(rows) + 1, worksheet.row_count)
+
+def append_rows_to_sheet(sheet, rows):
+    """Appends several rows to the Google Sheet in a single API call."""
+    try:
+        sheet.append_rows(rows)
+        print(f"--- DEBUG: append_rows_to_sheet: Successfully appended {len(rows)} rows to Google Sheet.")
+        return True
+    except Exception as e:
+        print(f"--- DEBUG: append_rows_to_sheet: ERROR: Error appending rows to sheet: {e}")
+        return False
+
 # --- CSV Helper Functions ---
 def read_records_from_csv(file_path):
     """Reads all records from a CSV file and returns as a list of dictionaries."""
@@ -163,394 +426,3179 @@ def write_records_to_csv(file_path, records_df):
         print(f"--- DEBUG: write_records_to_csv: ERROR writing CSV file {file_path}: {e}")
         return False
 
-# --- Helper Functions for Data (Interacts with Google Sheets and CSV) ---
-def save_record(record_type, data):
-    """Saves a record to the Google Sheet and optionally to CSV."""
-    
-    # Attempt to save to Google Sheet first
-    google_sheet_success = False
-    client = init_google_sheets_client()
-    if client:
-        sheet = get_sheet(client, GOOGLE_SHEET_ID)
-        if sheet:
-            # Define the order of columns as expected in the Google Sheet
-            ordered_headers = ['Date', 'Type', 'Category', 'Item', 'Quantity', 'Unit', 'Amount', 'Profit Per Unit', 'Total Profit']
-            row_data = [data.get(header.replace(' ', '_').lower(), '') for header in ordered_headers]
-
-            google_sheet_success = append_to_sheet(sheet, row_data)
-            if not google_sheet_success:
-                flash("Failed to add record to Google Sheet. Check server logs.", "danger")
+def append_records_to_csv(file_path, records, columns=None):
+    """
+    Appends records to a CSV file in one write, writing the header first if the file is new.
+    columns defaults to the farm record columns.
+    """
+    try:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        fieldnames = columns or CSV_COLUMNS
+        if os.path.exists(file_path) and os.path.getsize(file_path) > 0:
+            # Keep the existing file's column order
+            with open(file_path, mode='r', newline='', encoding='utf-8') as csvfile:
+                fieldnames = next(csv.reader(csvfile), None) or fieldnames
+            write_header = False
+        else:
+            write_header = True
+        with open(file_path, mode='a', newline='', encoding='utf-8') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=fieldnames, restval='', extrasaction='ignore')
+            if write_header:
+                writer.writeheader()
+            for data in records:
+                writer.writerow({col: data.get(col.replace(' ', '_').lower(), '') for col in fieldnames})
+        print(f"--- DEBUG: append_records_to_csv: Appended {len(records)} records to {file_path}.")
+        return True
+    except Exception as e:
+        print(f"--- DEBUG: append_records_to_csv: ERROR appending to CSV file {file_path}: {e}")
+        return False
+
+# --- Cross-Process Locks ---
+# Lock files created with O_EXCL and holding the holder's pid, so gunicorn workers of one machine
+# serialize their writes. A lock left behind by a worker that died is taken over.
+_held_file_locks = threading.local()
+
+@contextlib.contextmanager
+def file_lock(path, timeout=None):
+    """
+    Holds the lock file at path for the duration of the with block; re-entrant within a thread.
+    Raises TimeoutError if another worker still holds it after timeout (default FILE_LOCK_TIMEOUT_SECONDS) seconds.
+    """
+    held = getattr(_held_file_locks, 'paths', None)
+    if held is None:
+        held = _held_file_locks.paths = {}
+    if path in held:
+        held[path] += 1
+        try:
+            yield
+        finally:
+            held[path] -= 1
+        return
+
+    deadline = time.monotonic() + (FILE_LOCK_TIMEOUT_SECONDS if timeout is None else timeout)
+    while True:
+        try:
+            descriptor = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                with open(path, 'r', encoding='utf-8') as lock_file:
+                    holder = int(lock_file.read().strip() or 0)
+            except (OSError, ValueError):
+                holder = 0
+            if holder and not process_is_alive(holder):
+                print(f"--- DEBUG: file_lock: Taking over {path} from exited worker {holder}.")
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                continue
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Lock {path} is held by process {holder or 'unknown'}.")
+            time.sleep(0.05)
+    with os.fdopen(descriptor, 'w', encoding='utf-8') as lock_file:
+        lock_file.write(str(os.getpid()))
+    held[path] = 1
+    try:
+        yield
+    finally:
+        del held[path]
+        os.remove(path)
+
+def records_write_lock(backend):
+    """Lock taken by everything that writes a backend's record partitions or its manifest."""
+    os.makedirs(current_tenant()['partition_dir'], exist_ok=True)
+    return file_lock(os.path.join(current_tenant()['partition_dir'], f"records_{backend}.lock"))
+
+# --- Record Caches ---
+# Raw records per partition, the Google manifest, and normalized frames keyed by data version.
+# The caches themselves live in each farm's tenant_state().
+_cache_lock = threading.RLock()
+
+def records_digest(records):
+    """Returns a short content hash of a list of record dictionaries."""
+    payload = json.dumps(records, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+def partition_source_stamp(backend, key, entry):
+    """
+    Returns a cheap freshness stamp for a partition: the file's (mtime, size) for CSV, so every
+    worker sees another worker's writes, ('archived', generation) for read-only archives, and None
+    for Google (which is refreshed by RECORDS_CACHE_TTL_SECONDS instead). An archived partition is
+    only rewritten by compaction, which bumps its manifest generation. Local history archives change
+    when more rows are compacted, so they are revalidated by file like CSV.
+    """
+    if entry.get('history') and backend != 'google':
+        try:
+            file_stat = os.stat(history_archive_path(backend, key[len(HISTORY_PARTITION_PREFIX):]))
+            return (file_stat.st_mtime_ns, file_stat.st_size)
+        except OSError:
+            return 'missing'
+    if entry.get('archived') and not entry.get('history'):
+        return ('archived', entry.get('generation', 0))
+    if backend == 'csv':
+        try:
+            file_stat = os.stat(partition_file_path(key, entry))
+            return (file_stat.st_mtime_ns, file_stat.st_size)
+        except OSError:
+            return 'missing'
+    return None
+
+def get_partition_records_cached(backend, key, entry, client=None):
+    """
+    Returns (records, digest, fetched) for a partition, reading it from the source only when the
+    cached copy is stale. Record keys are canonicalized once here rather than on every read.
+    A partition rewritten by another worker (new manifest generation) is always read again.
+    """
+    stamp = partition_source_stamp(backend, key, entry)
+    generation = entry.get('generation', 0)
+    partition_cache = tenant_state()['partition_cache']
+    with _cache_lock:
+        cached = partition_cache.get((backend, key))
+    if (cached and cached['stamp'] == stamp and cached['generation'] == generation
+            and (stamp is not None or time.time() - cached['loaded_at'] < RECORDS_CACHE_TTL_SECONDS)):
+        return cached['records'], cached['digest'], False
+
+    records = canonicalize_record_keys(read_partition_records(backend, key, entry, client))
+    digest = records_digest(records)
+    with _cache_lock:
+        partition_cache[(backend, key)] = {'records': records, 'digest': digest, 'stamp': stamp,
+                                           'generation': generation, 'loaded_at': time.time()}
+    return records, digest, True
+
+def invalidate_partition_cache(backend, key=None):
+    """Drops cached records for one partition (or all partitions of a backend) after a write."""
+    partition_cache = tenant_state()['partition_cache']
+    with _cache_lock:
+        for cache_key in list(partition_cache):
+            if cache_key[0] == backend and (key is None or cache_key[1] == key):
+                del partition_cache[cache_key]
+
+def get_cached_frame(data_version, copy=True):
+    """
+    Returns the normalized DataFrame cached for data_version, or None.
+    With copy=False the cached frame itself is returned and must not be modified.
+    """
+    frame_cache = tenant_state()['frame_cache']
+    with _cache_lock:
+        cached = frame_cache.get(data_version)
+        if cached is None:
+            return None
+        frame_cache.move_to_end(data_version)
+    if not copy:
+        return cached['df']
+    df = cached['df'].copy()
+    df.attrs['data_version'] = data_version
+    df.attrs['loaded_at'] = cached['loaded_at']
+    return df
+
+def store_cached_frame(data_version, df):
+    """Caches a normalized DataFrame under its data version, evicting the least recently used."""
+    loaded_at = datetime.utcnow().replace(microsecond=0)
+    df.attrs['data_version'] = data_version
+    df.attrs['loaded_at'] = loaded_at
+    frame_cache = tenant_state()['frame_cache']
+    with _cache_lock:
+        frame_cache[data_version] = {'df': df.copy(), 'loaded_at': loaded_at}
+        frame_cache.move_to_end(data_version)
+        while len(frame_cache) > FRAME_CACHE_SIZE:
+            frame_cache.popitem(last=False)
+    return df
+
+# --- Conditional Responses and Compression ---
+def records_etag(df, template_name, *extra):
+    """
+    Builds the ETag of a page rendered from df: the record data version, the template file's
+    modification time (so a deploy invalidates it) and anything else the page depends on.
+    Returns None when the frame carries no data version.
+    """
+    data_version = df.attrs.get('data_version')
+    if not data_version:
+        return None
+    try:
+        template_mtime = os.path.getmtime(os.path.join(current_app.root_path, current_app.template_folder, template_name)) if template_name else 0
+    except OSError:
+        template_mtime = 0
+    parts = [data_version, str(template_name), str(template_mtime)] + [str(part) for part in extra]
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()[:24]
+
+def conditional_response(etag, last_modified, render):
+    """
+    Answers 304 Not Modified when the client's cached copy matches etag (or last_modified),
+    otherwise calls render() and tags the response. Pending flash messages always force a render
+    so they are not left in the session.
+    """
+    if etag is None:
+        return render()
+    if not session.get('_flashes'):
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains_weak(etag)
+        else:
+            not_modified = bool(request.if_modified_since and last_modified and last_modified <= request.if_modified_since.replace(tzinfo=None))
+        if not_modified:
+            print(f"--- DEBUG: conditional_response: 304 Not Modified for {request.path}")
+            response = make_response('', 304)
+            response.set_etag(etag, weak=True)
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+
+    response = make_response(render())
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    # Pages sit behind the login, so only the user's browser may cache them, and must revalidate
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def compress_response_body(response):
+    """Compresses large text responses with brotli (when installed) or gzip, per Accept-Encoding."""
+    if response.status_code != 200 or response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return response
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    accept_encoding = request.headers.get('Accept-Encoding', '').lower()
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    if brotli is not None and 'br' in accept_encoding:
+        response.set_data(brotli.compress(data, quality=5))
+        response.headers['Content-Encoding'] = 'br'
+    elif 'gzip' in accept_encoding:
+        response.set_data(gzip.compress(data, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+# --- Partitioned Record Storage ---
+# Column order of a record row in a worksheet and in a partition CSV file.
+RECORD_HEADERS = ['Date', 'Type', 'Category', 'Item', 'Quantity', 'Unit', 'Amount', 'Profit Per Unit', 'Total Profit']
+CSV_COLUMNS = [header.replace(' ', '_').lower() for header in RECORD_HEADERS]
+# 'profit_per_unit', 'Profit Per Unit', 'profitperunit' ... -> 'Profit Per Unit'
+CANONICAL_HEADER_LOOKUP = {header.replace(' ', '').lower(): header for header in RECORD_HEADERS}
+
+def canonicalize_record_keys(records):
+    """
+    Renames the keys of raw records to RECORD_HEADERS where they only differ in case, spaces or
+    underscores, so partitions written by different code paths line up when concatenated.
+    """
+    if not records:
+        return records
+    key_map = {}
+    for key in records[0].keys():
+        normalized = str(key).replace(' ', '').replace('_', '').lower()
+        key_map[key] = CANONICAL_HEADER_LOOKUP.get(normalized, key)
+    if all(key == new_key for key, new_key in key_map.items()):
+        return records
+    return [{key_map.get(key, key): value for key, value in record.items()} for record in records]
+
+def partition_key_for_date(date_value):
+    """
+    Returns the partition key a record date belongs to ('2025' when partitioning by year,
+    '2025-06' by month). Records without a usable date stay in the legacy partition.
+    """
+    if RECORD_PARTITIONING not in ('year', 'month'):
+        return LEGACY_PARTITION_KEY
+    timestamp = pd.to_datetime(date_value, errors='coerce')
+    if pd.isna(timestamp):
+        return LEGACY_PARTITION_KEY
+    return timestamp.strftime('%Y' if RECORD_PARTITIONING == 'year' else '%Y-%m')
+
+def partition_bounds(key):
+    """Returns the (first_day, last_day) Timestamps covered by a partition key, or (None, None) for legacy."""
+    if key == LEGACY_PARTITION_KEY:
+        return None, None
+    if is_summary_partition(key):
+        key = key[len(SUMMARY_PARTITION_PREFIX):]
+    if len(key) == 4:
+        return pd.Timestamp(f"{key}-01-01"), pd.Timestamp(f"{key}-12-31")
+    start = pd.Timestamp(f"{key}-01")
+    return start, start + pd.offsets.MonthEnd(0)
+
+def partition_overlaps(entry, start_date=None, end_date=None):
+    """
+    Checks whether a manifest entry can hold records between start_date and end_date (inclusive).
+    Entries without a known date range are always read.
+    """
+    if not entry.get('min_date') or not entry.get('max_date'):
+        return True
+    if start_date is not None and pd.Timestamp(entry['max_date']) < pd.Timestamp(start_date).normalize():
+        return False
+    if end_date is not None and pd.Timestamp(entry['min_date']) > pd.Timestamp(end_date).normalize():
+        return False
+    return True
+
+def widen_manifest_range(entry, date_value):
+    """Extends an entry's min/max dates to include date_value. Returns True if the entry changed."""
+    timestamp = pd.to_datetime(date_value, errors='coerce')
+    if pd.isna(timestamp):
+        return False
+    day = timestamp.strftime('%Y-%m-%d')
+    changed = False
+    if not entry.get('min_date') or day < entry['min_date']:
+        entry['min_date'] = day
+        changed = True
+    if not entry.get('max_date') or day > entry['max_date']:
+        entry['max_date'] = day
+        changed = True
+    return changed
+
+def partition_storage_name(backend, key):
+    """Returns the worksheet title (Google) or file name (CSV) that stores a partition."""
+    if key == LEGACY_PARTITION_KEY:
+        return 'sheet1' if backend == 'google' else CSV_FILE_NAME
+    if is_summary_partition(key):
+        year = key[len(SUMMARY_PARTITION_PREFIX):]
+        return f"Summary {year}" if backend == 'google' else f"summary_{year}.csv"
+    return f"Records {key}" if backend == 'google' else f"records_{key}.csv"
+
+def partition_file_path(key, entry):
+    """Returns the local CSV file that stores a partition."""
+    if key == LEGACY_PARTITION_KEY:
+        return current_tenant()['csv_file_path']
+    return os.path.join(current_tenant()['partition_dir'], entry['storage'])
+
+def partition_archive_path(backend, key, generation=0):
+    """
+    Local gzip archive of a compacted partition. Each backend keeps its own archives, and each rewrite
+    (generation) its own file, so an instance holding an older archive rebuilds it from the live storage.
+    """
+    suffix = f"_g{generation}" if generation else ''
+    return os.path.join(current_tenant()['partition_dir'], f"archive_{backend}_{key}{suffix}.csv.gz")
+
+def load_partition_manifest(backend, client=None, fresh=False):
+    """
+    Loads the partition manifest: {key: {'storage', 'min_date', 'max_date', 'archived', 'generation'}}.
+    Google keeps it in the 'Partitions' worksheet so all workers share it; CSV in partitions/manifest.json.
+    The legacy partition (sheet1 / farm_records.csv) is always present. Writers holding the
+    records_write_lock() pass fresh=True to skip the cached Google copy; a fresh read raises when the
+    manifest exists but cannot be read, rather than returning one with only the legacy partition.
+    """
+    if backend == 'google' and not fresh:
+        with _cache_lock:
+            cached = tenant_state()['manifest_cache'].get(backend)
+        if cached and time.time() - cached['loaded_at'] < RECORDS_CACHE_TTL_SECONDS:
+            # Callers mutate entries, so hand out copies
+            return {key: dict(entry) for key, entry in cached['manifest'].items()}
+
+    manifest = {}
+    if backend == 'google':
+        if fresh:
+            try:
+                worksheet = open_spreadsheet(client, current_tenant()['sheet_id']).worksheet(PARTITION_MANIFEST_WORKSHEET)
+            except gspread.exceptions.WorksheetNotFound:
+                worksheet = None
         else:
-            flash(f"Could not open Google Sheet with ID '{GOOGLE_SHEET_ID}'. Check server logs.", "danger")
+            worksheet = get_worksheet(client, current_tenant()['sheet_id'], PARTITION_MANIFEST_WORKSHEET)
+        if worksheet:
+            try:
+                for row in worksheet.get_all_records():
+                    if not str(row.get('Key', '')).strip():
+                        continue # Blank rows left below the manifest
+                    manifest[str(row.get('Key'))] = {
+                        'storage': row.get('Worksheet', ''),
+                        'min_date': str(row.get('Min Date', '') or ''),
+                        'max_date': str(row.get('Max Date', '') or ''),
+                        'archived': str(row.get('Archived', '')).lower() == 'true',
+                        'generation': int(row.get('Generation') or 0),
+                    }
+            except Exception as e:
+                print(f"--- DEBUG: load_partition_manifest: ERROR reading manifest worksheet: {e}")
+                if fresh:
+                    raise
     else:
-        flash("Google Sheets client could not be initialized. Check server logs.", "danger")
-    
-    # If Google Sheet failed AND CSV fallback is enabled, or if CSV fallback is just enabled, save to CSV
-    if not google_sheet_success and USE_CSV_FALLBACK:
-        flash("Google Sheet save failed. Attempting to save to local CSV (data may not persist).", "warning")
-    
-    csv_success = False
-    if USE_CSV_FALLBACK:
-        # Prepare data for CSV
-        df = pd.DataFrame([data])
-        # Add missing columns with empty strings to ensure consistent CSV schema
-        csv_columns = ['date', 'type', 'category', 'item', 'quantity', 'unit', 'amount', 'profit_per_unit', 'total_profit']
-        for col in csv_columns:
-            if col not in df.columns:
-                df[col] = ''
-        df = df[csv_columns] # Reorder columns for consistency
-
-        # Read existing CSV, append new data, and write back
-        existing_records_df = pd.DataFrame(read_records_from_csv(CSV_FILE_PATH))
-        
-        # Check if existing_records_df is empty and align columns for concatenation
-        if existing_records_df.empty:
-            final_df = df
+        manifest_path = os.path.join(current_tenant()['partition_dir'], PARTITION_MANIFEST_FILE_NAME)
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path, 'r', encoding='utf-8') as manifest_file:
+                    manifest = json.load(manifest_file)
+            except Exception as e:
+                print(f"--- DEBUG: load_partition_manifest: ERROR reading {manifest_path}: {e}")
+                if fresh:
+                    raise
+    manifest.setdefault(LEGACY_PARTITION_KEY, {
+        'storage': partition_storage_name(backend, LEGACY_PARTITION_KEY),
+        'min_date': '', 'max_date': '', 'archived': False,
+    })
+    if backend == 'google':
+        with _cache_lock:
+            tenant_state()['manifest_cache'][backend] = {'manifest': {key: dict(entry) for key, entry in manifest.items()}, 'loaded_at': time.time()}
+    return manifest
+
+def save_partition_manifest(backend, manifest, client=None):
+    """Persists the partition manifest for the given backend."""
+    try:
+        if backend == 'google':
+            worksheet = get_worksheet(client, current_tenant()['sheet_id'], PARTITION_MANIFEST_WORKSHEET, create=True,
+                                      headers=PARTITION_MANIFEST_HEADERS)
+            if not worksheet:
+                return False
+            rows = [PARTITION_MANIFEST_HEADERS] + [
+                [key, entry['storage'], entry.get('min_date', ''), entry.get('max_date', ''),
+                 str(entry.get('archived', False)).upper(), entry.get('generation', 0)]
+                for key, entry in sorted(manifest.items())
+            ]
+            # Never cleared first: a manifest read mid-save must not look like a legacy-only one
+            overwrite_worksheet(worksheet, rows)
+            with _cache_lock:
+                tenant_state()['manifest_cache'][backend] = {'manifest': {key: dict(entry) for key, entry in manifest.items()}, 'loaded_at': time.time()}
         else:
-            # Align columns before concat, fill missing with empty strings
-            missing_in_existing = set(df.columns) - set(existing_records_df.columns)
-            for col in missing_in_existing:
-                existing_records_df[col] = ''
-            
-            missing_in_new = set(existing_records_df.columns) - set(df.columns)
-            for col in missing_in_new:
-                df[col] = ''
-            
-            # Ensure order before concatenation
-            existing_records_df = existing_records_df[list(df.columns)]
-            final_df = pd.concat([existing_records_df, df], ignore_index=True)
-
-        csv_success = write_records_to_csv(CSV_FILE_PATH, final_df)
-        if csv_success:
-            flash("Record also saved to local CSV.", "info")
+            os.makedirs(current_tenant()['partition_dir'], exist_ok=True)
+            manifest_path = os.path.join(current_tenant()['partition_dir'], PARTITION_MANIFEST_FILE_NAME)
+            # Write to a temporary file and rename so readers never see a half-written manifest
+            temp_path = manifest_path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as manifest_file:
+                json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+            os.replace(temp_path, manifest_path)
+        return True
+    except Exception as e:
+        print(f"--- DEBUG: save_partition_manifest: ERROR saving {backend} manifest: {e}")
+        return False
+
+def read_partition_records(backend, key, entry, client=None):
+    """
+    Reads the raw records of one partition as a list of dictionaries.
+    Archived partitions are served from their local read-only archive; if the archive is missing
+    (e.g. a fresh instance) it is rebuilt from the live storage. History entries read the compacted
+    detail rows of a year.
+    """
+    if entry.get('history'):
+        return read_history_archive(backend, key[len(HISTORY_PARTITION_PREFIX):], client)
+    if entry.get('archived'):
+        archive_path = partition_archive_path(backend, key, entry.get('generation', 0))
+        if os.path.exists(archive_path):
+            try:
+                archived = pd.read_csv(archive_path, dtype=str, keep_default_na=False, compression='gzip')
+                print(f"--- DEBUG: read_partition_records: Read {len(archived)} records from archive {archive_path}.")
+                return archived.to_dict(orient='records')
+            except Exception as e:
+                print(f"--- DEBUG: read_partition_records: ERROR reading archive {archive_path}: {e}")
+
+    records = []
+    if backend == 'google':
+        if key == LEGACY_PARTITION_KEY:
+            worksheet = get_sheet(client, current_tenant()['sheet_id'])
         else:
-            flash("Failed to save record to local CSV.", "danger")
+            worksheet = get_worksheet(client, current_tenant()['sheet_id'], entry['storage'])
+        if worksheet:
+            records = worksheet.get_all_records()
+    else:
+        file_path = partition_file_path(key, entry)
+        records = read_records_from_csv(file_path)
 
-    return google_sheet_success or csv_success # Return true if either save method succeeded
+    if entry.get('archived') and records:
+        write_partition_archive(backend, key, records, entry.get('generation', 0))
+    return records
 
-def get_safe_sum(df_filtered, col_name):
+def write_partition_archive(backend, key, records, generation=0):
+    """Writes a partition's records to its gzip-compressed, read-only archive file."""
+    archive_path = partition_archive_path(backend, key, generation)
+    try:
+        os.makedirs(current_tenant()['partition_dir'], exist_ok=True)
+        pd.DataFrame(records).to_csv(archive_path, index=False, encoding='utf-8', compression='gzip')
+        print(f"--- DEBUG: write_partition_archive: Archived {len(records)} records of partition {key} to {archive_path}.")
+        return True
+    except Exception as e:
+        print(f"--- DEBUG: write_partition_archive: ERROR writing archive {archive_path}: {e}")
+        return False
+
+def read_records_for_range(backend, start_date=None, end_date=None, client=None, detail=False):
     """
-    Safely sums a column from a filtered DataFrame slice.
-    Ensures the column is numeric and handles empty slices.
+    Reads the records of every partition overlapping [start_date, end_date] (None means unbounded).
+    With detail=True compacted years are read from their history archives instead of their summary rows.
+    Returns (records, locators, data_version, fetched) where each locator is 'partition_key:position'
+    and identifies the row inside its partition, so edits can be routed back to the right worksheet
+    or file. data_version changes whenever any of the partitions read changes, and fetched tells
+    whether anything had to be read from the source rather than the cache.
+    """
+    manifest = load_partition_manifest(backend, client)
+    records, locators, digests = [], [], []
+    manifest_changed = False
+    fetched = False
+    for key in sorted(manifest, key=lambda k: (k != LEGACY_PARTITION_KEY, k)):
+        entry = manifest[key]
+        if not partition_overlaps(entry, start_date, end_date):
+            print(f"--- DEBUG: read_records_for_range: Pruned partition {key} ({entry.get('min_date')} to {entry.get('max_date')}).")
+            continue
+        if detail and is_summary_partition(key):
+            key = HISTORY_PARTITION_PREFIX + key[len(SUMMARY_PARTITION_PREFIX):]
+            entry = dict(entry, history=True)
+        try:
+            partition_records, digest, partition_fetched = get_partition_records_cached(backend, key, entry, client)
+        except Exception as e:
+            print(f"--- DEBUG: read_records_for_range: ERROR reading partition {key}: {e}")
+            raise
+        fetched = fetched or partition_fetched
+        if key == LEGACY_PARTITION_KEY and partition_records and not entry.get('min_date'):
+            # Learn the legacy sheet's date range once so later reads can prune it too
+            for record in partition_records:
+                manifest_changed = widen_manifest_range(entry, record.get('Date')) or manifest_changed
+        # Quarantined rows are left out; locators keep each row's position within its partition
+        valid_positions = validate_partition(backend, key, partition_records, digest)
+        if len(valid_positions) == len(partition_records):
+            records.extend(partition_records)
+        else:
+            records.extend(partition_records[position] for position in valid_positions)
+        locators.extend(f"{key}:{position}" for position in valid_positions)
+        digests.append(f"{key}={digest}")
+    if manifest_changed:
+        # Merge into the latest manifest, which another worker may have changed since it was read
+        try:
+            with records_write_lock(backend):
+                latest = load_partition_manifest(backend, client, fresh=True)
+                for bound in ('min_date', 'max_date'):
+                    widen_manifest_range(latest[LEGACY_PARTITION_KEY], manifest[LEGACY_PARTITION_KEY].get(bound))
+                save_partition_manifest(backend, latest, client)
+        except TimeoutError as e:
+            print(f"--- DEBUG: read_records_for_range: Legacy date range not saved, records are being written: {e}")
+    with _cache_lock:
+        tenant_state()['records_backend'] = backend
+    data_version = hashlib.sha1(f"{current_tenant()['id']}|{backend}|v{RECORD_VALIDATION_VERSION}|{'|'.join(digests)}".encode('utf-8')).hexdigest()[:16]
+    return records, locators, data_version, fetched
+
+def append_partition_record(backend, data, client=None):
+    """
+    Routes a new record to the partition of its date, creating the partition (worksheet or file)
+    and its manifest entry on first use. Archived partitions are read-only.
+    """
+    return append_partition_records(backend, [data], client)
+
+def append_partition_records(backend, records, client=None):
+    """
+    Appends a batch of records, grouped by partition so each partition costs one write
+    (one append_rows call for Google). Fails without writing if any target partition is archived.
+    Holds the backend's records_write_lock(), so compaction never rewrites a partition mid-append.
     """
-    # Check if the filtered DataFrame is empty or if the column doesn't exist
-    if df_filtered.empty or col_name not in df_filtered.columns:
-        return 0.0
-    
-    # Now that we know df_filtered is not empty and col_name exists,
-    # proceed with numeric conversion and sum
     try:
-        # Ensure the column is numeric and fill NaN before summing
-        # pd.to_numeric handles converting various types (strings, numbers) to numeric.
-        numeric_series = pd.to_numeric(df_filtered[col_name], errors='coerce').fillna(0)
-        # .sum() on a numeric Series returns a numpy scalar, which float() can handle.
-        return float(numeric_series.sum())
+        with records_write_lock(backend):
+            manifest = load_partition_manifest(backend, client, fresh=True)
+            batches = OrderedDict()
+            for data in records:
+                batches.setdefault(partition_key_for_date(data.get('date')), []).append(data)
+            for key in batches:
+                if manifest.get(key, {}).get('archived'):
+                    print(f"--- DEBUG: append_partition_records: Partition {key} is archived (read-only); records not saved.")
+                    return False
+
+            success = True
+            manifest_changed = False
+            for key, batch in batches.items():
+                entry = manifest.get(key)
+                if entry is None:
+                    entry = manifest[key] = {'storage': partition_storage_name(backend, key), 'min_date': '', 'max_date': '', 'archived': False}
+                    manifest_changed = True
+
+                if backend == 'google':
+                    if key == LEGACY_PARTITION_KEY:
+                        worksheet = get_sheet(client, current_tenant()['sheet_id'])
+                    else:
+                        worksheet = get_worksheet(client, current_tenant()['sheet_id'], entry['storage'], create=True, headers=RECORD_HEADERS)
+                    if not worksheet:
+                        success = False
+                        break
+                    rows = [[data.get(header.replace(' ', '_').lower(), '') for header in RECORD_HEADERS] for data in batch]
+                    batch_success = append_to_sheet(worksheet, rows[0]) if len(rows) == 1 else append_rows_to_sheet(worksheet, rows)
+                else:
+                    batch_success = append_records_to_csv(partition_file_path(key, entry), batch)
+                invalidate_partition_cache(backend, key)
+                if not batch_success:
+                    success = False
+                    break
+                for data in batch:
+                    manifest_changed = widen_manifest_range(entry, data.get('date')) or manifest_changed
+
+            if manifest_changed:
+                save_partition_manifest(backend, manifest, client)
+            if success:
+                compact_old_partitions(backend, manifest, client)
+            return success
     except Exception as e:
-        # This catch is for extremely unexpected cases,
-        # as pd.to_numeric on a valid Series/list should not raise a TypeError like this.
-        # It means the initial check or data structure is more complex than expected.
-        print(f"--- ERROR: get_safe_sum: Exception processing column '{col_name}': {e}")
-        return 0.0
+        print(f"--- DEBUG: append_partition_records: ERROR appending {backend} records: {e}")
+        return False
 
-def get_farm_statistics():
-    """Retrieves aggregated farm data for dashboard statistics from Google Sheets or CSV fallback."""
-    df = get_all_farm_records_df() # Use the unified data retrieval function
-    if df.empty:
-        print("--- DEBUG: get_farm_statistics: No records found for statistics.")
-        return {
-            'total_feeds_kg': 0.0,
-            'total_expenditure': 0.0,
-            'total_profit': 0.0,
-            'layers_eggs_sold_crates': 0.0,
-            'broilers_birds_sold': 0.0,
-            'goats_sold': 0.0,
-            'sheep_sold': 0.0
+def compact_old_partitions(backend, manifest, client=None):
+    """
+    Compacts partitions whose period ended more than PARTITION_ARCHIVE_AFTER_DAYS ago into
+    read-only gzip archives. Cheap when nothing qualifies: it only inspects the manifest.
+    """
+    cutoff = pd.Timestamp(datetime.now().date()) - timedelta(days=PARTITION_ARCHIVE_AFTER_DAYS)
+    archived_any = False
+    for key, entry in manifest.items():
+        if key == LEGACY_PARTITION_KEY or entry.get('archived'):
+            continue
+        _, period_end = partition_bounds(key)
+        if period_end is None or period_end >= cutoff:
+            continue
+        try:
+            records = read_partition_records(backend, key, entry, client)
+        except Exception as e:
+            print(f"--- DEBUG: compact_old_partitions: ERROR reading partition {key}: {e}")
+            continue
+        if write_partition_archive(backend, key, records, entry.get('generation', 0)):
+            entry['archived'] = True
+            archived_any = True
+    if archived_any:
+        save_partition_manifest(backend, manifest, client)
+    return archived_any
+
+def update_partition_record(backend, record_locator, updated_data, client=None, expected=None):
+    """
+    Updates the record identified by record_locator ('partition_key:position') in one backend.
+    If the new date belongs to another partition the row is moved there. Archived partitions are read-only.
+    expected is the record the edit was made against; if the row at that position no longer holds it
+    (another edit or a compaction moved the rows), nothing is written.
+    """
+    try:
+        with records_write_lock(backend):
+            key, position = record_locator.rsplit(':', 1)
+            position = int(position)
+            manifest = load_partition_manifest(backend, client, fresh=True)
+            entry = manifest.get(key)
+            if entry is None:
+                print(f"--- DEBUG: update_partition_record: Partition {key} not found in {backend} manifest.")
+                return False
+            if entry.get('archived'):
+                print(f"--- DEBUG: update_partition_record: Partition {key} is archived (read-only).")
+                return False
+            if is_summary_partition(key):
+                print(f"--- DEBUG: update_partition_record: Partition {key} holds compacted summary rows (read-only).")
+                return False
+            if expected is not None and not row_holds_record(read_partition_row(backend, key, entry, position, client), expected):
+                print(f"--- DEBUG: update_partition_record: Row {record_locator} no longer holds the edited record; not updated.")
+                return False
+
+            new_key = partition_key_for_date(updated_data.get('date'))
+            if key != LEGACY_PARTITION_KEY and new_key != key:
+                # The date moved the record into another period: append it there, then remove the old row
+                if not append_partition_record(backend, updated_data, client):
+                    return False
+                return delete_partition_row(backend, key, entry, position, client)
+
+            if backend == 'google':
+                worksheet = get_sheet(client, current_tenant()['sheet_id']) if key == LEGACY_PARTITION_KEY else get_worksheet(client, current_tenant()['sheet_id'], entry['storage'])
+                if not worksheet:
+                    return False
+                # Google Sheet rows are 1-indexed and the first row holds the headers
+                sheet_row = position + 2
+                row_values = [updated_data.get(header.replace(' ', '_').lower(), '') for header in RECORD_HEADERS]
+                range_name = f'A{sheet_row}:{chr(ord("A") + len(RECORD_HEADERS) - 1)}{sheet_row}'
+                worksheet.update(range_name, [row_values])
+                print(f"--- DEBUG: update_partition_record: Updated row {sheet_row} of worksheet '{entry['storage']}'.")
+            else:
+                file_path = partition_file_path(key, entry)
+                all_records_df = pd.DataFrame(read_records_from_csv(file_path), dtype=object) # object columns accept the edited numbers
+                if all_records_df.empty or not 0 <= position < len(all_records_df):
+                    print(f"--- DEBUG: update_partition_record: Position {position} out of bounds for {file_path} (size: {len(all_records_df)})")
+                    return False
+                for column_key, value in updated_data.items():
+                    # Find the actual column name in the DataFrame (which might have mixed casing or spaces)
+                    matched_cols = [col for col in all_records_df.columns if col.replace(' ', '_').lower() == column_key]
+                    if matched_cols:
+                        all_records_df.at[position, matched_cols[0]] = value
+                if not write_records_to_csv(file_path, all_records_df):
+                    return False
+            invalidate_partition_cache(backend, key)
+
+            if widen_manifest_range(entry, updated_data.get('date')):
+                save_partition_manifest(backend, manifest, client)
+            return True
+    except TimeoutError as e:
+        print(f"--- DEBUG: update_partition_record: ERROR waiting for the {backend} write lock: {e}")
+        return False
+
+def delete_partition_row(backend, key, entry, position, client=None):
+    """Removes one row (by position) from a partition's worksheet or file, under the backend's records_write_lock()."""
+    with records_write_lock(backend):
+        invalidate_partition_cache(backend, key)
+        if backend == 'google':
+            worksheet = get_sheet(client, current_tenant()['sheet_id']) if key == LEGACY_PARTITION_KEY else get_worksheet(client, current_tenant()['sheet_id'], entry['storage'])
+            if not worksheet:
+                return False
+            worksheet.delete_rows(position + 2)
+            return True
+        file_path = partition_file_path(key, entry)
+        all_records_df = pd.DataFrame(read_records_from_csv(file_path))
+        if not 0 <= position < len(all_records_df):
+            return False
+        return write_records_to_csv(file_path, all_records_df.drop(index=position))
+
+def read_partition_row(backend, key, entry, position, client=None):
+    """Reads the raw row at a position of a partition, or None if there is no such row."""
+    if backend == 'google':
+        worksheet = get_sheet(client, current_tenant()['sheet_id']) if key == LEGACY_PARTITION_KEY else get_worksheet(client, current_tenant()['sheet_id'], entry['storage'])
+        if not worksheet:
+            return None
+        values = worksheet.row_values(position + 2)
+        return dict(zip(worksheet.row_values(1), values)) if values else None
+    records = read_records_from_csv(partition_file_path(key, entry))
+    return records[position] if 0 <= position < len(records) else None
+
+def row_holds_record(row, expected):
+    """Checks that a raw row still holds the expected record: the same date, type and item."""
+    if row is None:
+        return False
+    row_columns, expected_columns = resolve_record_columns(row), resolve_record_columns(expected)
+    for header in ('Date', 'Type', 'Item'):
+        current = str(row.get(row_columns.get(header), '')).strip().lower()
+        wanted = str(expected.get(expected_columns.get(header), '')).strip().lower()
+        if header == 'Date':
+            current_day, wanted_day = pd.to_datetime(current, errors='coerce'), pd.to_datetime(wanted, errors='coerce')
+            if not (pd.isna(current_day) or pd.isna(wanted_day)):
+                current, wanted = current_day.strftime('%Y-%m-%d'), wanted_day.strftime('%Y-%m-%d')
+        if current != wanted:
+            return False
+    return True
+
+# --- Record Validation and Quarantine ---
+# Rows are validated when their partition is (re)read, not on every request: results are cached per
+# partition digest, and inside a changed partition only rows whose values were not seen before are checked.
+# Rows that fail are left out of the record frame (and so out of totals and reports) and listed in the
+# quarantine table, where an admin can fix them in place. Each result is also saved next to the partitions
+# (quarantine_<backend>_<key>.json), so every worker shares one verdict and one alert per partition version.
+# Only rows the record frame could never use are quarantined: a missing or unparseable date, or text in a
+# numeric column. Any Type is accepted, so legacy and free-text types keep counting as they always did.
+# Bump when the rules change so cached frames and snapshots built under the old rules are not reused.
+RECORD_VALIDATION_VERSION = 2
+# Standardized column names and the common variations (lowercase, no spaces) found in sheets
+RECORD_COLUMN_VARIATIONS = {
+    'Date': ['date', 'recorddate', 'transactiondate', 'timestamp'],
+    'Type': ['type', 'recordtype', 'recordkind', 'transactiontype'],
+    'Category': ['category', 'itemcategory', 'classification'],
+    'Item': ['item', 'description', 'product', 'detail'],
+    'Quantity': ['quantity', 'qty', 'amountbought', 'amountsold'],
+    'Unit': ['unit', 'uom', 'measure'],
+    'Amount': ['amount', 'expenditureamount', 'cost', 'totalcost', 'value'], # For expenditure
+    'Profit Per Unit': ['profitperunit', 'ppu', 'unitprofit', 'priceperunit'],
+    'Total Profit': ['totalprofit', 'profit', 'netsales', 'revenue']
+}
+VALIDATED_NUMERIC_COLUMNS = ['Quantity', 'Amount', 'Profit Per Unit', 'Total Profit']
+
+def resolve_record_columns(record):
+    """Maps standardized column names to the keys a raw record actually uses for them."""
+    normalized_keys = {str(key).lower().replace(' ', ''): key for key in record}
+    columns = {}
+    for header, variations in RECORD_COLUMN_VARIATIONS.items():
+        for variation in variations:
+            if variation in normalized_keys:
+                columns[header] = normalized_keys[variation]
+                break
+    return columns
+
+def validation_fields(record):
+    """Returns (columns, fields): the resolved columns of a partition and the keys of the values record_problems() checks."""
+    columns = resolve_record_columns(record)
+    return columns, [columns.get(header) for header in ['Date'] + VALIDATED_NUMERIC_COLUMNS]
+
+def validation_values(record, fields):
+    return tuple('' if field is None or record.get(field) is None else record.get(field) for field in fields)
+
+def record_problems(values, columns):
+    """
+    Checks one row's (Date, *VALIDATED_NUMERIC_COLUMNS) values and returns the reasons it fails,
+    or an empty list.
+    """
+    problems = []
+    date_text = str(values[0]).strip()
+    if 'Date' not in columns:
+        problems.append("The data source has no Date column.")
+    elif not date_text:
+        problems.append("Date is missing.")
+    elif pd.isna(pd.to_datetime(date_text, errors='coerce')):
+        problems.append(f"Date {date_text!r} is not a valid date.")
+    for header, value in zip(VALIDATED_NUMERIC_COLUMNS, values[1:]):
+        text = str(value).strip()
+        if text and pd.isna(pd.to_numeric(text, errors='coerce')):
+            problems.append(f"{header} {text!r} is not a number.")
+    return problems
+
+def quarantine_file_path(backend, key):
+    """Shared file holding the latest validation result of one partition."""
+    return os.path.join(current_tenant()['partition_dir'], f"quarantine_{backend}_{key}.json")
+
+def read_quarantine_file(backend, key):
+    """Reads a partition's shared validation result ({'version', 'digest', 'valid_positions', 'quarantine'}), or None."""
+    try:
+        with open(quarantine_file_path(backend, key), 'r', encoding='utf-8') as quarantine_file:
+            saved = json.load(quarantine_file)
+    except (OSError, ValueError):
+        return None
+    return saved if saved.get('version') == RECORD_VALIDATION_VERSION else None
+
+def write_quarantine_file(backend, key, digest, valid_positions, quarantine):
+    """Atomically saves a partition's validation result for the other workers."""
+    path = quarantine_file_path(backend, key)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(current_tenant()['partition_dir'], exist_ok=True)
+        with open(temp_path, 'w', encoding='utf-8') as quarantine_file:
+            json.dump({'version': RECORD_VALIDATION_VERSION, 'digest': digest, 'valid_positions': valid_positions,
+                       'quarantine': quarantine}, quarantine_file, default=str)
+        os.replace(temp_path, path)
+    except Exception as e:
+        print(f"--- DEBUG: write_quarantine_file: ERROR saving {path}: {e}")
+
+def validate_partition(backend, key, records, digest):
+    """
+    Returns the positions of a partition's rows that pass validation and records the others in the
+    quarantine table. Cached per partition digest, in memory and in the shared quarantine file; rows
+    whose checked values are unchanged since the partition's previous version reuse their earlier verdict.
+    """
+    validation_cache = tenant_state()['validation_cache']
+    with _cache_lock:
+        cached = validation_cache.get((backend, key))
+    if cached and cached['digest'] == digest:
+        return cached['valid_positions']
+
+    columns, fields = validation_fields(records[0] if records else {})
+    saved = read_quarantine_file(backend, key)
+    if saved and saved['digest'] == digest:
+        # Another worker already validated this version of the partition (and alerted about it)
+        with _cache_lock:
+            validation_cache[(backend, key)] = {
+                'digest': digest, 'valid_positions': saved['valid_positions'], 'quarantine': saved['quarantine'],
+                'verdicts': {validation_values(entry['record'], fields): entry['problems'] for entry in saved['quarantine']},
+            }
+        return saved['valid_positions']
+
+    if cached:
+        previous_verdicts = cached['verdicts']
+    else:
+        # Rows already quarantined in the previous version were alerted about then
+        previous_verdicts = {validation_values(entry['record'], fields): entry['problems'] for entry in (saved or {}).get('quarantine', [])}
+    verdicts = {}
+    valid_positions, quarantine = [], []
+    newly_failed = 0
+    for position, record in enumerate(records):
+        values = validation_values(record, fields)
+        problems = verdicts.get(values)
+        if problems is None:
+            problems = previous_verdicts.get(values)
+            if problems is None:
+                problems = record_problems(values, columns)
+                newly_failed += bool(problems)
+            verdicts[values] = problems
+        if problems:
+            quarantine.append({'locator': f"{key}:{position}", 'record': record, 'problems': problems})
+        else:
+            valid_positions.append(position)
+
+    with _cache_lock:
+        validation_cache[(backend, key)] = {
+            'digest': digest, 'valid_positions': valid_positions, 'quarantine': quarantine, 'verdicts': verdicts,
         }
+    write_quarantine_file(backend, key, digest, valid_positions, quarantine)
+    print(f"--- DEBUG: validate_partition: {backend} partition {key}: {len(valid_positions)} valid, {len(quarantine)} quarantined.")
+    if newly_failed:
+        notify(f"{newly_failed} record(s) failed validation and were quarantined. Review them under Quarantine.", "warning")
+    return valid_positions
 
-    # Columns are already converted to numeric (float) and lowercased for Type, Category, Item
-    # in get_all_farm_records_df.
-    # We still need to lowercase all columns that were not explicitly handled
-    # by renaming or initial lowercasing in get_all_farm_records_df
-    df.columns = [col.replace(' ', '_').lower() for col in df.columns]
+def get_quarantined_records():
+    """Returns the quarantine entries ({'locator', 'record', 'problems'}) of the backend records are read from."""
+    state = tenant_state()
+    with _cache_lock:
+        backend = state.get('records_backend')
+        entries = [(key, cached['quarantine']) for (cached_backend, key), cached in state['validation_cache'].items()
+                   if cached_backend == backend]
+    quarantined = []
+    for _, quarantine in sorted(entries, key=lambda item: (item[0] != LEGACY_PARTITION_KEY, item[0])):
+        quarantined.extend(quarantine)
+    return quarantined
 
-    # Ensure 'type' and 'category' columns exist and are lowercased for consistent filtering
-    # These are already handled in get_all_farm_records_df
-    # if 'type' in df.columns:
+def record_from_form(form):
+    """
+    Reads the edit form into the dictionary update_record_in_sheet() expects.
+    Returns (updated_data, error) where error is a message for the first invalid number, or None.
+    """
+    updated_data = {
+        'date': form['date'],
+        'type': form['type'],
+        'category': form['category'],
+        'item': form['item'],
+        'quantity': form.get('quantity', ''),
+        'unit': form.get('unit', ''),
+        'amount': form.get('amount', ''),
+        'profit_per_unit': form.get('profit_per_unit', ''),
+        'total_profit': form.get('total_profit', '')
+    }
+    for key in ['quantity', 'amount', 'profit_per_unit', 'total_profit']:
+        if updated_data[key]:
+            try:
+                # Keep quantity as float to preserve decimal values if they exist
+                updated_data[key] = float(updated_data[key])
+            except ValueError:
+                return updated_data, f"Invalid number for {key.replace('_', ' ').title()}. Please enter a valid number."
+        else:
+            updated_data[key] = '' # Ensure empty string for missing/invalid numeric fields
+
+    if updated_data.get('quantity') != '' and updated_data.get('profit_per_unit') != '':
+        updated_data['total_profit'] = updated_data['quantity'] * updated_data['profit_per_unit']
+    return updated_data, None
+
+# --- History Compaction ---
+# A background job moves detail rows older than COMPACTION_HORIZON_DAYS out of the live storage. They go
+# to a per-year history: a 'History <year>' worksheet for Google, so they live as long as the sheet, and a
+# local archive (partitions/history_csv_<year>.csv.gz) for the CSV. In their place, a
+# 'Summary <year>' worksheet (summary_<year>.csv) gets one row per day, type, category, item and unit,
+# holding the summed quantity, amount and total profit. Totals, daily series and reports stay the same.
+# Pages that list individual rows can pass detail=True, which reads the archives instead of the summaries.
+COMPACTION_HORIZON_DAYS = int(os.environ.get('COMPACTION_HORIZON_DAYS', '730'))
+SUMMARY_PARTITION_PREFIX = 'summary-'
+HISTORY_PARTITION_PREFIX = 'history-'
+SUMMED_COLUMNS = ['Quantity', 'Amount', 'Total Profit']
+HISTORY_WORKSHEET_PREFIX = 'History '
+COMPACTION_LOCK_FILE_NAME = 'compaction.lock'
+
+def is_summary_partition(key):
+    return key.startswith(SUMMARY_PARTITION_PREFIX)
+
+def history_archive_path(backend, year):
+    """Local gzip archive holding the compacted detail rows of one year (CSV backend)."""
+    return os.path.join(current_tenant()['partition_dir'], f"history_{backend}_{year}.csv.gz")
+
+def history_worksheet_name(year):
+    """Worksheet holding the compacted Google detail rows of one year."""
+    return f"{HISTORY_WORKSHEET_PREFIX}{year}"
+
+def read_history_archive(backend, year, client=None):
+    """Reads the archived detail rows of a year, or an empty list if nothing was compacted for it yet."""
+    if backend == 'google':
+        worksheet = get_worksheet(client, current_tenant()['sheet_id'], history_worksheet_name(year))
+        return worksheet.get_all_records() if worksheet else []
+    path = history_archive_path(backend, year)
+    if not os.path.exists(path):
+        return []
+    archived = pd.read_csv(path, dtype=str, keep_default_na=False, compression='gzip')
+    print(f"--- DEBUG: read_history_archive: Read {len(archived)} records from {path}.")
+    return archived.to_dict(orient='records')
+
+def summarize_records(rows):
+    """
+    Rolls detail rows (RECORD_HEADERS keys) up to one row per day, type, category, item and unit.
+    Quantity, Amount and Total Profit are summed, so rows that are already summaries can be folded in again.
+    """
+    groups = {}
+    for row in rows:
+        day = str(row.get('Date', '')).strip()[:10]
+        group_key = (day,) + tuple(str(row.get(header, '')).strip().lower() for header in ('Type', 'Category', 'Item', 'Unit'))
+        summary = groups.get(group_key)
+        if summary is None:
+            summary = groups[group_key] = {
+                'Date': day, 'Type': group_key[1],
+                'Category': str(row.get('Category', '')).strip(),
+                'Item': str(row.get('Item', '')).strip(),
+                'Unit': str(row.get('Unit', '')).strip(),
+                'Quantity': None, 'Amount': None, 'Total Profit': None,
+            }
+        for header in SUMMED_COLUMNS:
+            text = str(row.get(header, '')).strip()
+            if text:
+                summary[header] = (summary[header] or 0.0) + float(text)
+
+    summaries = []
+    for group_key in sorted(groups):
+        summary = groups[group_key]
+        for header in SUMMED_COLUMNS:
+            summary[header] = '' if summary[header] is None else round(summary[header], 6)
+        # An average, so the total stays quantity x price per unit
+        quantity, total_profit = summary['Quantity'], summary['Total Profit']
+        summary['Profit Per Unit'] = round(total_profit / quantity, 4) if quantity and total_profit != '' else ''
+        summaries.append(summary)
+    return summaries
+
+def rewrite_partition_rows(backend, key, entry, header, rows, client=None):
+    """
+    Replaces all rows (lists in header order) of a partition's worksheet or file, and of its archive if it has one.
+    Bumps the entry's generation, so other workers drop their cached copy once the manifest is saved.
+    """
+    if backend == 'google':
+        if key == LEGACY_PARTITION_KEY:
+            worksheet = get_sheet(client, current_tenant()['sheet_id'])
+        else:
+            worksheet = get_worksheet(client, current_tenant()['sheet_id'], entry['storage'], create=True, headers=header)
+        if not worksheet:
+            return False
+        overwrite_worksheet(worksheet, [header] + rows)
+    elif not write_records_to_csv(partition_file_path(key, entry), pd.DataFrame(rows, columns=header)):
+        return False
+    invalidate_partition_cache(backend, key)
+    previous_generation = entry.get('generation', 0)
+    entry['generation'] = previous_generation + 1
+    if entry.get('archived'):
+        write_partition_archive(backend, key, [dict(zip(header, row)) for row in rows], entry['generation'])
+        stale_archive = partition_archive_path(backend, key, previous_generation)
+        if os.path.exists(stale_archive):
+            os.remove(stale_archive)
+    return True
+
+def split_compactable_rows(raw_records, cutoff):
+    """
+    Splits a partition's rows into (kept raw rows, {year: detail rows}) where the detail rows are the valid
+    rows dated before cutoff, with RECORD_HEADERS keys. Quarantined rows always stay where they are.
+    """
+    records = canonicalize_record_keys(raw_records)
+    columns, fields = validation_fields(records[0])
+    date_field = columns.get('Date')
+    if date_field is None:
+        return list(raw_records), {}
+    days = pd.to_datetime(pd.Series([str(record.get(date_field, '')).strip() for record in records], dtype=object),
+                          errors='coerce', format='mixed')
+    kept, moved = [], {}
+    for raw, record, day in zip(raw_records, records, days):
+        if pd.isna(day) or day.normalize() >= cutoff or record_problems(validation_values(record, fields), columns):
+            kept.append(raw)
+            continue
+        detail = {header: '' if columns.get(header) is None else record.get(columns[header], '') for header in RECORD_HEADERS}
+        detail['Date'] = day.strftime('%Y-%m-%d')
+        moved.setdefault(day.strftime('%Y'), []).append(detail)
+    return kept, moved
+
+def compact_partition(backend, manifest, key, cutoff, client=None):
+    """
+    Moves one partition's detail rows older than cutoff into the yearly history and summary partitions.
+    Returns (rows moved, {summary partition: row count}). The detail rows are written to the history first
+    (appended to the Google history worksheets, staged next to the local archives), and the partition is only
+    shortened after that succeeded. Local archives are committed once the summaries and the shortened partition
+    have been written; on failure the appended history rows are removed and the summaries restored.
+    """
+    entry = manifest[key]
+    raw_records = read_partition_records(backend, key, entry, client)
+    if not raw_records:
+        return 0, {}
+    kept, moved = split_compactable_rows(raw_records, cutoff)
+    if not moved:
+        return 0, {}
+
+    summary_header = RECORD_HEADERS if backend == 'google' else CSV_COLUMNS
+    staged_archives, appended_history, previous_summaries = {}, {}, {}
+    summary_rows = {}
+    try:
+        os.makedirs(current_tenant()['partition_dir'], exist_ok=True)
+        for year, details in moved.items():
+            if backend == 'google':
+                worksheet = get_worksheet(client, current_tenant()['sheet_id'], history_worksheet_name(year),
+                                          create=True, headers=RECORD_HEADERS)
+                if not worksheet:
+                    raise RuntimeError(f"Could not open the history worksheet of {year}.")
+                first_row = len(worksheet.get_all_values()) + 1
+                worksheet.append_rows([[row[header] for header in RECORD_HEADERS] for row in details])
+                appended_history[year] = (worksheet, first_row, first_row + len(details) - 1)
+                continue
+            staged_archives[year] = f"{history_archive_path(backend, year)}.{os.getpid()}.tmp"
+            pd.DataFrame(read_history_archive(backend, year) + details, columns=RECORD_HEADERS).to_csv(
+                staged_archives[year], index=False, encoding='utf-8', compression='gzip')
+
+        for year, details in moved.items():
+            summary_key = SUMMARY_PARTITION_PREFIX + year
+            summary_entry = manifest.get(summary_key) or {
+                'storage': partition_storage_name(backend, summary_key), 'min_date': '', 'max_date': '', 'archived': False,
+            }
+            existing = canonicalize_record_keys(read_partition_records(backend, summary_key, summary_entry, client)) if summary_key in manifest else []
+            previous_summaries[summary_key] = (summary_entry, existing)
+            summaries = summarize_records(existing + details)
+            if not rewrite_partition_rows(backend, summary_key, summary_entry,
+                                          summary_header, [[row[header] for header in RECORD_HEADERS] for row in summaries], client):
+                raise RuntimeError(f"Could not write summary partition {summary_key}.")
+            manifest[summary_key] = summary_entry
+            for row in summaries:
+                widen_manifest_range(summary_entry, row['Date'])
+            summary_rows[summary_key] = len(summaries)
+
+        header = list(raw_records[0].keys())
+        if not rewrite_partition_rows(backend, key, entry, header, [[raw.get(column, '') for column in header] for raw in kept], client):
+            raise RuntimeError(f"Could not remove the compacted rows from partition {key}.")
+    except Exception:
+        for summary_key, (summary_entry, existing) in previous_summaries.items():
+            try:
+                rewrite_partition_rows(backend, summary_key, summary_entry, summary_header,
+                                       [[row.get(header, '') for header in RECORD_HEADERS] for row in existing], client)
+            except Exception as e:
+                print(f"--- DEBUG: compact_partition: ERROR restoring summary partition {summary_key}: {e}")
+            if not existing:
+                manifest.pop(summary_key, None)
+        for year, (worksheet, first_row, last_row) in appended_history.items():
+            try:
+                worksheet.delete_rows(first_row, last_row)
+            except Exception as e:
+                print(f"--- DEBUG: compact_partition: ERROR removing appended rows {first_row}-{last_row} of history {year}: {e}")
+        for staged_path in staged_archives.values():
+            if os.path.exists(staged_path):
+                os.remove(staged_path)
+        raise
+
+    for year, staged_path in staged_archives.items():
+        os.replace(staged_path, history_archive_path(backend, year))
+    for year in moved:
+        invalidate_partition_cache(backend, HISTORY_PARTITION_PREFIX + year)
+    if not kept and key != LEGACY_PARTITION_KEY:
+        # Nothing left in this period; a later record for it creates the partition again
+        del manifest[key]
+        leftovers = [partition_archive_path(backend, key, entry.get('generation', 0)), quarantine_file_path(backend, key)] + ([partition_file_path(key, entry)] if backend == 'csv' else [])
+        for path in leftovers:
+            if os.path.exists(path):
+                os.remove(path)
+    else:
+        entry['min_date'] = entry['max_date'] = ''
+        for raw in kept:
+            widen_manifest_range(entry, canonicalize_record_keys([raw])[0].get('Date'))
+    moved_count = sum(len(details) for details in moved.values())
+    print(f"--- DEBUG: compact_partition: Moved {moved_count} {backend} rows of partition {key} into history ({sum(summary_rows.values())} summary rows).")
+    return moved_count, summary_rows
+
+def compact_history(backend, cutoff, client=None, progress=None):
+    """
+    Compacts every partition of a backend that holds rows dated before cutoff.
+    Returns (rows moved, rows now in the summary partitions that were written).
+    """
+    manifest = load_partition_manifest(backend, client)
+    cutoff_day = cutoff.strftime('%Y-%m-%d')
+    candidates = [key for key, entry in manifest.items()
+                  if not is_summary_partition(key) and not (entry.get('min_date') and entry['min_date'] >= cutoff_day)]
+    moved_total, summary_rows = 0, {}
+    for index, key in enumerate(sorted(candidates, key=lambda k: (k != LEGACY_PARTITION_KEY, k))):
+        # One partition at a time under the write lock, so appends and edits only wait for that rewrite
+        with records_write_lock(backend):
+            manifest = load_partition_manifest(backend, client, fresh=True)
+            moved, partition_summary_rows = compact_partition(backend, manifest, key, cutoff, client) if key in manifest else (0, {})
+            if moved:
+                moved_total += moved
+                summary_rows.update(partition_summary_rows)
+                save_partition_manifest(backend, manifest, client)
+        if progress:
+            progress((index + 1) / len(candidates))
+    return moved_total, sum(summary_rows.values())
+
+def compact_all_history(cutoff=None, progress=None):
+    """
+    Runs history compaction for the Google Sheet and the local CSV, for rows dated before cutoff
+    (default: COMPACTION_HORIZON_DAYS ago). One compaction per farm runs at a time. Returns a summary message.
+    """
+    cutoff = pd.Timestamp(cutoff).normalize() if cutoff is not None else pd.Timestamp(datetime.now().date()) - timedelta(days=COMPACTION_HORIZON_DAYS)
+    os.makedirs(current_tenant()['partition_dir'], exist_ok=True)
+    lock_path = os.path.join(current_tenant()['partition_dir'], COMPACTION_LOCK_FILE_NAME)
+    with contextlib.ExitStack() as held_locks:
+        try:
+            held_locks.enter_context(file_lock(lock_path, timeout=0))
+        except TimeoutError:
+            raise RuntimeError("Another history compaction is already running for this farm.")
+        results = []
+        client = get_sheets_client()
+        if client:
+            results.append(('Google Sheet', compact_history('google', cutoff, client, progress)))
+        if USE_CSV_FALLBACK:
+            results.append(('local CSV', compact_history('csv', cutoff)))
+    if not results:
+        raise RuntimeError("No record storage is available to compact.")
+    return f"Rows dated before {cutoff.strftime('%Y-%m-%d')}: " + '; '.join(
+        f"{source}: {moved} moved to the history archive ({summaries} summary rows)" for source, (moved, summaries) in results)
+
+# --- Helper Functions for Data (Interacts with Google Sheets and CSV) ---
+def save_record(record_type, data):
+    """
+    Saves a record to the Google Sheet and optionally to CSV.
+    The record is routed to the partition (worksheet / CSV file) of its date.
+    """
+    
+    # Attempt to save to Google Sheet first
+    google_sheet_success = False
+    client = get_sheets_client()
+    if client:
+        google_sheet_success = append_partition_record('google', data, client)
+        if not google_sheet_success:
+            notify("Failed to add record to Google Sheet. Check server logs.", "danger")
+    else:
+        notify("Google Sheets client could not be initialized. Check server logs.", "danger")
+    
+    # If Google Sheet failed AND CSV fallback is enabled, or if CSV fallback is just enabled, save to CSV
+    if not google_sheet_success and USE_CSV_FALLBACK:
+        notify("Google Sheet save failed. Attempting to save to local CSV (data may not persist).", "warning")
+    
+    csv_success = False
+    if USE_CSV_FALLBACK:
+        csv_success = append_partition_record('csv', data)
+        if csv_success:
+            notify("Record also saved to local CSV.", "info")
+        else:
+            notify("Failed to save record to local CSV.", "danger")
+
+    return google_sheet_success or csv_success # Return true if either save method succeeded
+
+def save_records(records):
+    """
+    Saves a batch of records to the Google Sheet and optionally to CSV,
+    with one write per partition instead of one per record.
+    """
+    google_sheet_success = False
+    client = get_sheets_client()
+    if client:
+        google_sheet_success = append_partition_records('google', records, client)
+        if not google_sheet_success:
+            notify("Failed to add records to Google Sheet. Check server logs.", "danger")
+    else:
+        notify("Google Sheets client could not be initialized. Check server logs.", "danger")
+
+    csv_success = False
+    if USE_CSV_FALLBACK:
+        csv_success = append_partition_records('csv', records)
+        if not csv_success:
+            notify("Failed to save records to local CSV.", "danger")
+
+    return google_sheet_success or csv_success
+
+def profit_unit_for_item(item):
+    """Returns the unit of a sales record: crates for eggs, birds for birds, units otherwise."""
+    return 'crates' if 'Eggs' in item else ('birds' if 'Birds' in item else 'units')
+
+def get_safe_sum(df_filtered, col_name):
+    """
+    Safely sums a column from a filtered DataFrame slice.
+    Ensures the column is numeric and handles empty slices.
+    """
+    # Check if the filtered DataFrame is empty or if the column doesn't exist
+    if df_filtered.empty or col_name not in df_filtered.columns:
+        return 0.0
+    
+    # Now that we know df_filtered is not empty and col_name exists,
+    # proceed with numeric conversion and sum
+    try:
+        # Ensure the column is numeric and fill NaN before summing
+        # pd.to_numeric handles converting various types (strings, numbers) to numeric.
+        numeric_series = pd.to_numeric(df_filtered[col_name], errors='coerce').fillna(0)
+        # Accumulate in float64 even for float32 columns so long sums don't drift.
+        return float(numeric_series.to_numpy(dtype='float64').sum())
+    except Exception as e:
+        # This catch is for extremely unexpected cases,
+        # as pd.to_numeric on a valid Series/list should not raise a TypeError like this.
+        # It means the initial check or data structure is more complex than expected.
+        print(f"--- ERROR: get_safe_sum: Exception processing column '{col_name}': {e}")
+        return 0.0
+
+# --- Record Frame Dtypes ---
+# Low-cardinality text columns are stored as categoricals so filters compare
+# small integer codes instead of Python strings row by row.
+CATEGORICAL_COLUMNS = ['Type', 'Category', 'Item', 'Unit']
+# Quantities and unit prices fit comfortably in float32; money totals stay float64
+# so large sums keep their cents.
+FLOAT32_COLUMNS = ['Quantity', 'Profit Per Unit']
+FLOAT64_COLUMNS = ['Amount', 'Total Profit']
+# float32 values are widened and rounded to this many decimals before display/export
+FLOAT32_DISPLAY_DECIMALS = 4
+
+def optimize_record_dtypes(df):
+    """
+    Converts a normalized records DataFrame to its compact representation:
+    categorical dtypes for low-cardinality text columns and float32 where precision allows.
+    """
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].fillna('').astype(str).astype('category')
+    for col in FLOAT32_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype('float32')
+    for col in FLOAT64_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype('float64')
+    return df
+
+def category_mask(series, value):
+    """
+    Returns a boolean mask of rows equal to `value`.
+    For categorical columns the comparison is done on the integer category codes.
+    """
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return series == value
+    try:
+        code = series.cat.categories.get_loc(value)
+    except KeyError:
+        # Value never occurs in this frame, so nothing can match
+        return pd.Series(False, index=series.index)
+    return pd.Series(series.cat.codes.to_numpy() == code, index=series.index)
+
+def display_frame(df):
+    """
+    Returns a shallow copy of `df` suitable for templates and exports:
+    float32 columns are widened to float64 and rounded so 0.1 doesn't render as 0.10000000149.
+    """
+    out = df.copy(deep=False)
+    for col in FLOAT32_COLUMNS:
+        if col in out.columns:
+            out[col] = out[col].astype('float64').round(FLOAT32_DISPLAY_DECIMALS)
+    return out
+
+def frame_to_records(df):
+    """Converts a records DataFrame to a list of dictionaries for rendering."""
+    return display_frame(df).to_dict(orient='records')
+
+def get_farm_statistics():
+    """Retrieves aggregated farm data for dashboard statistics from Google Sheets or CSV fallback."""
+    df = get_all_farm_records_df() # Use the unified data retrieval function
+    if df.empty:
+        print("--- DEBUG: get_farm_statistics: No records found for statistics.")
+        return {
+            'total_feeds_kg': 0.0,
+            'total_expenditure': 0.0,
+            'total_profit': 0.0,
+            'layers_eggs_sold_crates': 0.0,
+            'broilers_birds_sold': 0.0,
+            'goats_sold': 0.0,
+            'sheep_sold': 0.0
+        }
+
+    # Columns are already converted to numeric (float) and lowercased for Type, Category, Item
+    # in get_all_farm_records_df.
+    # We still need to lowercase all columns that were not explicitly handled
+    # by renaming or initial lowercasing in get_all_farm_records_df
+    df.columns = [col.replace(' ', '_').lower() for col in df.columns]
+
+    # Ensure 'type' and 'category' columns exist and are lowercased for consistent filtering
+    # These are already handled in get_all_farm_records_df
+    # if 'type' in df.columns:
     #     df['type'] = df['type'].astype(str).str.lower()
     # if 'category' in df.columns:
     #     df['category'] = df['category'].astype(str).str.lower()
     # if 'item' in df.columns:
     #     df['item'] = df['item'].astype(str).str.lower()
 
-    stats = {
-        'total_feeds_kg': get_safe_sum(df[df['type'] == 'feed_input'], 'quantity'),
-        'total_expenditure': get_safe_sum(df[df['type'] == 'expenditure'], 'amount'),
-        'total_profit': get_safe_sum(df[df['type'] == 'profit'], 'total_profit'),
-        'layers_eggs_sold_crates': get_safe_sum(df[(df['type'] == 'profit') & (df['category'] == 'layers') & (df['item'] == 'eggs sold')], 'quantity'),
-        'broilers_birds_sold': get_safe_sum(df[(df['type'] == 'profit') & (df['category'] == 'broilers') & (df['item'] == 'birds sold')], 'quantity'),
-        'goats_sold': get_safe_sum(df[(df['type'] == 'profit') & (df['category'] == 'goats') & (df['item'] == 'goat meat')], 'quantity'),
-        'sheep_sold': get_safe_sum(df[(df['type'] == 'profit') & (df['category'] == 'sheep') & (df['item'] == 'sheep meat')], 'quantity'),
-    }
-    return stats
+    # Build each mask once on the category codes and combine them, instead of
+    # re-comparing the string columns for every statistic.
+    is_feed = category_mask(df['type'], 'feed_input')
+    is_expenditure = category_mask(df['type'], 'expenditure')
+    is_profit = category_mask(df['type'], 'profit')
+
+    def sold(category, item):
+        return df[is_profit & category_mask(df['category'], category) & category_mask(df['item'], item)]
+
+    stats = {
+        'total_feeds_kg': get_safe_sum(df[is_feed], 'quantity'),
+        'total_expenditure': get_safe_sum(df[is_expenditure], 'amount'),
+        'total_profit': get_safe_sum(df[is_profit], 'total_profit'),
+        'layers_eggs_sold_crates': get_safe_sum(sold('layers', 'eggs sold'), 'quantity'),
+        'broilers_birds_sold': get_safe_sum(sold('broilers', 'birds sold'), 'quantity'),
+        'goats_sold': get_safe_sum(sold('goats', 'goat meat'), 'quantity'),
+        'sheep_sold': get_safe_sum(sold('sheep', 'sheep meat'), 'quantity'),
+    }
+    return stats
+
+def get_all_farm_records_df(start_date=None, end_date=None, copy=True, detail=False):
+    """
+    Retrieves all farm records as a pandas DataFrame,
+    prioritizing local CSV, then falling back to Google Sheets.
+    When start_date/end_date are given, only partitions overlapping that range are read;
+    callers still filter rows to the exact range.
+    The DataFrame index holds each row's 'partition_key:position' locator.
+    Read-only callers may pass copy=False to get the cached frame without copying it.
+    Compacted years come back as summary rows unless detail=True asks for their archived detail rows.
+    """
+    print(f"--- DEBUG: get_all_farm_records_df: Called to retrieve farm records ({start_date} to {end_date}).")
+    
+    records = []
+    locators = []
+    data_version = None
+    fetched = False
+    source_failed = False # True when the records could not be read, as opposed to there being none
+    
+    # --- Step 1: Attempt to read from CSV first (new primary read source) ---
+    if USE_CSV_FALLBACK: # Only attempt CSV if the feature is enabled
+        print("--- DEBUG: get_all_farm_records_df: Attempting to read records from local CSV.")
+        records, locators, data_version, fetched = read_records_for_range('csv', start_date, end_date, detail=detail)
+        if records:
+            print(f"--- DEBUG: get_all_farm_records_df: Successfully retrieved {len(records)} records from local CSV.")
+            if fetched: # Only announce actual reads, not cache hits
+                notify("Records loaded from local CSV.", "info")
+            # If CSV has records, we'll process and return them.
+            # No need to try Google Sheets for reading in this path.
+        else:
+            print("--- DEBUG: get_all_farm_records_df: No records found in local CSV or CSV read failed.")
+            notify("No records found in local CSV. Attempting Google Sheet.", "info") # Inform user about fallback
+    else:
+        print("--- DEBUG: get_all_farm_records_df: CSV fallback disabled. Skipping CSV read.")
+
+
+    # --- Step 2: If CSV is empty or not used, attempt to retrieve from Google Sheets ---
+    if not records: # Only proceed to Google Sheets if no records were found from CSV
+        print("--- DEBUG: get_all_farm_records_df: Attempting to retrieve from Google Sheets.")
+        client = get_sheets_client()
+        if client:
+            try:
+                records, locators, data_version, fetched = read_records_for_range('google', start_date, end_date, client, detail)
+                if records:
+                    print(f"--- DEBUG: get_all_farm_records_df: Successfully retrieved {len(records)} records from Google Sheet.")
+                    if fetched: # Only announce actual reads, not cache hits
+                        notify("Records loaded from Google Sheet.", "success")
+                else:
+                    print("--- DEBUG: get_all_farm_records_df: Google Sheet is empty.")
+                    notify("No records found in the Google Sheet.", "info")
+            except Exception as e:
+                print(f"--- DEBUG: get_all_farm_records_df: ERROR retrieving records from Google Sheet: {e}")
+                notify("Error retrieving records from Google Sheet. Check server logs.", "danger")
+                source_failed = True
+        else:
+            notify("Google Sheets client could not be initialized for record retrieval.", "danger")
+            source_failed = True
+    else:
+        print("--- DEBUG: get_all_farm_records_df: Records already retrieved from CSV. Skipping Google Sheets read.")
+
+
+    if not records:
+        if source_failed:
+            # Keep pages working from the last snapshot while the sheet is unreachable
+            snapshot_df = load_latest_snapshot()
+            if snapshot_df is not None:
+                notify(f"Showing records from the snapshot taken at {snapshot_df.attrs['loaded_at']} UTC; the live data could not be read.", "warning")
+                return snapshot_df
+        print("--- DEBUG: get_all_farm_records_df: No records found from any source, returning empty DataFrame.")
+        return pd.DataFrame()
+
+    # Unchanged data is normalized once per data version
+    cached_df = get_cached_frame(data_version, copy)
+    if cached_df is not None:
+        print(f"--- DEBUG: get_all_farm_records_df: Returning cached frame for data version {data_version}.")
+        return cached_df
+
+    # The latest snapshot tracks the default (summarized) view of the records
+    full_read = start_date is None and end_date is None and not detail
+    if full_read:
+        # A cold worker can load the frame of this exact version from the latest snapshot instead of normalizing
+        snapshot_df = load_latest_snapshot(data_version)
+        if snapshot_df is not None:
+            print(f"--- DEBUG: get_all_farm_records_df: Bootstrapped data version {data_version} from snapshot.")
+            snapshot_df.attrs.pop('snapshot', None) # It matches the live data exactly
+            return store_cached_frame(data_version, snapshot_df)
+
+    df = pd.DataFrame(records, index=pd.Index(locators, name='locator'))
+    print(f"--- DEBUG: Initial DataFrame shape: {df.shape}")
+    print(f"--- DEBUG: Initial DataFrame columns (raw from source): {df.columns.tolist()}")
+    print(f"--- DEBUG: Initial DataFrame head:\n{df.head().to_string()}")
+
+    # Normalize existing column names to facilitate matching
+    normalized_df_columns = {col.lower().replace(' ', ''): col for col in df.columns}
+    
+    # Create a mapping from current actual column names to desired standardized names
+    column_renaming_dict = {}
+    final_columns = set() # To keep track of columns we actually want to keep/rename to
+
+    for desired_name, variations in RECORD_COLUMN_VARIATIONS.items():
+        found_match = False
+        for var in variations:
+            if var in normalized_df_columns:
+                original_matched_col = normalized_df_columns[var]
+                if original_matched_col != desired_name:
+                    column_renaming_dict[original_matched_col] = desired_name
+                else: # It's already the desired_name (case-sensitive)
+                    column_renaming_dict[original_matched_col] = desired_name # Ensure it's in the dict
+                found_match = True
+                final_columns.add(desired_name)
+                break
+        
+        # If a desired column is not found through variations or exact match
+        if not found_match and desired_name not in df.columns:
+            df[desired_name] = '' # Add as empty to prevent KeyError
+            final_columns.add(desired_name) # Add to final columns list
+            print(f"--- DEBUG: Critical column '{desired_name}' not found, added as empty.")
+
+
+    # Apply the renaming
+    if column_renaming_dict:
+        df.rename(columns=column_renaming_dict, inplace=True)
+    
+    # Reorder columns to a consistent display order (optional but good for consistency)
+    ordered_display_columns = [
+        'Date', 'Type', 'Category', 'Item', 'Quantity', 'Unit', 
+        'Amount', 'Profit Per Unit', 'Total Profit'
+    ]
+    
+    # Filter for columns that actually exist in the DataFrame (including newly added empty ones)
+    df_columns_as_set = set(df.columns)
+    columns_to_reorder = [col for col in ordered_display_columns if col in df_columns_as_set]
+    
+    # Add any original columns that weren't part of our standardized map to the end
+    for col in df.columns:
+        if col not in columns_to_reorder:
+            columns_to_reorder.append(col)
+
+    df = df[columns_to_reorder]
+    
+    print(f"--- DEBUG: After standardization and adding missing, DataFrame columns: {df.columns.tolist()}")
+    print(f"--- DEBUG: DataFrame head after column processing:\n{df.head().to_string()}")
+
+    # Normalize 'Type', 'Category', and 'Item' column values to lowercase for consistent filtering
+    if 'Type' in df.columns:
+        df['Type'] = df['Type'].astype(str).str.lower()
+        print("--- DEBUG: get_all_farm_records_df: 'Type' column values lowercased.")
+    
+    if 'Category' in df.columns:
+        df['Category'] = df['Category'].astype(str).str.lower()
+        print("--- DEBUG: get_all_farm_records_df: 'Category' column values lowercased.")
+    
+    if 'Item' in df.columns:
+        df['Item'] = df['Item'].astype(str).str.lower()
+        print("--- DEBUG: get_all_farm_records_df: 'Item' column values lowercased.")
+
+
+    # Missing or empty critical values were caught by validate_partition: those rows are in quarantine,
+    # so the frame needs no per-request data-quality scan.
+
+    # Ensure 'Date' column is in datetime format AFTER ensuring it exists and is named correctly
+    if 'Date' in df.columns:
+        print(f"--- DEBUG: 'Date' column dtype (before convert): {df['Date'].dtype}")
+        print(f"--- DEBUG: 'Date' column values (before convert, head):\n{df['Date'].head().to_string()}")
+
+        # Rows with unparseable dates were quarantined, but the validated dates may mix formats
+        # that a single inferred format can't parse
+        dates = pd.to_datetime(df['Date'], errors='coerce')
+        if dates.isna().any():
+            dates = pd.to_datetime(df['Date'], errors='coerce', format='mixed')
+        df['Date'] = dates
+        
+        print(f"--- DEBUG: After pd.to_datetime, 'Date' column dtype: {df['Date'].dtype}")
+        print(f"--- DEBUG: Count of NaT values in 'Date' column: {df['Date'].isna().sum()}")
+        df.dropna(subset=['Date'], inplace=True)
+
+    else:
+        print("--- DEBUG: 'Date' column still missing or invalid after all checks, returning empty DataFrame.")
+        notify("Error: Failed to establish a valid 'Date' column. Reports cannot be generated. Please ensure your Google Sheet/CSV has a column for dates (e.g., 'Date').", "danger")
+        return pd.DataFrame()
+
+    # Convert relevant numeric columns after date processing, as errors='coerce' might be needed
+    # for columns that might have mixed types from Google Sheets.
+    # Numeric columns become float32/float64 and the text columns categoricals.
+    df = optimize_record_dtypes(df)
+    # Lets pages offer the archived detail without scanning the index on every request
+    df.attrs['summary_rows'] = int(df.index.str.startswith(SUMMARY_PARTITION_PREFIX).sum())
+    
+    print(f"--- DEBUG: Final DataFrame shape being returned: {df.shape}")
+    print(f"--- DEBUG: Final DataFrame head being returned:\n{df.head().to_string()}")
+    df = store_cached_frame(data_version, df)
+    if full_read:
+        refresh_latest_snapshot(data_version)
+    return df
+
+def update_record_in_sheet(record_locator, updated_data_dict, expected=None):
+    """
+    Updates a specific record in the Google Sheet and optionally in local CSV.
+    record_locator is the 'partition_key:position' index label from get_all_farm_records_df(), and
+    expected the record found there, so a row that moved in the meantime is not overwritten.
+    """
+    google_sheet_success = False
+    
+    client = get_sheets_client()
+    if client:
+        try:
+            google_sheet_success = update_partition_record('google', record_locator, updated_data_dict, client, expected)
+            if google_sheet_success:
+                print(f"--- DEBUG: update_record_in_sheet: Successfully updated record {record_locator} in Google Sheet.")
+                notify('Record updated successfully in Google Sheet!', 'success')
+            else:
+                notify('Failed to update record in Google Sheet. Archived periods are read-only, and a record that changed meanwhile must be reopened. Check server logs.', 'danger')
+        except Exception as e:
+            print(f"--- DEBUG: update_record_in_sheet: ERROR updating Google Sheet record {record_locator}: {e}")
+            notify('Failed to update record in Google Sheet. Check server logs.', 'danger')
+    else:
+        notify("Google Sheets client could not be initialized for update. Check server logs.", "danger")
+
+    csv_success = False
+    if USE_CSV_FALLBACK:
+        if not google_sheet_success: # Only flash this warning if Google Sheet update failed
+            notify("Google Sheet update failed. Attempting to update local CSV (data may not persist).", "warning")
+        
+        csv_success = update_partition_record('csv', record_locator, updated_data_dict, expected=expected)
+        if csv_success:
+            notify("Record also updated in local CSV.", "info")
+        else:
+            notify("Could not update record in local CSV. It might not exist there yet, or its period is archived.", "warning")
+
+    return google_sheet_success or csv_success # Return true if either save method succeeded
+
+
+def build_records_workbook(df_records, progress=None):
+    """
+    Builds the styled 'Farm Records' XLSX workbook for a records DataFrame and returns its bytes.
+    progress, if given, is called with the fraction of rows written so far.
+    """
+    output = io.BytesIO()
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = "Farm Records"
+
+    headers = df_records.columns.tolist()
+    sheet.append(headers)
+
+    # Apply header styling
+    # Font and PatternFill need to be imported from openpyxl.styles
+    # Make sure these are imported at the top:
+    # from openpyxl.styles import Font, PatternFill, Alignment
+
+    header_font = Font(bold=True, color="FFFFFF")
+    header_fill = PatternFill(start_color="4CAF50", end_color="4CAF50", fill_type="solid")
+    header_alignment = Alignment(horizontal="center", vertical="center")
+
+    for col_idx, header in enumerate(headers, 1):
+        cell = sheet.cell(row=1, column=col_idx, value=header)
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.alignment = header_alignment
+
+    total_rows = len(df_records)
+    for r_idx, row in enumerate(display_frame(df_records).itertuples(index=False), 1):
+        sheet.append(list(row))
+        if progress and r_idx % 1000 == 0:
+            progress(r_idx / total_rows)
+
+    for column in sheet.columns:
+        max_length = 0
+        column_name = column[0].column_letter
+        for cell in column:
+            try:
+                if len(str(cell.value)) > max_length:
+                    max_length = len(str(cell.value))
+            except:
+                pass
+        adjusted_width = (max_length + 2)
+        sheet.column_dimensions[column_name].width = adjusted_width
+
+
+    workbook.save(output)
+    return output.getvalue()
+
+
+def build_report_workbook(df, progress=None):
+    """
+    Builds a long-range report workbook: a 'Monthly Summary' sheet (profit, expenditure, net, feed)
+    and a 'By Category' sheet, both aggregated with vectorized groupbys over the records frame.
+    """
+    month = df['Date'].dt.to_period('M').astype(str).rename('Month')
+    totals = pd.DataFrame({
+        'Month': month,
+        'Profit': df['Total Profit'].where(category_mask(df['Type'], 'profit'), 0.0),
+        'Expenditure': df['Amount'].where(category_mask(df['Type'], 'expenditure'), 0.0),
+        'Feed (kg)': df['Quantity'].astype('float64').where(category_mask(df['Type'], 'feed_input'), 0.0),
+    })
+    monthly_summary = totals.groupby('Month').sum().round(2).reset_index()
+    monthly_summary.insert(3, 'Net', (monthly_summary['Profit'] - monthly_summary['Expenditure']).round(2))
+    if progress:
+        progress(0.4)
+    by_category = (
+        df.assign(Month=month, Quantity=df['Quantity'].astype('float64'))
+        .groupby(['Month', 'Type', 'Category'], observed=True)[['Quantity', 'Amount', 'Total Profit']]
+        .sum()
+        .round(2)
+        .reset_index()
+    )
+    if progress:
+        progress(0.7)
+
+    output = io.BytesIO()
+    workbook = openpyxl.Workbook()
+    header_font = Font(bold=True, color="FFFFFF")
+    header_fill = PatternFill(start_color="4CAF50", end_color="4CAF50", fill_type="solid")
+    for sheet_index, (title, frame) in enumerate([("Monthly Summary", monthly_summary), ("By Category", by_category)]):
+        sheet = workbook.active if sheet_index == 0 else workbook.create_sheet()
+        sheet.title = title
+        sheet.append(frame.columns.tolist())
+        for cell in sheet[1]:
+            cell.font = header_font
+            cell.fill = header_fill
+        for row in frame.itertuples(index=False):
+            sheet.append(list(row))
+        for column in sheet.columns:
+            sheet.column_dimensions[column[0].column_letter].width = max(len(str(cell.value)) for cell in column) + 2
+    workbook.save(output)
+    return output.getvalue()
+
+# --- Background Jobs ---
+# Heavy exports and long-range reports run in a per-process thread pool instead of the request
+# thread. Job state is kept as JSON files in each farm's jobs directory so any gunicorn worker can report status
+# and serve the finished artifact.
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_RETENTION_HOURS = int(os.environ.get('JOB_RETENTION_HOURS', '24'))
+# Exports of more rows than this (without a cached workbook) are sent to the job runner
+EXPORT_SYNC_MAX_ROWS = int(os.environ.get('EXPORT_SYNC_MAX_ROWS', '5000'))
+JOB_KINDS = {'export': 'Records export', 'report': 'Long-range report', 'compact': 'History compaction'}
+# Directory (per farm) for job status files and artifacts
+JOBS_DIR_NAME = 'jobs'
+_job_executor = None
+_job_executor_lock = threading.Lock()
+
+def get_job_executor():
+    """Returns this process's job thread pool, creating it on first use."""
+    global _job_executor
+    with _job_executor_lock:
+        if _job_executor is None:
+            _job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='farm-job')
+        return _job_executor
+
+def job_status_path(job_id):
+    """Returns the status file path of a job. Rejects ids that are not plain hex."""
+    if not job_id or not all(char in '0123456789abcdef' for char in job_id):
+        raise ValueError(f"Invalid job id: {job_id!r}")
+    return os.path.join(current_tenant()['jobs_dir'], f"{job_id}.json")
+
+def read_job(job_id):
+    """Reads a job's status dictionary, or returns None if it doesn't exist."""
+    try:
+        with open(job_status_path(job_id), 'r', encoding='utf-8') as job_file:
+            return json.load(job_file)
+    except (OSError, ValueError):
+        return None
+
+def write_job(job):
+    """Atomically writes a job's status file."""
+    os.makedirs(current_tenant()['jobs_dir'], exist_ok=True)
+    path = job_status_path(job['id'])
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as job_file:
+        json.dump(job, job_file, indent=2)
+    os.replace(temp_path, path)
+
+def update_job(job, **changes):
+    """Applies changes to a job and persists them."""
+    job.update(changes)
+    write_job(job)
+    return job
+
+def process_is_alive(pid):
+    """Checks whether a process id is still running on this machine."""
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+def list_jobs():
+    """
+    Returns all jobs, newest first. Jobs whose worker process died are marked failed,
+    and jobs older than JOB_RETENTION_HOURS are deleted along with their artifacts.
+    """
+    jobs = []
+    if not os.path.isdir(current_tenant()['jobs_dir']):
+        return jobs
+    expiry = datetime.now() - timedelta(hours=JOB_RETENTION_HOURS)
+    for file_name in os.listdir(current_tenant()['jobs_dir']):
+        if not file_name.endswith('.json'):
+            continue
+        job = read_job(file_name[:-len('.json')])
+        if job is None:
+            continue
+        if datetime.fromisoformat(job['created_at']) < expiry and job['status'] in ('done', 'failed'):
+            delete_job_files(job)
+            continue
+        if job['status'] in ('queued', 'running') and not process_is_alive(job['pid']):
+            update_job(job, status='failed', message='Interrupted: the worker running this job exited.')
+        jobs.append(job)
+    return sorted(jobs, key=lambda job: job['created_at'], reverse=True)
+
+def delete_job_files(job):
+    """Removes a job's status file and artifact."""
+    for path in (job_status_path(job['id']), os.path.join(current_tenant()['jobs_dir'], job.get('artifact') or '')):
+        if os.path.isfile(path):
+            os.remove(path)
+
+def enqueue_job(kind, start_date=None, end_date=None, detail=False, data_version=None):
+    """
+    Creates a job record and submits it to the thread pool. Returns the job dictionary.
+    detail makes exports include the archived detail rows of compacted years; a compaction job
+    compacts rows dated before end_date (default: COMPACTION_HORIZON_DAYS ago). data_version records
+    which records an export was requested for, so find_export_job() can reuse it.
+    """
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unknown job kind: {kind!r}")
+    job = {
+        'id': uuid.uuid4().hex,
+        'kind': kind,
+        'label': JOB_KINDS[kind],
+        'start_date': start_date.strftime('%Y-%m-%d') if start_date is not None else None,
+        'end_date': end_date.strftime('%Y-%m-%d') if end_date is not None else None,
+        'detail': bool(detail),
+        'data_version': data_version,
+        'status': 'queued',
+        'progress': 0,
+        'message': 'Waiting for a free worker.',
+        'artifact': None,
+        'download_name': None,
+        'tenant': current_tenant()['id'],
+        'pid': os.getpid(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'finished_at': None,
+    }
+    write_job(job)
+    get_job_executor().submit(run_job, job['id'], job['tenant'])
+    print(f"--- DEBUG: enqueue_job: Queued {kind} job {job['id']} ({job['start_date']} to {job['end_date']}).")
+    return job
+
+def find_export_job(data_version, detail):
+    """
+    Returns the queued, running or finished full export of this farm's records at data_version
+    (with or without archived detail), or None. Callers hold the jobs directory's export lock.
+    """
+    for job in list_jobs():
+        if (job['kind'] == 'export' and job.get('data_version') == data_version and job.get('detail') == bool(detail)
+                and job.get('tenant') == current_tenant()['id'] and not job['start_date'] and not job['end_date']
+                and job['status'] in ('queued', 'running', 'done')):
+            if job['status'] == 'done' and not os.path.isfile(os.path.join(current_tenant()['jobs_dir'], job.get('artifact') or '')):
+                continue
+            return job
+    return None
+
+def run_job(job_id, tenant_id=DEFAULT_TENANT_ID):
+    """Runs one job in a pool thread for the given farm, reporting progress through its status file."""
+    set_current_tenant(tenant_id)
+    job = read_job(job_id)
+    if job is None:
+        return
+    try:
+        start_date = pd.Timestamp(job['start_date']) if job['start_date'] else None
+        end_date = pd.Timestamp(job['end_date']) if job['end_date'] else None
+        if job['kind'] == 'compact':
+            update_job(job, status='running', progress=5, message='Compacting old records...')
+            message = compact_all_history(end_date, lambda fraction: update_job(job, progress=5 + int(fraction * 90)))
+            update_job(job, status='done', progress=100, message=message, finished_at=datetime.now().isoformat(timespec='seconds'))
+            return
+        update_job(job, status='running', progress=5, message='Loading records...')
+        df = get_all_farm_records_df(start_date, end_date, detail=job.get('detail', False))
+        if not df.empty and (start_date is not None or end_date is not None):
+            df = filter_records(df, start_date, end_date)
+        if df.empty:
+            update_job(job, status='failed', progress=100, message='No records in the requested range.',
+                       finished_at=datetime.now().isoformat(timespec='seconds'))
+            return
+        update_job(job, progress=20, message=f'Building workbook from {len(df)} records...')
+
+        def progress(fraction):
+            # Only write when the visible percentage moves, not for every chunk
+            percent = 20 + int(fraction * 75)
+            if percent > job['progress']:
+                update_job(job, progress=percent)
+
+        if job['kind'] == 'export':
+            content = build_records_workbook(df, progress)
+            download_name = f'Farm_Records_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
+        else:
+            content = build_report_workbook(df, progress)
+            download_name = f'Farm_Report_{job["start_date"] or "start"}_to_{job["end_date"] or "today"}.xlsx'
+        artifact = f"{job['id']}.xlsx"
+        with open(os.path.join(current_tenant()['jobs_dir'], artifact), 'wb') as artifact_file:
+            artifact_file.write(content)
+        # The records may have changed since the job was queued; the artifact holds the version read here
+        update_job(job, status='done', progress=100, message=f'Ready: {len(df)} records.', artifact=artifact,
+                   download_name=download_name, data_version=df.attrs.get('data_version') or job.get('data_version'),
+                   finished_at=datetime.now().isoformat(timespec='seconds'))
+        print(f"--- DEBUG: run_job: Job {job_id} finished ({len(content)} bytes).")
+    except Exception as e:
+        print(f"--- DEBUG: run_job: ERROR in job {job_id}: {e}")
+        update_job(job, status='failed', message=f'Failed: {e}', finished_at=datetime.now().isoformat(timespec='seconds'))
+
+# --- Record Snapshots ---
+# Columnar copies of the normalized records frame (Parquet or Arrow IPC) carrying their schema and
+# data version. They are fast to reload, bootstrap cold workers, keep reports available when the
+# sheet cannot be reached, and can be read directly by offline analysis scripts.
+SNAPSHOT_DIR_NAME = 'snapshots'
+SNAPSHOT_FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+SNAPSHOT_COMPRESSION = os.environ.get('SNAPSHOT_COMPRESSION', 'zstd')
+SNAPSHOT_SCHEMA_VERSION = 1
+SNAPSHOT_METADATA_KEY = b'farm_snapshot'
+# The rolling snapshot of the latest full frame, used to bootstrap reads
+SNAPSHOT_LATEST_NAME = 'latest'
+SNAPSHOT_AUTO = os.environ.get('SNAPSHOT_AUTO', 'true').lower() == 'true'
+# Named snapshots kept per farm; older ones are deleted
+SNAPSHOT_RETENTION = int(os.environ.get('SNAPSHOT_RETENTION', '10'))
+
+def snapshot_path(name, snapshot_format='parquet'):
+    """Returns the file path of a snapshot. Rejects names that could escape the snapshot directory."""
+    if snapshot_format not in SNAPSHOT_FORMATS:
+        raise ValueError(f"Unknown snapshot format: {snapshot_format!r}")
+    if not name or not all(char.isalnum() or char in '_-' for char in name):
+        raise ValueError(f"Invalid snapshot name: {name!r}")
+    return os.path.join(current_tenant()['snapshot_dir'], name + SNAPSHOT_FORMATS[snapshot_format])
+
+def write_records_snapshot(df, snapshot_format='parquet', name=None):
+    """
+    Writes a normalized records frame (locator index included) to a compressed Parquet or Arrow file
+    with its data version and column dtypes in the schema metadata. Returns the snapshot metadata.
+    """
+    if pyarrow is None:
+        raise RuntimeError("Snapshots need the 'pyarrow' package. Install it with: pip install pyarrow")
+    created_at = datetime.utcnow().replace(microsecond=0)
+    data_version = df.attrs.get('data_version') or ''
+    name = name or f"records_{created_at.strftime('%Y%m%d_%H%M%S')}_{data_version[:8] or 'unversioned'}"
+    path = snapshot_path(name, snapshot_format)
+    metadata = {
+        'schema_version': SNAPSHOT_SCHEMA_VERSION,
+        'tenant': current_tenant()['id'],
+        'data_version': data_version,
+        'created_at': created_at.isoformat(),
+        'rows': int(len(df)),
+        'columns': {col: str(dtype) for col, dtype in df.dtypes.items()},
+    }
+    frame = df.copy(deep=False)
+    frame.attrs = {} # The version travels in the snapshot metadata instead
+    table = pyarrow.Table.from_pandas(frame, preserve_index=True)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), SNAPSHOT_METADATA_KEY: json.dumps(metadata).encode('utf-8')})
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + '.tmp'
+    if snapshot_format == 'parquet':
+        pyarrow.parquet.write_table(table, temp_path, compression=SNAPSHOT_COMPRESSION)
+    else:
+        pyarrow.feather.write_feather(table, temp_path, compression=SNAPSHOT_COMPRESSION)
+    os.replace(temp_path, path)
+    print(f"--- DEBUG: write_records_snapshot: Wrote {len(df)} records to {path}.")
+    return dict(metadata, name=name, format=snapshot_format, file_name=os.path.basename(path), size=os.path.getsize(path))
+
+def snapshot_format_of(path):
+    """Returns the snapshot format of a file from its extension, or None."""
+    for snapshot_format, extension in SNAPSHOT_FORMATS.items():
+        if path.endswith(extension):
+            return snapshot_format
+    return None
+
+def read_snapshot_metadata(path):
+    """Reads a snapshot's metadata from its schema without loading the data. Raises ValueError if it is not a snapshot."""
+    if pyarrow is None:
+        raise RuntimeError("Snapshots need the 'pyarrow' package. Install it with: pip install pyarrow")
+    snapshot_format = snapshot_format_of(path)
+    try:
+        if snapshot_format == 'parquet':
+            schema = pyarrow.parquet.read_schema(path)
+        else:
+            with pyarrow.memory_map(path) as source:
+                schema = pyarrow.ipc.open_file(source).schema
+    except Exception as e:
+        raise ValueError(f"Not a readable Parquet/Arrow file: {e}")
+    raw = (schema.metadata or {}).get(SNAPSHOT_METADATA_KEY)
+    if not raw:
+        raise ValueError("The file has no farm snapshot metadata.")
+    metadata = json.loads(raw)
+    if metadata.get('schema_version') != SNAPSHOT_SCHEMA_VERSION:
+        raise ValueError(f"Unsupported snapshot schema version {metadata.get('schema_version')}.")
+    missing = [header for header in RECORD_HEADERS if header not in metadata.get('columns', {})]
+    if missing:
+        raise ValueError(f"The snapshot is missing columns: {', '.join(missing)}.")
+    name = os.path.basename(path)[:-len(SNAPSHOT_FORMATS[snapshot_format])]
+    return dict(metadata, name=name, format=snapshot_format, file_name=os.path.basename(path), size=os.path.getsize(path))
+
+def read_records_snapshot(path):
+    """Loads a snapshot back into a normalized records frame carrying its data version in attrs."""
+    metadata = read_snapshot_metadata(path)
+    if metadata['format'] == 'parquet':
+        table = pyarrow.parquet.read_table(path)
+    else:
+        table = pyarrow.feather.read_table(path)
+    df = optimize_record_dtypes(table.to_pandas())
+    df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
+    df.attrs['data_version'] = metadata['data_version']
+    df.attrs['loaded_at'] = datetime.fromisoformat(metadata['created_at'])
+    df.attrs['snapshot'] = metadata['name']
+    return df
+
+def list_snapshots():
+    """Returns the metadata of the current farm's snapshots, newest first. Unreadable files are skipped."""
+    snapshot_dir = current_tenant()['snapshot_dir']
+    if pyarrow is None or not os.path.isdir(snapshot_dir):
+        return []
+    snapshots = []
+    for file_name in os.listdir(snapshot_dir):
+        if not snapshot_format_of(file_name):
+            continue
+        try:
+            snapshots.append(read_snapshot_metadata(os.path.join(snapshot_dir, file_name)))
+        except ValueError as e:
+            print(f"--- DEBUG: list_snapshots: Skipping {file_name}: {e}")
+    return sorted(snapshots, key=lambda snapshot: snapshot['created_at'], reverse=True)
+
+def prune_snapshots():
+    """Deletes named snapshots beyond SNAPSHOT_RETENTION, oldest first. The rolling latest snapshot is kept."""
+    named = [snapshot for snapshot in list_snapshots() if snapshot['name'] != SNAPSHOT_LATEST_NAME]
+    for snapshot in named[SNAPSHOT_RETENTION:]:
+        try:
+            os.remove(snapshot_path(snapshot['name'], snapshot['format']))
+        except (OSError, ValueError) as e:
+            print(f"--- DEBUG: prune_snapshots: Could not delete {snapshot['file_name']}: {e}")
+
+def load_latest_snapshot(data_version=None):
+    """
+    Returns the rolling latest snapshot as a frame, or None when there is none (or pyarrow is missing).
+    With data_version, only a snapshot of exactly that version is returned.
+    """
+    if pyarrow is None:
+        return None
+    path = snapshot_path(SNAPSHOT_LATEST_NAME)
+    if not os.path.exists(path):
+        return None
+    try:
+        if data_version and read_snapshot_metadata(path)['data_version'] != data_version:
+            return None
+        return read_records_snapshot(path)
+    except Exception as e:
+        print(f"--- DEBUG: load_latest_snapshot: ERROR reading {path}: {e}")
+        return None
+
+def refresh_latest_snapshot(data_version):
+    """Rewrites the rolling latest snapshot from the cached frame of data_version, in the background."""
+    if pyarrow is None or not SNAPSHOT_AUTO or not data_version:
+        return
+
+    def write_latest():
+        try:
+            path = snapshot_path(SNAPSHOT_LATEST_NAME)
+            if os.path.exists(path) and read_snapshot_metadata(path)['data_version'] == data_version:
+                return
+            df = get_cached_frame(data_version, copy=False)
+            if df is not None:
+                write_records_snapshot(df, name=SNAPSHOT_LATEST_NAME)
+        except Exception as e:
+            print(f"--- DEBUG: refresh_latest_snapshot: ERROR writing snapshot for {data_version}: {e}")
+
+    # Run with this request's farm selected
+    get_job_executor().submit(contextvars.copy_context().run, write_latest)
+
+def snapshot_to_records(df):
+    """Converts a snapshot frame to record dictionaries in the shape save_records() expects."""
+    df = display_frame(df)
+    df['Date'] = df['Date'].dt.strftime('%Y-%m-%d')
+    df = df[RECORD_HEADERS].astype(object).where(df[RECORD_HEADERS].notna(), '')
+    return [{header.replace(' ', '_').lower(): value for header, value in row.items()} for row in df.to_dict(orient='records')]
+
+def count_stored_records(backend, client=None):
+    """
+    Counts the rows of every partition of a backend straight from the source, bypassing the caches and
+    snapshots. Raises if anything cannot be read, so a failed read is never mistaken for empty storage.
+    """
+    manifest = load_partition_manifest(backend, client, fresh=True)
+    total = 0
+    for key, entry in manifest.items():
+        if backend == 'google':
+            spreadsheet = open_spreadsheet(client, current_tenant()['sheet_id'])
+            try:
+                worksheet = spreadsheet.sheet1 if key == LEGACY_PARTITION_KEY else spreadsheet.worksheet(entry['storage'])
+            except gspread.exceptions.WorksheetNotFound:
+                continue
+            total += max(len(worksheet.get_all_values()) - 1, 0) # Minus the header row
+        else:
+            file_path = partition_file_path(key, entry)
+            if os.path.exists(file_path):
+                with open(file_path, 'r', newline='', encoding='utf-8') as csv_file:
+                    total += sum(1 for _ in csv.DictReader(csv_file))
+    return total
+
+def restore_records_snapshot(path):
+    """
+    Restores a snapshot's records into the farm's record storage. Only allowed while every storage it
+    writes to is confirmed empty by a direct read, so a restore can never duplicate existing rows (a
+    frame served from a snapshot may only mean that the live read failed). Returns the number restored.
+    """
+    df = read_records_snapshot(path)
+    client = get_sheets_client()
+    backends = (['google'] if client else []) + (['csv'] if USE_CSV_FALLBACK else [])
+    if not backends:
+        raise ValueError("No record storage is available to restore into.")
+    for backend in backends:
+        try:
+            stored = count_stored_records(backend, client if backend == 'google' else None)
+        except Exception as e:
+            print(f"--- DEBUG: restore_records_snapshot: ERROR reading {backend} records: {e}")
+            raise ValueError("The farm's records could not be read to confirm the farm is empty. Nothing was restored; try again later.")
+        if stored:
+            raise ValueError("This farm already has records. Snapshots can only be restored into an empty farm.")
+    records = snapshot_to_records(df)
+    if records and not save_records(records):
+        raise ValueError("The records could not be saved. Check server logs.")
+    return len(records)
+
+# --- Livestock Analytics ---
+# Trend metrics per category, computed with groupby/rolling over the normalized records and
+# cached per data version, so dashboard charts don't add table scans.
+ANALYTICS_WINDOWS = (7, 30)
+# Days of farm-wide rolling totals returned for charts
+ANALYTICS_SERIES_DAYS = 90
+ANALYTICS_CACHE_SIZE = 4
+
+def safe_ratio(numerator, denominator):
+    """Element-wise numerator / denominator with None where the denominator is zero."""
+    ratio = numerator / denominator.where(denominator != 0)
+    return ratio.round(3).astype(object).where(ratio.notna(), None)
+
+def compute_livestock_analytics(df, as_of):
+    """
+    Computes per-category analytics from a normalized records frame:
+    rolling 7/30-day profit and expenditure, the previous 30 days and the change against them,
+    feed kg per unit sold, revenue (sales) per unit sold, and margin per unit sold (sales minus
+    the category's expenditure). Also returns farm-wide rolling 30-day totals for the last
+    ANALYTICS_SERIES_DAYS days for charting.
+    """
+    as_of = pd.Timestamp(as_of).normalize()
+    is_profit = category_mask(df['Type'], 'profit')
+    quantity = df['Quantity'].astype('float64')
+    values = pd.DataFrame({
+        'Day': df['Date'].dt.normalize(),
+        'Category': df['Category'],
+        'profit': df['Total Profit'].where(is_profit, 0.0),
+        'expenditure': df['Amount'].where(category_mask(df['Type'], 'expenditure'), 0.0),
+        'feed_kg': quantity.where(category_mask(df['Type'], 'feed_input'), 0.0),
+        'units_sold': quantity.where(is_profit, 0.0),
+    })
+
+    # All-time totals per category drive the efficiency ratios
+    totals = values.groupby('Category', observed=True)[['profit', 'expenditure', 'feed_kg', 'units_sold']].sum()
+
+    # Daily sums per category on a continuous calendar, so rolling windows are calendar days
+    longest = max(ANALYTICS_WINDOWS + (ANALYTICS_SERIES_DAYS, 60))
+    first_day = min(values['Day'].min(), as_of - pd.Timedelta(days=longest - 1))
+    calendar = pd.date_range(first_day, as_of, freq='D')
+    # Every category gets columns, even when all its rows are dated after as_of
+    daily = (
+        values[values['Day'] <= as_of]
+        .groupby(['Day', 'Category'], observed=True)[['profit', 'expenditure']]
+        .sum()
+        .unstack('Category', fill_value=0.0)
+        .reindex(index=calendar, columns=pd.MultiIndex.from_product([['profit', 'expenditure'], totals.index]), fill_value=0.0)
+    )
+
+    result = totals[['feed_kg', 'units_sold']].copy()
+    for window in ANALYTICS_WINDOWS:
+        latest = daily.rolling(window, min_periods=1).sum().iloc[-1]
+        result[f'profit_{window}d'] = latest['profit']
+        result[f'expenditure_{window}d'] = latest['expenditure']
+    # The 30 days before the latest 30-day window, for period-over-period deltas
+    previous = daily.iloc[-60:-30].sum()
+    result['profit_prev_30d'] = previous['profit']
+    result['expenditure_prev_30d'] = previous['expenditure']
+    result = result.fillna(0.0)
+    result['profit_change_30d'] = result['profit_30d'] - result['profit_prev_30d']
+    result['expenditure_change_30d'] = result['expenditure_30d'] - result['expenditure_prev_30d']
+    result = result.round(2)
+    result['profit_change_pct'] = safe_ratio(result['profit_change_30d'] * 100, result['profit_prev_30d'])
+    result['expenditure_change_pct'] = safe_ratio(result['expenditure_change_30d'] * 100, result['expenditure_prev_30d'])
+    result['feed_kg_per_unit_sold'] = safe_ratio(totals['feed_kg'], totals['units_sold'])
+    result['revenue_per_unit'] = safe_ratio(totals['profit'], totals['units_sold'])
+    result['margin_per_unit'] = safe_ratio(totals['profit'] - totals['expenditure'], totals['units_sold'])
+
+    farm_rolling = daily.T.groupby(level=0).sum().T.rolling(30, min_periods=1).sum().iloc[-ANALYTICS_SERIES_DAYS:]
+    return {
+        'as_of': as_of.strftime('%Y-%m-%d'),
+        'categories': result.reset_index().rename(columns={'Category': 'category'}).to_dict(orient='records'),
+        'series': {
+            'dates': farm_rolling.index.strftime('%Y-%m-%d').tolist(),
+            'profit_30d': farm_rolling['profit'].round(2).tolist(),
+            'expenditure_30d': farm_rolling['expenditure'].round(2).tolist(),
+        },
+    }
+
+def get_livestock_analytics(as_of=None):
+    """Returns livestock analytics for the current farm, computed once per data version and day."""
+    as_of = pd.Timestamp(as_of or datetime.now().date()).normalize()
+    df = get_all_farm_records_df(copy=False)
+    if df.empty:
+        return {'as_of': as_of.strftime('%Y-%m-%d'), 'categories': [], 'series': {'dates': [], 'profit_30d': [], 'expenditure_30d': []}}
+    cache_key = (df.attrs.get('data_version'), as_of)
+    analytics_cache = tenant_state()['analytics_cache']
+    with _cache_lock:
+        cached = analytics_cache.get(cache_key)
+        if cached is not None:
+            analytics_cache.move_to_end(cache_key)
+            return cached
+    analytics = compute_livestock_analytics(df, as_of)
+    with _cache_lock:
+        analytics_cache[cache_key] = analytics
+        while len(analytics_cache) > ANALYTICS_CACHE_SIZE:
+            analytics_cache.popitem(last=False)
+    return analytics
+
+# --- Record Search ---
+# An inverted index over the normalized Item and Category text: token -> text values, and text value
+# -> row locators. Queries resolve tokens by exact, prefix (bisect over the sorted token list) or fuzzy
+# match and intersect the posting sets, so they never touch the rows. The index follows data versions
+# by diffing the new frame against the rows it already holds and re-posting only what changed.
+SEARCH_FIELDS = {'item': 'Item', 'category': 'Category'}
+# Closest-spelling cutoff (0-1) for query tokens with no exact or prefix match
+SEARCH_FUZZY_CUTOFF = float(os.environ.get('SEARCH_FUZZY_CUTOFF', '0.75'))
+SEARCH_MIN_PREFIX = 2
+_search_token_pattern = re.compile(r'[a-z0-9]+')
+
+def normalize_search_text(value):
+    """Lowercases text and collapses punctuation and whitespace, so 'Broiler  starter.' == 'broiler starter'."""
+    return ' '.join(_search_token_pattern.findall(str(value).lower()))
+
+def normalized_column(series):
+    """Normalizes a text column once per distinct value (the record text columns are categorical)."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        categories = np.array([normalize_search_text(value) for value in series.cat.categories] + [''], dtype=object)
+        # Missing values have code -1, which picks the trailing ''
+        return pd.Series(categories[series.cat.codes.to_numpy()], index=series.index)
+    return series.fillna('').astype(str).map(normalize_search_text)
+
+def new_search_index():
+    return {
+        'data_version': None,
+        'rows': pd.DataFrame(columns=list(SEARCH_FIELDS), dtype=object), # locator -> normalized item/category
+        'postings': {}, # (field, value) -> set of locators
+        'value_tokens': {}, # token -> set of (field, value)
+        'tokens': [], # sorted token list for prefix lookups
+    }
+
+def post_search_rows(index, rows, remove=False):
+    """Adds (or removes) rows, a frame of normalized item/category indexed by locator, to the postings."""
+    postings = index['postings']
+    for field in SEARCH_FIELDS:
+        for value, locators in rows.groupby(field).groups.items():
+            key = (field, value)
+            if remove:
+                remaining = postings.get(key, set())
+                remaining.difference_update(locators)
+                if not remaining:
+                    postings.pop(key, None)
+                    for token in value.split():
+                        values = index['value_tokens'].get(token)
+                        if values is not None:
+                            values.discard(key)
+                            if not values:
+                                del index['value_tokens'][token]
+                                del index['tokens'][bisect.bisect_left(index['tokens'], token)]
+                continue
+            if key not in postings:
+                postings[key] = set()
+                for token in value.split():
+                    if token not in index['value_tokens']:
+                        index['value_tokens'][token] = set()
+                        bisect.insort(index['tokens'], token)
+                    index['value_tokens'][token].add(key)
+            postings[key].update(locators)
+
+def sync_search_index(df):
+    """
+    Brings the current farm's search index up to df's data version. Rows that were added, removed or
+    whose item/category text changed are re-posted; unchanged rows are left alone.
+    """
+    state = tenant_state()
+    with _cache_lock:
+        index = state.get('search_index')
+        if index is None:
+            index = state['search_index'] = new_search_index()
+        data_version = df.attrs.get('data_version')
+        if data_version and index['data_version'] == data_version:
+            return index
+
+        rows = pd.DataFrame({field: normalized_column(df[column]) for field, column in SEARCH_FIELDS.items()}, index=df.index)
+        previous = index['rows']
+        if previous.empty:
+            stale, fresh = previous, rows
+        else:
+            aligned = previous.reindex(rows.index)
+            changed = (aligned != rows).any(axis=1) # Also true for new locators (NaN never compares equal)
+            removed = previous.index.difference(rows.index)
+            stale = previous.loc[removed.append(rows.index[changed & aligned.notna().all(axis=1)])]
+            fresh = rows.loc[changed]
+        post_search_rows(index, stale, remove=True)
+        post_search_rows(index, fresh)
+        index['rows'] = rows
+        index['data_version'] = data_version
+        print(f"--- DEBUG: sync_search_index: Re-posted {len(fresh)} rows, dropped {len(stale)} for data version {data_version}.")
+        return index
+
+def match_search_token(index, token):
+    """
+    Returns (matched tokens, how): the token itself, else every indexed token it prefixes,
+    else the closest spellings.
+    """
+    if token in index['value_tokens']:
+        return [token], 'exact'
+    tokens = index['tokens']
+    if len(token) >= SEARCH_MIN_PREFIX:
+        start = bisect.bisect_left(tokens, token)
+        end = bisect.bisect_left(tokens, token + '\uffff')
+        if start < end:
+            return tokens[start:end], 'prefix'
+    return difflib.get_close_matches(token, tokens, n=3, cutoff=SEARCH_FUZZY_CUTOFF), 'fuzzy'
+
+def search_records(df, query, field=None):
+    """
+    Finds the rows of df whose item or category (or only `field`) contains every query token.
+    Returns (positions of the matching rows in df, {query token: fuzzy replacements used}).
+    """
+    index = sync_search_index(df)
+    matches, corrections = None, {}
+    for token in normalize_search_text(query).split():
+        matched_tokens, how = match_search_token(index, token)
+        if how == 'fuzzy' and matched_tokens:
+            corrections[token] = matched_tokens
+        locators = set()
+        for matched in matched_tokens:
+            for key in index['value_tokens'][matched]:
+                if field is None or key[0] == field:
+                    locators |= index['postings'][key]
+        matches = locators if matches is None else matches & locators
+        if not matches:
+            return [], corrections
+    if matches is None:
+        return [], corrections
+    positions = df.index.get_indexer(list(matches))
+    return sorted(int(position) for position in positions if position >= 0), corrections
+
+# --- Feed Inventory Ledger ---
+# Purchases, consumption and adjustments per category and feed type. Every movement is appended to
+# the ledger and applied to a stored running balance, so stock on hand never requires rescanning history.
+# Posting holds a lock shared by all workers and re-reads the stored balances, so no update is lost.
+FEED_LEDGER_WORKSHEET = 'Feed Ledger'
+FEED_BALANCES_WORKSHEET = 'Feed Balances'
+FEED_LEDGER_FILE_NAME = 'feed_ledger.csv'
+FEED_BALANCES_FILE_NAME = 'feed_balances.json'
+FEED_LEDGER_HEADERS = ['Date', 'Category', 'Feed Type', 'Movement', 'Quantity Kg', 'Note']
+FEED_BALANCES_HEADERS = ['Category', 'Feed Type', 'Balance Kg', 'Purchased Kg', 'Consumed Kg', 'Adjusted Kg', 'Daily Use', 'Updated At']
+FEED_MOVEMENTS = {'purchase': 'Purchase', 'consumption': 'Consumption', 'adjustment': 'Adjustment'}
+# A stock count is posted as the adjustment that brings each backend's balance to the counted amount
+FEED_COUNT_MOVEMENT = 'count'
+# Days of consumption averaged into the burn rate
+FEED_BURN_WINDOW_DAYS = int(os.environ.get('FEED_BURN_WINDOW_DAYS', '14'))
+# Stock lasting fewer days than this raises a low-stock alert
+FEED_LOW_STOCK_DAYS = int(os.environ.get('FEED_LOW_STOCK_DAYS', '7'))
+
+def feed_ledger_lock(backend):
+    """Lock held while a backend's ledger and balances are updated."""
+    os.makedirs(current_tenant()['partition_dir'], exist_ok=True)
+    return file_lock(os.path.join(current_tenant()['partition_dir'], f"feed_{backend}.lock"))
+
+def feed_balance_key(category, feed_type):
+    """Balances are keyed case-insensitively on category and feed type."""
+    return f"{str(category).strip().lower()}|{str(feed_type).strip().lower()}"
+
+def apply_feed_movement(balances, movement, today=None):
+    """
+    Applies one ledger movement to the balances dict in place: purchases add stock, consumption
+    removes it (and counts toward the burn rate), adjustments add their signed quantity.
+    """
+    key = feed_balance_key(movement['category'], movement['feed_type'])
+    entry = balances.setdefault(key, {
+        'category': str(movement['category']).strip(),
+        'feed_type': str(movement['feed_type']).strip(),
+        'balance_kg': 0.0, 'purchased_kg': 0.0, 'consumed_kg': 0.0, 'adjusted_kg': 0.0,
+        'daily_use': {}, 'updated_at': '',
+    })
+    quantity = float(movement['quantity_kg'])
+    if movement['movement'] == 'purchase':
+        entry['purchased_kg'] += quantity
+        entry['balance_kg'] += quantity
+    elif movement['movement'] == 'consumption':
+        entry['consumed_kg'] += quantity
+        entry['balance_kg'] -= quantity
+        entry['daily_use'][movement['date']] = entry['daily_use'].get(movement['date'], 0.0) + quantity
+    else:
+        entry['adjusted_kg'] += quantity
+        entry['balance_kg'] += quantity
+    # Only the burn-rate window of daily use is kept
+    cutoff = ((today or datetime.now()) - timedelta(days=FEED_BURN_WINDOW_DAYS - 1)).strftime('%Y-%m-%d')
+    entry['daily_use'] = {day: kg for day, kg in entry['daily_use'].items() if day >= cutoff}
+    entry['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return key
+
+def load_feed_balances(backend, client=None, fresh=False):
+    """
+    Loads running feed balances: {key: entry}. Google keeps them in the 'Feed Balances' worksheet;
+    CSV in feed_balances.json next to the farm's records. Writers pass fresh=True to skip the
+    cached Google copy and see errors instead of an empty result.
+    """
+    if backend == 'google' and not fresh:
+        with _cache_lock:
+            cached = tenant_state()['feed_balances_cache'].get(backend)
+        if cached and time.time() - cached['loaded_at'] < RECORDS_CACHE_TTL_SECONDS:
+            return json.loads(cached['balances'])
+
+    balances = {}
+    if backend == 'google':
+        if fresh:
+            # Only a missing worksheet means there are no balances yet; any other failure raises
+            try:
+                worksheet = open_spreadsheet(client, current_tenant()['sheet_id']).worksheet(FEED_BALANCES_WORKSHEET)
+            except gspread.exceptions.WorksheetNotFound:
+                worksheet = None
+        else:
+            worksheet = get_worksheet(client, current_tenant()['sheet_id'], FEED_BALANCES_WORKSHEET)
+        if worksheet:
+            try:
+                for row in worksheet.get_all_records():
+                    if not str(row.get('Category', '')).strip() and not str(row.get('Feed Type', '')).strip():
+                        continue # Blank rows left below the balances
+                    balances[feed_balance_key(row.get('Category', ''), row.get('Feed Type', ''))] = {
+                        'category': str(row.get('Category', '')),
+                        'feed_type': str(row.get('Feed Type', '')),
+                        'balance_kg': float(row.get('Balance Kg') or 0),
+                        'purchased_kg': float(row.get('Purchased Kg') or 0),
+                        'consumed_kg': float(row.get('Consumed Kg') or 0),
+                        'adjusted_kg': float(row.get('Adjusted Kg') or 0),
+                        'daily_use': json.loads(row.get('Daily Use') or '{}'),
+                        'updated_at': str(row.get('Updated At', '')),
+                    }
+            except Exception as e:
+                print(f"--- DEBUG: load_feed_balances: ERROR reading balances worksheet: {e}")
+                if fresh:
+                    raise
+        with _cache_lock:
+            tenant_state()['feed_balances_cache'][backend] = {'balances': json.dumps(balances), 'loaded_at': time.time()}
+    else:
+        balances_path = current_tenant()['feed_balances_path']
+        if os.path.exists(balances_path):
+            try:
+                with open(balances_path, 'r', encoding='utf-8') as balances_file:
+                    balances = json.load(balances_file)
+            except Exception as e:
+                print(f"--- DEBUG: load_feed_balances: ERROR reading {balances_path}: {e}")
+                if fresh:
+                    raise
+    return balances
+
+def save_feed_balances(backend, balances, client=None, shrink=False):
+    """
+    Persists running feed balances for the given backend. The Google worksheet is overwritten in place,
+    so readers never see it empty; pass shrink=True when entries may have been dropped (rebuilds).
+    """
+    try:
+        if backend == 'google':
+            worksheet = get_worksheet(client, current_tenant()['sheet_id'], FEED_BALANCES_WORKSHEET, create=True,
+                                      headers=FEED_BALANCES_HEADERS)
+            if not worksheet:
+                return False
+            rows = [FEED_BALANCES_HEADERS] + [
+                [entry['category'], entry['feed_type'], round(entry['balance_kg'], 3), round(entry['purchased_kg'], 3),
+                 round(entry['consumed_kg'], 3), round(entry['adjusted_kg'], 3), json.dumps(entry['daily_use']), entry['updated_at']]
+                for _, entry in sorted(balances.items())
+            ]
+            if shrink:
+                overwrite_worksheet(worksheet, rows)
+            else:
+                worksheet.update('A1', rows)
+            with _cache_lock:
+                tenant_state()['feed_balances_cache'][backend] = {'balances': json.dumps(balances), 'loaded_at': time.time()}
+        else:
+            balances_path = current_tenant()['feed_balances_path']
+            os.makedirs(os.path.dirname(balances_path), exist_ok=True)
+            temp_path = balances_path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as balances_file:
+                json.dump(balances, balances_file, indent=2, sort_keys=True)
+            os.replace(temp_path, balances_path)
+        return True
+    except Exception as e:
+        print(f"--- DEBUG: save_feed_balances: ERROR saving {backend} feed balances: {e}")
+        return False
+
+def read_feed_ledger(backend, client=None):
+    """Reads every ledger movement of the given backend (only needed to rebuild balances)."""
+    if backend == 'google':
+        worksheet = get_worksheet(client, current_tenant()['sheet_id'], FEED_LEDGER_WORKSHEET)
+        rows = worksheet.get_all_records() if worksheet else []
+    else:
+        rows = read_records_from_csv(current_tenant()['feed_ledger_path'])
+    return [{
+        'date': str(row.get('Date', '')),
+        'category': row.get('Category', ''),
+        'feed_type': row.get('Feed Type', ''),
+        'movement': str(row.get('Movement', '')).lower(),
+        'quantity_kg': float(row.get('Quantity Kg') or 0),
+        'note': row.get('Note', ''),
+    } for row in rows if str(row.get('Movement', '')).lower() in FEED_MOVEMENTS]
+
+def feed_rebuild_flag_path(backend):
+    """Marker left when a backend's ledger was appended but its balances could not be saved."""
+    return os.path.join(current_tenant()['partition_dir'], f"feed_{backend}.rebuild")
+
+def rebuild_backend_feed_balances(backend, client=None):
+    """
+    Recomputes one backend's balances from its full ledger and clears its rebuild flag.
+    The caller holds feed_ledger_lock(backend). Returns the balances, or None if they could not be saved.
+    """
+    balances = {}
+    for movement in read_feed_ledger(backend, client):
+        apply_feed_movement(balances, movement)
+    if not save_feed_balances(backend, balances, client, shrink=True):
+        return None
+    try:
+        os.remove(feed_rebuild_flag_path(backend))
+    except FileNotFoundError:
+        pass
+    return balances
+
+def post_feed_movements(backend, movements, client=None):
+    """
+    Appends movements to the backend's ledger and folds them into its stored balances, holding the
+    backend's feed_ledger_lock() around the uncached read-modify-write. Stock counts become the
+    adjustment from this backend's own balance. If the balances can't be saved after the ledger
+    append, the backend is flagged and its balances are rebuilt from the ledger, now or on the next post.
+    Returns False if the movements or the balances could not be posted.
+    """
+    try:
+        with feed_ledger_lock(backend):
+            if os.path.exists(feed_rebuild_flag_path(backend)):
+                print(f"--- DEBUG: post_feed_movements: Rebuilding flagged {backend} feed balances first.")
+                balances = rebuild_backend_feed_balances(backend, client)
+                if balances is None:
+                    return False
+            else:
+                balances = load_feed_balances(backend, client, fresh=True)
+            posted = []
+            for movement in movements:
+                if movement['movement'] == FEED_COUNT_MOVEMENT:
+                    current = balances.get(feed_balance_key(movement['category'], movement['feed_type']), {}).get('balance_kg', 0.0)
+                    movement = dict(movement, movement='adjustment', quantity_kg=round(float(movement['quantity_kg']) - current, 3),
+                                    note=movement.get('note') or 'Stock count')
+                apply_feed_movement(balances, movement)
+                posted.append(movement)
+
+            if backend == 'google':
+                worksheet = get_worksheet(client, current_tenant()['sheet_id'], FEED_LEDGER_WORKSHEET, create=True,
+                                          headers=FEED_LEDGER_HEADERS)
+                if not worksheet or not append_rows_to_sheet(worksheet, [[movement.get(col.replace(' ', '_').lower(), '') for col in FEED_LEDGER_HEADERS] for movement in posted]):
+                    return False
+            elif not append_records_to_csv(current_tenant()['feed_ledger_path'], posted, FEED_LEDGER_HEADERS):
+                return False
+            if save_feed_balances(backend, balances, client):
+                return True
+            # The ledger already holds the movements, so the stored balances must catch up from it
+            with open(feed_rebuild_flag_path(backend), 'w', encoding='utf-8') as flag_file:
+                flag_file.write(datetime.now().isoformat())
+            rebuild_backend_feed_balances(backend, client)
+            return False
+    except Exception as e:
+        print(f"--- DEBUG: post_feed_movements: ERROR posting {backend} feed movements: {e}")
+        return False
+
+def feed_stock_projection(entry, today=None):
+    """
+    Adds burn rate (average kg/day over the recent window), days of stock remaining, the projected
+    run-out date and a low-stock flag to a balance entry. Balances that never had a purchase or
+    adjustment are not tracked for alerts, since their opening stock is unknown.
+    """
+    today = (today or datetime.now()).date()
+    recent = {day: kg for day, kg in entry['daily_use'].items()
+              if (today - datetime.strptime(day, '%Y-%m-%d').date()).days < FEED_BURN_WINDOW_DAYS}
+    burn_rate = 0.0
+    if recent:
+        # Average over the days since use was first seen, so a new ledger isn't diluted by empty days
+        span = min(FEED_BURN_WINDOW_DAYS, (today - datetime.strptime(min(recent), '%Y-%m-%d').date()).days + 1)
+        burn_rate = sum(recent.values()) / max(span, 1)
+    days_remaining = entry['balance_kg'] / burn_rate if burn_rate > 0 else None
+    tracked = entry['purchased_kg'] > 0 or entry['adjusted_kg'] != 0
+    low_stock = tracked and (entry['balance_kg'] <= 0 or (days_remaining is not None and days_remaining < FEED_LOW_STOCK_DAYS))
+    return dict(
+        entry,
+        balance_kg=round(entry['balance_kg'], 2),
+        burn_rate_kg_per_day=round(burn_rate, 2),
+        days_remaining=round(max(days_remaining, 0), 1) if days_remaining is not None else None,
+        runs_out_on=(today + timedelta(days=max(days_remaining, 0))).strftime('%Y-%m-%d') if days_remaining is not None else None,
+        tracked=tracked,
+        low_stock=low_stock,
+    )
+
+def feed_ledger_backend():
+    """The backend feed stock is read from: local files when CSV fallback is on and has balances, else Google."""
+    if USE_CSV_FALLBACK and (os.path.exists(current_tenant()['feed_balances_path']) or not get_sheets_client()):
+        return 'csv'
+    return 'google'
+
+def get_feed_stock():
+    """Returns projected stock for every category and feed type, low-stock entries first."""
+    backend = feed_ledger_backend()
+    client = get_sheets_client() if backend == 'google' else None
+    if os.path.exists(feed_rebuild_flag_path(backend)):
+        try:
+            with feed_ledger_lock(backend):
+                rebuild_backend_feed_balances(backend, client)
+        except Exception as e:
+            print(f"--- DEBUG: get_feed_stock: ERROR rebuilding flagged {backend} balances: {e}")
+    balances = load_feed_balances(backend, client)
+    stock = [feed_stock_projection(entry) for entry in balances.values()]
+    return sorted(stock, key=lambda item: (not item['low_stock'], item['category'].lower(), item['feed_type'].lower()))
+
+def record_feed_movements(movements):
+    """
+    Records feed movements in the Google Sheet ledger and optionally the local CSV ledger,
+    updating running balances incrementally, and warns about any balance that is now low.
+    Each movement: {'date', 'movement', 'category', 'feed_type', 'quantity_kg', 'note'}; a 'count'
+    movement's quantity is the counted stock. Returns False if any enabled backend was not fully updated.
+    """
+    if not movements:
+        return True
+    google_success = False
+    client = get_sheets_client()
+    if client:
+        google_success = post_feed_movements('google', movements, client)
+        if not google_success:
+            notify("Failed to update feed stock in Google Sheet. Check server logs.", "danger")
+    csv_success = False
+    if USE_CSV_FALLBACK:
+        csv_success = post_feed_movements('csv', movements)
+        if not csv_success:
+            notify("Failed to update the local feed stock.", "danger")
+    if not (google_success or csv_success):
+        return False
+
+    touched = {feed_balance_key(movement['category'], movement['feed_type']) for movement in movements}
+    for item in get_feed_stock():
+        if item['low_stock'] and feed_balance_key(item['category'], item['feed_type']) in touched:
+            if item['days_remaining'] is not None and item['balance_kg'] > 0:
+                notify(f"Low feed stock: {item['feed_type']} for {item['category']} has {item['balance_kg']} kg left, about {item['days_remaining']} days.", "warning")
+            else:
+                notify(f"Out of feed stock: {item['feed_type']} for {item['category']} is at {item['balance_kg']} kg.", "warning")
+    return (google_success or not client) and (csv_success or not USE_CSV_FALLBACK)
+
+def feed_consumption_movements(records):
+    """Ledger consumption movements for the feed_input records among records."""
+    return [{
+        'date': record['date'],
+        'movement': 'consumption',
+        'category': record['category'],
+        'feed_type': record['item'],
+        'quantity_kg': record['quantity'],
+        'note': 'Feed record',
+    } for record in records if record.get('type') == 'feed_input']
+
+def rebuild_feed_balances():
+    """Recomputes running balances from the full ledger, for repairs after manual ledger edits."""
+    rebuilt = 0
+    for backend in ('google', 'csv'):
+        if backend == 'csv' and not USE_CSV_FALLBACK:
+            continue
+        client = get_sheets_client() if backend == 'google' else None
+        if backend == 'google' and not client:
+            continue
+        try:
+            with feed_ledger_lock(backend):
+                if rebuild_backend_feed_balances(backend, client) is not None:
+                    rebuilt += 1
+        except Exception as e:
+            print(f"--- DEBUG: rebuild_feed_balances: ERROR rebuilding {backend} balances: {e}")
+    return rebuilt > 0
+
+# --- Request Profiling ---
+# An admin can add ?_profile=1 (or an 'X-Profile: 1' header; true, yes and on also work) to any request to run it under a stack
+# sampler and tracemalloc. The folded stacks (for flamegraph.pl, speedscope or Firefox Profiler) and an
+# allocation summary are saved per farm for download. Requests without the flag only pay for the check.
+PROFILE_QUERY_FLAG = '_profile'
+PROFILE_HEADER = 'X-Profile'
+PROFILE_FLAG_VALUES = {'1', 'true', 'yes', 'on'}
+PROFILES_DIR_NAME = 'profiles'
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', '1'))
+PROFILE_TRACEMALLOC_FRAMES = int(os.environ.get('PROFILE_TRACEMALLOC_FRAMES', '10'))
+PROFILE_TOP_ALLOCATIONS = 25
+# Profiles kept per farm; older ones are deleted
+PROFILE_RETENTION = int(os.environ.get('PROFILE_RETENTION', '20'))
+PROFILE_FILES = {'folded': ('.folded', 'text/plain'), 'memory': ('.memory.txt', 'text/plain')}
+
+# tracemalloc is process-wide, so only one request is profiled at a time
+_profile_lock = threading.Lock()
+
+class StackSampler:
+    """Samples one thread's Python stack at a fixed interval, counting identical stacks in folded form."""
+
+    def __init__(self, thread_id, interval_seconds):
+        self.thread_id = thread_id
+        self.interval_seconds = interval_seconds
+        self.counts = {}
+        self.samples = 0
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval_seconds):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                # 'flask/app.py' rather than 'app.py', so library frames aren't mistaken for ours
+                short_path = os.path.join(os.path.basename(os.path.dirname(code.co_filename)), os.path.basename(code.co_filename))
+                stack.append(f"{code.co_name} ({short_path}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                folded = ';'.join(reversed(stack))
+                self.counts[folded] = self.counts.get(folded, 0) + 1
+                self.samples += 1
+
+def profile_requested():
+    """
+    True when the current request asks to be profiled with one of PROFILE_FLAG_VALUES (so '0' or 'false'
+    do not). This is the only cost of an unprofiled request.
+    """
+    flag = request.args.get(PROFILE_QUERY_FLAG) or request.headers.get(PROFILE_HEADER)
+    return flag is not None and flag.strip().lower() in PROFILE_FLAG_VALUES
+
+def profile_file_path(profile_id, kind):
+    """Returns the path of a stored profile file. Rejects ids that are not plain hex."""
+    if not profile_id or not all(char in '0123456789abcdef' for char in profile_id) or kind not in PROFILE_FILES and kind != 'meta':
+        raise ValueError(f"Invalid profile: {profile_id!r} {kind!r}")
+    suffix = '.json' if kind == 'meta' else PROFILE_FILES[kind][0]
+    return os.path.join(current_tenant()['profiles_dir'], profile_id + suffix)
+
+def start_request_profile():
+    """Starts sampling the current thread and tracing allocations. Returns the profile state, or None if one is already running."""
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    was_tracing = tracemalloc.is_tracing()
+    if was_tracing:
+        baseline = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+    else:
+        baseline = None
+        tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+    sampler = StackSampler(threading.get_ident(), PROFILE_SAMPLE_INTERVAL_MS / 1000.0)
+    profile = {
+        'id': uuid.uuid4().hex,
+        'sampler': sampler,
+        'baseline': baseline,
+        'was_tracing': was_tracing,
+        'started': time.perf_counter(),
+        'cpu_started': time.thread_time(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+    }
+    sampler.start()
+    return profile
+
+def allocation_summary(snapshot, baseline, peak_bytes, current_bytes):
+    """Formats the top allocation sites (still alive at the end of the request) as plain text."""
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, '<frozen importlib._bootstrap*>')]
+    snapshot = snapshot.filter_traces(ignore)
+    if baseline is not None:
+        stats = snapshot.compare_to(baseline.filter_traces(ignore), 'lineno')
+        lines = [f"{stat.size_diff / 1024:10.1f} KiB {stat.count_diff:8d} blocks  {stat.traceback}" for stat in stats[:PROFILE_TOP_ALLOCATIONS]]
+    else:
+        stats = snapshot.statistics('lineno')
+        lines = [f"{stat.size / 1024:10.1f} KiB {stat.count:8d} blocks  {stat.traceback}" for stat in stats[:PROFILE_TOP_ALLOCATIONS]]
+    header = [
+        f"Peak traced memory during the request: {peak_bytes / 1024 / 1024:.2f} MiB",
+        f"Traced memory still allocated at the end: {current_bytes / 1024 / 1024:.2f} MiB",
+        "Tracing is process-wide, so allocations by concurrent requests are included.",
+        "",
+        f"Top {PROFILE_TOP_ALLOCATIONS} allocation sites by size:",
+    ]
+    return '\n'.join(header + lines) + '\n'
+
+def finish_request_profile(profile, response=None):
+    """Stops profiling, stores the folded stacks, allocation summary and metadata, and returns the metadata."""
+    try:
+        profile['sampler'].stop()
+        duration = time.perf_counter() - profile['started']
+        cpu_time = time.thread_time() - profile['cpu_started']
+        current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        if not profile['was_tracing']:
+            tracemalloc.stop()
+    finally:
+        _profile_lock.release()
+
+    metadata = {
+        'id': profile['id'],
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'endpoint': request.endpoint,
+        'status': response.status_code if response is not None else None,
+        'created_at': profile['created_at'],
+        'duration_ms': round(duration * 1000, 1),
+        'cpu_ms': round(cpu_time * 1000, 1),
+        'samples': profile['sampler'].samples,
+        'peak_memory_mb': round(peak_bytes / 1024 / 1024, 2),
+    }
+    try:
+        os.makedirs(current_tenant()['profiles_dir'], exist_ok=True)
+        with open(profile_file_path(profile['id'], 'folded'), 'w', encoding='utf-8') as folded_file:
+            for stack, count in sorted(profile['sampler'].counts.items()):
+                folded_file.write(f"{stack} {count}\n")
+        with open(profile_file_path(profile['id'], 'memory'), 'w', encoding='utf-8') as memory_file:
+            memory_file.write(allocation_summary(snapshot, profile['baseline'], peak_bytes, current_bytes))
+        with open(profile_file_path(profile['id'], 'meta'), 'w', encoding='utf-8') as meta_file:
+            json.dump(metadata, meta_file)
+        prune_profiles()
+        print(f"--- DEBUG: finish_request_profile: Stored profile {profile['id']} for {metadata['path']} ({metadata['duration_ms']} ms, {metadata['samples']} samples).")
+    except OSError as e:
+        print(f"--- DEBUG: finish_request_profile: ERROR storing profile {profile['id']}: {e}")
+    return metadata
+
+def list_profiles():
+    """Returns the current farm's stored profiles, newest first."""
+    profiles_dir = current_tenant()['profiles_dir']
+    if not os.path.isdir(profiles_dir):
+        return []
+    profiles = []
+    for file_name in os.listdir(profiles_dir):
+        if file_name.endswith('.json'):
+            try:
+                with open(os.path.join(profiles_dir, file_name), 'r', encoding='utf-8') as meta_file:
+                    profiles.append(json.load(meta_file))
+            except (OSError, ValueError) as e:
+                print(f"--- DEBUG: list_profiles: Skipping {file_name}: {e}")
+    return sorted(profiles, key=lambda profile: profile['created_at'], reverse=True)
+
+def prune_profiles():
+    """Deletes profiles beyond PROFILE_RETENTION, oldest first."""
+    for profile in list_profiles()[PROFILE_RETENTION:]:
+        for kind in list(PROFILE_FILES) + ['meta']:
+            try:
+                os.remove(profile_file_path(profile['id'], kind))
+            except (OSError, ValueError):
+                pass
+
+# --- Idempotent Submissions ---
+# Every add/edit form carries a one-time submission token (API clients send an Idempotency-Key header).
+# The first post claims the token with an exclusive file create in the farm's submissions directory, so a
+# retry that lands on any gunicorn worker sees the claim; once the write succeeds the outcome (flash messages
+# and redirect, or the JSON response) is stored with it. Retries within the window are answered from that
+# outcome without touching Google Sheets. Completed outcomes are also kept in a small in-memory index.
+SUBMISSION_TOKEN_FIELD = 'submission_token'
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+SUBMISSIONS_DIR_NAME = 'submissions'
+SUBMISSION_WINDOW_SECONDS = int(os.environ.get('SUBMISSION_WINDOW_SECONDS', '3600'))
+# How long a retry waits for the first attempt of the same submission to finish
+SUBMISSION_PENDING_WAIT_SECONDS = float(os.environ.get('SUBMISSION_PENDING_WAIT_SECONDS', '10'))
+# A claim file that still can't be read after this long was left by a worker that died while creating it
+SUBMISSION_UNREADABLE_CLAIM_SECONDS = 5
+SUBMISSION_INDEX_SIZE = 512
+SUBMISSION_PRUNE_INTERVAL_SECONDS = 300
+
+def new_submission_token():
+    """Returns a fresh token for a form's hidden submission_token field."""
+    return uuid.uuid4().hex
+
+def submission_key(token):
+    """Maps a form token or API idempotency key to a safe file name, or None when there is no token."""
+    token = (token or '').strip()
+    if not token:
+        return None
+    if len(token) == 32 and all(char in '0123456789abcdef' for char in token):
+        return token
+    # Client-chosen API keys can contain anything, so hash them
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()[:32]
+
+def submission_path(key):
+    return os.path.join(current_tenant()['submissions_dir'], f"{key}.json")
+
+def read_submission(key):
+    """Reads a claimed submission, or returns None if it doesn't exist."""
+    try:
+        with open(submission_path(key), 'r', encoding='utf-8') as submission_file:
+            return json.load(submission_file)
+    except (OSError, ValueError):
+        return None
 
-def get_all_farm_records_df():
+def write_submission(key, submission, exclusive=False):
     """
-    Retrieves all farm records as a pandas DataFrame,
-    prioritizing local CSV, then falling back to Google Sheets.
+    Atomically writes a submission file through a temp file, so readers never see it empty.
+    With exclusive=True it is published with os.link and raises FileExistsError if the token is already claimed.
     """
-    print("--- DEBUG: get_all_farm_records_df: Called to retrieve all farm records.")
-    
-    records = []
-    
-    # --- Step 1: Attempt to read from CSV first (new primary read source) ---
-    if USE_CSV_FALLBACK: # Only attempt CSV if the feature is enabled
-        print("--- DEBUG: get_all_farm_records_df: Attempting to read records from local CSV.")
-        records = read_records_from_csv(CSV_FILE_PATH)
-        if records:
-            print(f"--- DEBUG: get_all_farm_records_df: Successfully retrieved {len(records)} records from local CSV.")
-            flash("Records loaded from local CSV.", "info")
-            # If CSV has records, we'll process and return them.
-            # No need to try Google Sheets for reading in this path.
-        else:
-            print("--- DEBUG: get_all_farm_records_df: No records found in local CSV or CSV read failed.")
-            flash("No records found in local CSV. Attempting Google Sheet.", "info") # Inform user about fallback
-    else:
-        print("--- DEBUG: get_all_farm_records_df: CSV fallback disabled. Skipping CSV read.")
+    path = submission_path(key)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as submission_file:
+        json.dump(submission, submission_file)
+    if not exclusive:
+        os.replace(temp_path, path)
+        return
+    try:
+        os.link(temp_path, path)
+    finally:
+        os.remove(temp_path)
 
+def unreadable_claim_is_stale(key):
+    """True when an existing claim file can't be read and is too old to still be in the middle of being written."""
+    try:
+        return time.time() - os.path.getmtime(submission_path(key)) > SUBMISSION_UNREADABLE_CLAIM_SECONDS
+    except OSError:
+        return False # Removed in the meantime; the next claim attempt will tell
 
-    # --- Step 2: If CSV is empty or not used, attempt to retrieve from Google Sheets ---
-    if not records: # Only proceed to Google Sheets if no records were found from CSV
-        print("--- DEBUG: get_all_farm_records_df: Attempting to retrieve from Google Sheets.")
-        client = init_google_sheets_client()
-        if client:
-            sheet = get_sheet(client, GOOGLE_SHEET_ID)
-            if sheet:
-                try:
-                    records = sheet.get_all_records()
-                    if records:
-                        print(f"--- DEBUG: get_all_farm_records_df: Successfully retrieved {len(records)} records from Google Sheet.")
-                        flash("Records loaded from Google Sheet.", "success")
-                    else:
-                        print("--- DEBUG: get_all_farm_records_df: Google Sheet is empty.")
-                        flash("No records found in the Google Sheet.", "info")
-                except Exception as e:
-                    print(f"--- DEBUG: get_all_farm_records_df: ERROR retrieving records from Google Sheet: {e}")
-                    flash("Error retrieving records from Google Sheet. Check server logs.", "danger")
-            else:
-                flash(f"Could not open Google Sheet with ID '{GOOGLE_SHEET_ID}'. Check server logs.", "danger")
-        else:
-            flash("Google Sheets client could not be initialized for record retrieval.", "danger")
-    else:
-        print("--- DEBUG: get_all_farm_records_df: Records already retrieved from CSV. Skipping Google Sheets read.")
+def submission_index():
+    """Returns the current farm's in-memory index of completed submissions (key -> stored submission)."""
+    return tenant_state()['submissions']
 
+def claim_submission(scope, token):
+    """
+    Claims a submission token before its write runs.
+    Returns (True, None) when the caller should go ahead (including when no token was sent),
+    (False, submission) when the token was already used: the stored submission holds the first attempt's
+    outcome, or has status 'pending' if that attempt is still running after SUBMISSION_PENDING_WAIT_SECONDS.
+    """
+    key = submission_key(token)
+    if key is None:
+        return True, None
+    index = submission_index()
+    with _cache_lock:
+        submission = index.get(key)
+        if submission is not None and time.time() - submission['at'] <= SUBMISSION_WINDOW_SECONDS:
+            index.move_to_end(key)
+            print(f"--- DEBUG: claim_submission: Replaying {scope} submission {key} from the index.")
+            return False, submission
 
-    if not records:
-        print("--- DEBUG: get_all_farm_records_df: No records found from any source, returning empty DataFrame.")
-        return pd.DataFrame()
+    prune_submissions()
+    os.makedirs(current_tenant()['submissions_dir'], exist_ok=True)
+    deadline = time.time() + SUBMISSION_PENDING_WAIT_SECONDS
+    while True:
+        try:
+            write_submission(key, {'scope': scope, 'status': 'pending', 'at': time.time(), 'pid': os.getpid()}, exclusive=True)
+            return True, None
+        except FileExistsError:
+            submission = read_submission(key)
+            if submission is None:
+                # Empty or corrupt, e.g. written by a worker that died mid-write, or removed after a failed attempt
+                if unreadable_claim_is_stale(key):
+                    print(f"--- DEBUG: claim_submission: Releasing unreadable {scope} claim {key}.")
+                    release_submission(token)
+                    continue
+                if time.time() >= deadline:
+                    return False, {'scope': scope, 'status': 'pending', 'at': time.time()}
+                time.sleep(0.05)
+                continue
+            if time.time() - submission['at'] > SUBMISSION_WINDOW_SECONDS:
+                release_submission(token)
+                continue
+            if submission['status'] == 'pending' and not process_is_alive(submission['pid']):
+                # The worker handling the first attempt exited before finishing it
+                release_submission(token)
+                continue
+            if submission['status'] == 'done':
+                remember_submission(key, submission)
+                print(f"--- DEBUG: claim_submission: Replaying {scope} submission {key}.")
+                return False, submission
+            if time.time() >= deadline:
+                print(f"--- DEBUG: claim_submission: {scope} submission {key} is still pending.")
+                return False, submission
+            time.sleep(0.2)
+            continue
 
-    df = pd.DataFrame(records)
-    print(f"--- DEBUG: Initial DataFrame shape: {df.shape}")
-    print(f"--- DEBUG: Initial DataFrame columns (raw from source): {df.columns.tolist()}")
-    print(f"--- DEBUG: Initial DataFrame head:\n{df.head().to_string()}")
+def complete_submission(scope, token, outcome):
+    """Stores the outcome of a successful write so retries of the same token are answered with it."""
+    key = submission_key(token)
+    if key is None:
+        return
+    submission = {'scope': scope, 'status': 'done', 'at': time.time(), 'outcome': outcome}
+    try:
+        write_submission(key, submission)
+    except OSError as e:
+        print(f"--- DEBUG: complete_submission: ERROR storing submission {key}: {e}")
+    remember_submission(key, submission)
 
-    # Define desired standardized column names and common variations (lowercase, no spaces)
-    standardized_column_map = {
-        'Date': ['date', 'recorddate', 'transactiondate', 'timestamp'],
-        'Type': ['type', 'recordtype', 'recordkind', 'transactiontype'],
-        'Category': ['category', 'itemcategory', 'classification'],
-        'Item': ['item', 'description', 'product', 'detail'],
-        'Quantity': ['quantity', 'qty', 'amountbought', 'amountsold'],
-        'Unit': ['unit', 'uom', 'measure'],
-        'Amount': ['amount', 'expenditureamount', 'cost', 'totalcost', 'value'], # For expenditure
-        'Profit Per Unit': ['profitperunit', 'ppu', 'unitprofit', 'priceperunit'],
-        'Total Profit': ['totalprofit', 'profit', 'netsales', 'revenue']
-    }
+def remember_submission(key, submission):
+    index = submission_index()
+    with _cache_lock:
+        index[key] = submission
+        index.move_to_end(key)
+        while len(index) > SUBMISSION_INDEX_SIZE:
+            index.popitem(last=False)
 
-    # Normalize existing column names to facilitate matching
-    normalized_df_columns = {col.lower().replace(' ', ''): col for col in df.columns}
-    
-    # Create a mapping from current actual column names to desired standardized names
-    column_renaming_dict = {}
-    final_columns = set() # To keep track of columns we actually want to keep/rename to
+def release_submission(token):
+    """Drops a claim whose write failed, so the user's retry is processed normally."""
+    key = submission_key(token)
+    if key is None:
+        return
+    try:
+        os.remove(submission_path(key))
+    except OSError:
+        pass
 
-    for desired_name, variations in standardized_column_map.items():
-        found_match = False
-        for var in variations:
-            if var in normalized_df_columns:
-                original_matched_col = normalized_df_columns[var]
-                if original_matched_col != desired_name:
-                    column_renaming_dict[original_matched_col] = desired_name
-                else: # It's already the desired_name (case-sensitive)
-                    column_renaming_dict[original_matched_col] = desired_name # Ensure it's in the dict
-                found_match = True
-                final_columns.add(desired_name)
-                break
-        
-        # If a desired column is not found through variations or exact match
-        if not found_match and desired_name not in df.columns:
-            df[desired_name] = '' # Add as empty to prevent KeyError
-            final_columns.add(desired_name) # Add to final columns list
-            print(f"--- DEBUG: Critical column '{desired_name}' not found, added as empty.")
+def prune_submissions():
+    """Deletes submission files older than the dedupe window, at most once per SUBMISSION_PRUNE_INTERVAL_SECONDS."""
+    state = tenant_state()
+    now = time.time()
+    with _cache_lock:
+        if now - state.get('submissions_pruned_at', 0.0) < SUBMISSION_PRUNE_INTERVAL_SECONDS:
+            return
+        state['submissions_pruned_at'] = now
+    submissions_dir = current_tenant()['submissions_dir']
+    if not os.path.isdir(submissions_dir):
+        return
+    for file_name in os.listdir(submissions_dir):
+        path = os.path.join(submissions_dir, file_name)
+        try:
+            if now - os.path.getmtime(path) > SUBMISSION_WINDOW_SECONDS:
+                os.remove(path)
+        except OSError:
+            pass
 
+def replay_submission(submission, fallback_url):
+    """Answers a repeated form post from the first attempt's outcome."""
+    if submission['status'] != 'done':
+        flash('This form is still being saved. Check the records before submitting it again.', 'warning')
+        return redirect(fallback_url)
+    outcome = submission['outcome']
+    flash(f"{outcome['message']} This form was already submitted, so it was not saved again.", 'info')
+    return redirect(outcome.get('redirect') or fallback_url)
 
-    # Apply the renaming
-    if column_renaming_dict:
-        df.rename(columns=column_renaming_dict, inplace=True)
-    
-    # Reorder columns to a consistent display order (optional but good for consistency)
-    ordered_display_columns = [
-        'Date', 'Type', 'Category', 'Item', 'Quantity', 'Unit', 
-        'Amount', 'Profit Per Unit', 'Total Profit'
-    ]
-    
-    # Filter for columns that actually exist in the DataFrame (including newly added empty ones)
-    df_columns_as_set = set(df.columns)
-    columns_to_reorder = [col for col in ordered_display_columns if col in df_columns_as_set]
-    
-    # Add any original columns that weren't part of our standardized map to the end
-    for col in df.columns:
-        if col not in columns_to_reorder:
-            columns_to_reorder.append(col)
+# --- JSON API Helpers ---
+API_DEFAULT_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 500
+API_MAX_BATCH_SIZE = 500
+RECORD_TYPES = ('feed_input', 'expenditure', 'profit')
 
-    df = df[columns_to_reorder]
-    
-    print(f"--- DEBUG: After standardization and adding missing, DataFrame columns: {df.columns.tolist()}")
-    print(f"--- DEBUG: DataFrame head after column processing:\n{df.head().to_string()}")
+class ApiError(Exception):
+    """An API request problem that should be answered with a JSON error and status code."""
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
 
-    # Normalize 'Type', 'Category', and 'Item' column values to lowercase for consistent filtering
-    if 'Type' in df.columns:
-        df['Type'] = df['Type'].astype(str).str.lower()
-        print("--- DEBUG: get_all_farm_records_df: 'Type' column values lowercased.")
-    
-    if 'Category' in df.columns:
-        df['Category'] = df['Category'].astype(str).str.lower()
-        print("--- DEBUG: get_all_farm_records_df: 'Category' column values lowercased.")
-    
-    if 'Item' in df.columns:
-        df['Item'] = df['Item'].astype(str).str.lower()
-        print("--- DEBUG: get_all_farm_records_df: 'Item' column values lowercased.")
+def parse_api_date(value, name):
+    """Parses an optional YYYY-MM-DD query parameter, raising ApiError when it is malformed."""
+    if not value:
+        return None
+    parsed = pd.to_datetime(value, errors='coerce')
+    if pd.isna(parsed):
+        raise ApiError(f"Invalid '{name}' date: {value!r}. Use YYYY-MM-DD.")
+    return parsed.normalize()
 
+def filter_records(df, start_date=None, end_date=None, record_type=None, category=None):
+    """Filters a records DataFrame by inclusive date range, type and category (matched on category codes)."""
+    mask = pd.Series(True, index=df.index)
+    if start_date is not None:
+        mask &= df['Date'] >= start_date
+    if end_date is not None:
+        # end_date is a day, so include everything up to its end
+        mask &= df['Date'] < end_date + pd.Timedelta(days=1)
+    if record_type:
+        mask &= category_mask(df['Type'], record_type.lower())
+    if category:
+        mask &= category_mask(df['Category'], category.lower())
+    return df[mask]
 
-    # Check for critical columns and flash warnings if they were added as empty
-    critical_columns_for_warning = ['Date', 'Type', 'Amount', 'Total Profit']
-    for col_name in critical_columns_for_warning:
-        if col_name in df.columns and df[col_name].empty and not records: # Only flash if df is entirely empty from the start
-            continue # Don't flash if no records at all
-        
-        # Check if the column exists and if it's uniformly empty/missing in a non-empty df
-        if col_name in df.columns and not df.empty and df[col_name].astype(str).str.strip().eq('').all():
-             flash_message = f"Warning: The '{col_name}' column appears to be empty or was not explicitly found in your data source. Report data for this column might be missing or inaccurate. Please ensure your Google Sheet/CSV has a column specifically named '{col_name}' or a common variation."
-             if 'Date' in col_name:
-                 flash_message = f"Warning: The '{col_name}' column appears to be empty or was not explicitly found. Please ensure your Google Sheet/CSV has a column specifically named '{col_name}' for accurate reporting."
-             elif 'Type' in col_name:
-                  flash_message = f"Warning: The '{col_name}' column appears to be empty or was not explicitly found. Report filtering might be inaccurate. Please ensure your Google Sheet/CSV has a column specifically named '{col_name}'."
-             flash(flash_message, "warning")
+def records_to_api_json(df):
+    """Converts record rows to compact snake_case dictionaries, each carrying its locator as 'id'."""
+    columns = [col for col in RECORD_HEADERS if col in df.columns]
+    out = display_frame(df[columns]).rename(columns=lambda col: col.replace(' ', '_').lower())
+    out['date'] = out['date'].dt.strftime('%Y-%m-%d')
+    rows = out.to_dict(orient='records')
+    for locator, row in zip(df.index, rows):
+        row['id'] = locator
+    return rows
 
+def record_page_keys(df):
+    """
+    Keyset columns the API pages by: date, then partition (legacy first), then position within it.
+    New records sort after the rows of their date already served, so pages never skip or repeat them.
+    """
+    partitions, positions = zip(*(locator.rsplit(':', 1) for locator in df.index)) if len(df) else ((), ())
+    return pd.DataFrame({
+        'date': df['Date'].to_numpy(),
+        'partition': ['' if key == LEGACY_PARTITION_KEY else key for key in partitions],
+        'position': [int(position) for position in positions],
+    }, index=df.index)
 
-    # Ensure 'Date' column is in datetime format AFTER ensuring it exists and is named correctly
-    if 'Date' in df.columns:
-        print(f"--- DEBUG: 'Date' column dtype (before convert): {df['Date'].dtype}")
-        print(f"--- DEBUG: 'Date' column values (before convert, head):\n{df['Date'].head().to_string()}")
+def record_fingerprints(df):
+    """Hashes each row's record values, so a cursor can find its last record again after rows moved."""
+    columns = [col for col in RECORD_HEADERS if col in df.columns]
+    return pd.util.hash_pandas_object(df[columns], index=False)
 
-        initial_rows_before_dropna = df.shape[0]
-        
-        # Convert date column, coercing errors to NaT
-        df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
-        
-        print(f"--- DEBUG: After pd.to_datetime, 'Date' column dtype: {df['Date'].dtype}")
-        print(f"--- DEBUG: 'Date' column values (after convert, head):\n{df['Date'].head().to_string()}")
-        print(f"--- DEBUG: Count of NaT values in 'Date' column: {df['Date'].isna().sum()}")
+def resume_position(df, keys, last_key):
+    """
+    Returns the position the cursor's last record has now. An edit that moves a record to another period
+    deletes its old row, shifting the later rows of that partition up, so the record is looked up by its
+    fingerprint among the rows of its date and partition at or before its old position. If it is gone
+    itself, the rows after it moved up by one.
+    """
+    last_date, last_partition, last_position, fingerprint = last_key
+    if fingerprint is None:
+        return last_position
+    group = keys[(keys['date'] == last_date) & (keys['partition'] == last_partition) & (keys['position'] <= last_position)]
+    matches = group['position'][record_fingerprints(df.loc[group.index]).to_numpy() == fingerprint]
+    return int(matches.max()) if len(matches) else last_position - 1
 
-        # Drop rows where 'Date' became NaT (invalid date)
-        df.dropna(subset=['Date'], inplace=True)
-        
-        print(f"--- DEBUG: After dropna(subset=['Date']), DataFrame shape: {df.shape}")
-        if df.shape[0] < initial_rows_before_dropna:
-            dropped_rows_count = initial_rows_before_dropna - df.shape[0]
-            print(f"--- DEBUG: {dropped_rows_count} rows dropped due to invalid 'Date' values.")
-            if dropped_rows_count > 0 and df.empty:
-                 flash(f"Warning: All records were removed because their 'Date' column contained invalid or empty date formats. Please check your Google Sheet/CSV.", "warning")
-            elif dropped_rows_count > 0:
-                 flash(f"Warning: Some records were removed because their 'Date' column contained invalid or empty date formats. Please check your Google Sheet/CSV. Remaining records: {df.shape[0]}", "warning")
+def encode_cursor(last_key, data_version):
+    """Encodes the keyset of the last record served, (date, partition, position, fingerprint), as an opaque URL-safe cursor."""
+    date, partition, position, fingerprint = last_key
+    payload = json.dumps({'d': pd.Timestamp(date).isoformat(), 'p': partition, 'n': int(position), 'h': int(fingerprint),
+                          'v': data_version}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
 
-    else:
-        print("--- DEBUG: 'Date' column still missing or invalid after all checks, returning empty DataFrame.")
-        flash("Error: Failed to establish a valid 'Date' column. Reports cannot be generated. Please ensure your Google Sheet/CSV has a column for dates (e.g., 'Date').", "danger")
-        return pd.DataFrame()
+def decode_cursor(cursor):
+    """Decodes a cursor from encode_cursor(); returns (last key or None, data_version)."""
+    if not cursor:
+        return None, None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        fingerprint = int(payload['h']) if payload.get('h') is not None else None
+        return (pd.Timestamp(payload['d']), str(payload['p']), int(payload['n']), fingerprint), payload.get('v')
+    except Exception:
+        raise ApiError("Invalid cursor.")
 
-    # Convert relevant numeric columns after date processing, as errors='coerce' might be needed
-    # for columns that might have mixed types from Google Sheets.
-    for col in ['Quantity', 'Amount', 'Profit Per Unit', 'Total Profit']:
-        if col in df.columns:
-            # Explicitly convert to numeric, fill NaN, and then ensure float type
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(float)
-    
-    print(f"--- DEBUG: Final DataFrame shape being returned: {df.shape}")
-    print(f"--- DEBUG: Final DataFrame head being returned:\n{df.head().to_string()}")
-    return df
+def validate_api_record(raw):
+    """
+    Validates one record posted to the API and returns it in the shape save_record() expects.
+    Raises ApiError describing the first problem found.
+    """
+    if not isinstance(raw, dict):
+        raise ApiError("Each record must be a JSON object.")
+    record_type = str(raw.get('type', '')).strip().lower()
+    if record_type not in RECORD_TYPES:
+        raise ApiError(f"'type' must be one of {', '.join(RECORD_TYPES)}.")
+    date_value = raw.get('date') or datetime.now().strftime('%Y-%m-%d')
+    parsed_date = pd.to_datetime(date_value, errors='coerce')
+    if pd.isna(parsed_date):
+        raise ApiError(f"Invalid 'date': {date_value!r}. Use YYYY-MM-DD.")
+    data = {'date': parsed_date.strftime('%Y-%m-%d'), 'type': record_type}
+    for field in ('category', 'item'):
+        value = str(raw.get(field, '') or '').strip()
+        if not value:
+            raise ApiError(f"'{field}' is required.")
+        data[field] = value
 
-def update_record_in_sheet(row_index_in_sheet, updated_data_dict, df_record_index=None):
-    """Updates a specific row in the Google Sheet and optionally in local CSV."""
-    google_sheet_success = False
-    
-    client = init_google_sheets_client()
-    if client:
-        sheet = get_sheet(client, GOOGLE_SHEET_ID)
-        if sheet:
-            try:
-                # Define the exact order of columns as they appear in the Google Sheet headers.
-                ordered_headers = ['Date', 'Type', 'Category', 'Item', 'Quantity', 'Unit', 'Amount', 'Profit Per Unit', 'Total Profit']
-                row_values = [updated_data_dict.get(header.replace(' ', '_').lower(), '') for header in ordered_headers]
-                
-                # Update in Google Sheet
-                range_name = f'A{row_index_in_sheet}:{chr(ord("A") + len(ordered_headers) - 1)}{row_index_in_sheet}'
-                sheet.update(range_name, [row_values])
-                print(f"--- DEBUG: update_record_in_sheet: Successfully updated row {row_index_in_sheet} in Google Sheet.")
-                google_sheet_success = True
-                flash('Record updated successfully in Google Sheet!', 'success')
-            except Exception as e:
-                print(f"--- DEBUG: update_record_in_sheet: ERROR updating Google Sheet row {row_index_in_sheet}: {e}")
-                flash('Failed to update record in Google Sheet. Check server logs.', 'danger')
-        else:
-            flash(f"Could not open Google Sheet with ID '{GOOGLE_SHEET_ID}'. Check server logs.", "danger")
+    def number(field):
+        try:
+            return float(raw[field])
+        except (KeyError, TypeError, ValueError):
+            raise ApiError(f"'{field}' must be a number.")
+
+    if record_type == 'feed_input':
+        data['quantity'] = number('quantity')
+        data['unit'] = raw.get('unit') or 'kg'
+    elif record_type == 'expenditure':
+        data['amount'] = number('amount')
     else:
-        flash("Google Sheets client could not be initialized for update. Check server logs.", "danger")
+        data['quantity'] = number('quantity')
+        data['profit_per_unit'] = number('profit_per_unit')
+        data['total_profit'] = data['quantity'] * data['profit_per_unit']
+        data['unit'] = raw.get('unit') or profit_unit_for_item(data['item'])
+    return data
 
-    csv_success = False
-    if USE_CSV_FALLBACK:
-        if not google_sheet_success: # Only flash this warning if Google Sheet update failed
-            flash("Google Sheet update failed. Attempting to update local CSV (data may not persist).", "warning")
-        
-        all_records_df = pd.DataFrame(read_records_from_csv(CSV_FILE_PATH))
-        
-        # Google Sheet row_index_in_sheet is 1-indexed for headers + actual row
-        # DataFrame index is 0-indexed.
-        # So df_index = row_index_in_sheet - 2 
-
-        # Use df_record_index passed from the calling function
-        if not all_records_df.empty and df_record_index is not None and 0 <= df_record_index < len(all_records_df):
-            # Update the DataFrame at the specific index
-            for key, value in updated_data_dict.items():
-                # Find the actual column name in the DataFrame (which might have mixed casing or spaces)
-                # and update the cell using .at for label-based indexing
-                matched_cols = [col for col in all_records_df.columns if col.replace(' ', '_').lower() == key]
-                if matched_cols:
-                    col_name_in_df = matched_cols[0]
-                    all_records_df.at[df_record_index, col_name_in_df] = value
-                
-            csv_success = write_records_to_csv(CSV_FILE_PATH, all_records_df)
-            if csv_success:
-                flash("Record also updated in local CSV.", "info")
-            else:
-                flash("Failed to update record in local CSV.", "danger")
-        elif not all_records_df.empty:
-            print(f"--- DEBUG: update_record_in_sheet: DataFrame index {df_record_index} out of bounds for CSV update (df size: {len(all_records_df)})")
-            flash("Could not find record in local CSV for update. It might not exist there yet.", "warning")
-        else:
-             print(f"--- DEBUG: update_record_in_sheet: No records in CSV for update.")
-             flash("No records in local CSV to update.", "info")
+def report_range(period, reference_date):
+    """Returns (start, end, label) of the monthly or weekly report period containing reference_date."""
+    reference_date = pd.Timestamp(reference_date).normalize()
+    if period == 'monthly':
+        start = reference_date.replace(day=1)
+        return start, start + pd.offsets.MonthEnd(0), start.strftime('%B %Y')
+    if period == 'weekly':
+        start = reference_date - pd.Timedelta(days=reference_date.weekday())
+        end = start + pd.Timedelta(days=6)
+        return start, end, f"{start.strftime('%Y-%m-%d')} to {end.strftime('%Y-%m-%d')}"
+    raise ApiError("'period' must be 'monthly' or 'weekly'.")
 
-    return google_sheet_success or csv_success # Return true if either save method succeeded
+def build_report_payload(df, period, reference_date):
+    """Totals and per type/category breakdown of a report period, computed from the records frame."""
+    start, end, label = report_range(period, reference_date)
+    period_records = filter_records(df, start, end) if not df.empty else df
+    payload = {
+        'period': period,
+        'label': label,
+        'start': start.strftime('%Y-%m-%d'),
+        'end': end.strftime('%Y-%m-%d'),
+        'record_count': int(len(period_records)),
+        'total_profit': 0.0,
+        'total_expenditure': 0.0,
+        'by_category': [],
+    }
+    if period_records.empty:
+        return payload
+    payload['total_profit'] = get_safe_sum(period_records[category_mask(period_records['Type'], 'profit')], 'Total Profit')
+    payload['total_expenditure'] = get_safe_sum(period_records[category_mask(period_records['Type'], 'expenditure')], 'Amount')
+    grouped = (
+        period_records.astype({'Quantity': 'float64'})
+        .groupby(['Type', 'Category'], observed=True)[['Quantity', 'Amount', 'Total Profit']]
+        .sum()
+        .round(2)
+        .reset_index()
+    )
+    payload['by_category'] = [
+        {'type': row['Type'], 'category': row['Category'], 'quantity': row['Quantity'],
+         'amount': row['Amount'], 'total_profit': row['Total Profit']}
+        for row in grouped.to_dict(orient='records')
+    ]
+    return payload
 
 
 def create_app():
@@ -573,10 +3621,13 @@ def create_app():
         app_instance.root_path = os.path.dirname(os.path.abspath(__file__))
         print(f"--- DEBUG: app.py: Running in normal environment. app_instance.root_path: {app_instance.root_path}")
 
-    # Set CSV_FILE_PATH globally here after app_instance.root_path is determined
-    global CSV_FILE_PATH
-    CSV_FILE_PATH = os.path.join(app_instance.root_path, CSV_FILE_NAME)
-    print(f"--- DEBUG: CSV_FILE_PATH set to: {CSV_FILE_PATH}")
+    # Build the farm settings now that app_instance.root_path is determined; each farm gets
+    # its own sheet ID and storage paths
+    global TENANTS
+    TENANTS = load_tenants(app_instance.root_path)
+    for tenant in TENANTS.values():
+        print(f"--- DEBUG: Farm '{tenant['id']}': CSV at {tenant['csv_file_path']}, partitions in {tenant['partition_dir']}")
+    print(f"--- DEBUG: Record partitioning: {RECORD_PARTITIONING}")
     print(f"--- DEBUG: USE_CSV_FALLBACK is set to: {USE_CSV_FALLBACK}")
 
 
@@ -597,46 +3648,119 @@ def create_app():
         if request.method == 'POST':
             username = request.form['username']
             password = request.form['password']
-            
-            # --- START NEW DEBUG PRINTS ---
-            print(f"--- DEBUG: Login Debug - Raw Received username: {username!r} (len: {len(username)})")
-            print(f"--- DEBUG: Login Debug - Raw Received password: {password!r} (len: {len(password)})")
-            print(f"--- DEBUG: Login Debug - Raw Expected username: {ADMIN_USERNAME!r} (len: {len(ADMIN_USERNAME)})")
-            print(f"--- DEBUG: Login Debug - Raw Expected password: {ADMIN_PASSWORD!r} (len: {len(ADMIN_PASSWORD)})")
-            print(f"--- DEBUG: Login Debug - Username comparison: {username == ADMIN_USERNAME}")
-            print(f"--- DEBUG: Login Debug - Password comparison: {password == ADMIN_PASSWORD}")
-            # --- END NEW DEBUG PRINTS ---
-
-            if username == ADMIN_USERNAME and password == ADMIN_PASSWORD:
+            # The farm comes from the login form when several are served, else from the request host
+            tenant = TENANTS.get(request.form.get('farm') or current_tenant()['id']) or current_tenant()
+
+            if tenant['admin_username'] and username == tenant['admin_username'] and password == tenant['admin_password']:
                 session['logged_in'] = True
+                session['tenant'] = tenant['id']
+                set_current_tenant(tenant['id'])
                 flash('Logged in successfully!', 'success')
                 print("--- DEBUG: Login successful.")
                 return redirect(url_for('admin_dashboard'))
             else:
                 flash('Invalid credentials. Please try again.', 'danger')
                 print("--- DEBUG: Login failed: Invalid credentials.")
-        return render_template('login.html')
+        return render_template('login.html', farms=list(TENANTS.values()) if len(TENANTS) > 1 else [],
+                               selected_farm=current_tenant()['id'])
 
     @app_instance.route('/logout')
     def logout():
         print("--- DEBUG: app.py: logout() route called.")
         session.pop('logged_in', None)
+        session.pop('tenant', None)
         flash('You have been logged out.', 'info')
         return redirect(url_for('index'))
 
+    @app_instance.before_request
+    def start_profiling():
+        # Registered first so the profile covers the other hooks, the view and template rendering
+        if not profile_requested():
+            return None
+        if not session.get('logged_in') or not request_tenant()[1]:
+            return None # Profiling is for this farm's admins only; the flag is ignored otherwise
+        profile = start_request_profile()
+        if profile is None:
+            g.profile_busy = True
+            print("--- DEBUG: start_profiling: Another request is being profiled; running this one unprofiled.")
+        else:
+            g.request_profile = profile
+        return None
+
+    @app_instance.after_request
+    def finish_profiling(response):
+        # after_request hooks run in reverse order, so this one runs last (after compression)
+        profile = g.pop('request_profile', None)
+        if profile is None:
+            if g.get('profile_busy'):
+                response.headers['X-Profile-Status'] = 'busy'
+            return response
+        metadata = finish_request_profile(profile, response)
+        response.headers['X-Profile-Id'] = metadata['id']
+        response.headers['X-Profile-Url'] = url_for('download_profile', profile_id=metadata['id'], kind='folded')
+        return response
+
+    @app_instance.teardown_request
+    def abandon_profiling(error=None):
+        # A request that raised never reaches after_request; still stop the sampler and store what was captured
+        profile = g.pop('request_profile', None)
+        if profile is not None:
+            finish_request_profile(profile)
+
+    @app_instance.before_request
+    def select_tenant():
+        tenant_id, session_valid = request_tenant()
+        if not session_valid:
+            session.pop('logged_in', None)
+            session.pop('tenant', None)
+        set_current_tenant(tenant_id)
+
+    @app_instance.context_processor
+    def inject_farm():
+        # Only show the farm name when this process serves more than one
+        return {'farm_name': current_tenant()['name'] if len(TENANTS) > 1 else None,
+                'new_submission_token': new_submission_token}
+
     @app_instance.before_request
     def require_login():
         print(f"--- DEBUG: app.py: before_request called for endpoint: {request.endpoint}")
-        if request.endpoint in ['admin_dashboard', 'view_records', 'export_records', 'edit_record', 'view_monthly_report', 'view_weekly_report', 'add_record', 'send_custom_sms'] and not session.get('logged_in'):
+        if request.path.startswith('/api/'):
+            # The data helpers flash messages meant for HTML pages; remember the queue so
+            # API calls leave it as they found it
+            g.flashes_before_api = list(session.get('_flashes', []))
+            if not session.get('logged_in'):
+                return jsonify({'error': 'Authentication required. Log in first.'}), 401
+            return None
+        if request.endpoint in ['admin_dashboard', 'view_records', 'export_records', 'edit_record', 'view_monthly_report', 'view_weekly_report', 'add_record', 'send_custom_sms', 'jobs', 'job_status', 'download_job', 'feed_stock', 'rebuild_feed', 'snapshots', 'download_snapshot', 'import_snapshot', 'profiles', 'download_profile', 'quarantine', 'fix_quarantined_record'] and not session.get('logged_in'):
             flash('Please log in to access this page.', 'warning')
             print(f"--- DEBUG: Redirecting to login for endpoint: {request.endpoint}")
             return redirect(url_for('login'))
 
+    @app_instance.after_request
+    def compress_response(response):
+        return compress_response_body(response)
+
+    @app_instance.after_request
+    def discard_api_flashes(response):
+        if 'flashes_before_api' in g and session.get('_flashes', []) != g.flashes_before_api:
+            if g.flashes_before_api:
+                session['_flashes'] = g.flashes_before_api
+            else:
+                session.pop('_flashes', None)
+        return response
+
+    @app_instance.errorhandler(ApiError)
+    def handle_api_error(error):
+        return jsonify({'error': error.message}), error.status_code
+
     @app_instance.route('/admin')
     def admin_dashboard():
         print("--- DEBUG: app.py: admin_dashboard() route called.")
         stats = get_farm_statistics()
-        return render_template('admin.html', stats=stats)
+        analytics = get_livestock_analytics()
+        low_feed = [item for item in get_feed_stock() if item['low_stock']]
+        return render_template('admin.html', stats=stats, analytics=analytics, low_feed=low_feed,
+                               quarantined_count=len(get_quarantined_records()))
 
     @app_instance.route('/admin/add_record', methods=['POST'])
     def add_record():
@@ -645,10 +3769,18 @@ def create_app():
             flash('Unauthorized access.', 'danger')
             return redirect(url_for('login'))
 
-        record_type = request.form['record_type']
+        # A retried post (flaky connection, double click) is answered without writing again
+        submission_token = request.form.get(SUBMISSION_TOKEN_FIELD)
+        claimed, submission = claim_submission('add_record', submission_token)
+        if not claimed:
+            return replay_submission(submission, url_for('admin_dashboard'))
+
         data = {'date': datetime.now().strftime('%Y-%m-%d')}
+        success = False
 
+        # From here on the claim is released on every path that doesn't save the record
         try:
+            record_type = request.form['record_type']
             if record_type == 'feed':
                 data['type'] = 'feed_input'
                 data['category'] = request.form['feed_category']
@@ -657,7 +3789,12 @@ def create_app():
                 data['unit'] = 'kg'
                 success = save_record('feed', data)
                 if success:
-                    flash('Feed record added successfully!', 'success')
+                    if record_feed_movements(feed_consumption_movements([data])):
+                        success_message = 'Feed record added successfully!'
+                        flash(success_message, 'success')
+                    else:
+                        success_message = 'Feed record added, but feed stock could not be fully updated.'
+                        flash(success_message, 'warning')
                 else:
                     # Flash message already handled inside save_record
                     pass
@@ -668,7 +3805,8 @@ def create_app():
                 data['amount'] = float(request.form['exp_amount'])
                 success = save_record('expenditure', data)
                 if success:
-                    flash('Expenditure record added successfully!', 'success')
+                    success_message = 'Expenditure record added successfully!'
+                    flash(success_message, 'success')
                 else:
                     # Flash message already handled inside save_record
                     pass
@@ -679,21 +3817,30 @@ def create_app():
                 data['quantity'] = float(request.form['profit_quantity']) # Changed to float for consistency
                 data['profit_per_unit'] = float(request.form['profit_per_unit'])
                 data['total_profit'] = data['quantity'] * data['profit_per_unit']
-                data['unit'] = 'crates' if 'Eggs' in data['item'] else ('birds' if 'Birds' in data['item'] else 'units')
+                data['unit'] = profit_unit_for_item(data['item'])
                 success = save_record('profit', data)
                 if success:
-                    flash('Profit record added successfully!', 'success')
+                    success_message = 'Profit record added successfully!'
+                    flash(success_message, 'success')
                 else:
                     # Flash message already handled inside save_record
                     pass
             else:
                 flash('Invalid record type.', 'danger')
+        except KeyError as e:
+            flash(f'Missing form field: {e.args[0]}.', 'danger')
         except ValueError:
             flash('Invalid input for quantity, amount, or profit per unit. Please enter numbers.', 'danger')
         except Exception as e:
             flash(f'An unexpected error occurred: {e}', 'danger')
             print(f"Error adding record: {e}")
+        finally:
+            if not success:
+                release_submission(submission_token)
 
+        if success:
+            complete_submission('add_record', submission_token,
+                                {'message': success_message, 'redirect': url_for('admin_dashboard')})
         return redirect(url_for('admin_dashboard'))
 
     @app_instance.route('/admin/send_sms', methods=['POST'])
@@ -755,15 +3902,25 @@ def create_app():
             flash('Please log in to view records.', 'warning')
             return redirect(url_for('login'))
 
-        df_records = get_all_farm_records_df()
+        query = request.args.get('q', '').strip()
+        detail = request.args.get('detail') == '1'
+        df_records = get_all_farm_records_df(copy=False, detail=detail)
         if df_records.empty:
             flash("No records available to display.", "info")
-            return render_template('view_records.html', records=[], columns=[])
+            return render_template('view_records.html', records=[], columns=[], query=query, detail=detail)
 
-        records_list = df_records.to_dict(orient='records')
-        columns = df_records.columns.tolist()
+        def render():
+            positions, corrections = search_records(df_records, query) if query else (list(range(len(df_records))), {})
+            records_list = frame_to_records(df_records.iloc[positions])
+            columns = df_records.columns.tolist()
+            # Edit links address rows by their position in the full record list
+            return render_template('view_records.html', records=records_list, columns=columns, record_positions=positions,
+                                   query=query, corrections=corrections, quarantined_count=len(get_quarantined_records()),
+                                   detail=detail, summary_rows=df_records.attrs.get('summary_rows', 0))
 
-        return render_template('view_records.html', records=records_list, columns=columns)
+        # Repeat visits with unchanged data get a 304 instead of the full table
+        etag = records_etag(df_records, 'view_records.html', query, detail)
+        return conditional_response(etag, df_records.attrs.get('loaded_at'), render)
 
     @app_instance.route('/admin/edit_record/<int:record_index>', methods=['GET', 'POST'])
     def edit_record(record_index):
@@ -772,7 +3929,9 @@ def create_app():
             flash('Please log in to edit records.', 'warning')
             return redirect(url_for('login'))
 
-        df_records = get_all_farm_records_df()
+        # Positions refer to the list the link came from: with or without archived detail rows
+        detail = request.args.get('detail') == '1'
+        df_records = get_all_farm_records_df(detail=detail)
         
         # --- DEBUG: Added to confirm DataFrame size ---
         print(f"--- DEBUG: edit_record: Retrieved {len(df_records)} records from get_all_farm_records_df().")
@@ -791,58 +3950,90 @@ def create_app():
             flash("Record not found for editing.", "danger")
             return redirect(url_for('view_records'))
 
-        record_to_edit = df_records.iloc[record_index].to_dict()
+        record_to_edit = frame_to_records(df_records.iloc[[record_index]])[0]
         # Ensure keys are lowercase and snake_case for consistency with form data
         formatted_record = {k.replace(' ', '_').lower(): v for k, v in record_to_edit.items()}
         
-        # The sheet_row_number is 1-indexed and accounts for header row
-        # If your records are from df.get_all_records() which skips headers,
-        # then the sheet row for df.iloc[index] is index + 2
-        sheet_row_number = record_index + 2 
-
+        # The index label locates the row inside its partition ('partition_key:position')
+        record_locator = df_records.index[record_index]
+        if record_locator.startswith((SUMMARY_PARTITION_PREFIX, HISTORY_PARTITION_PREFIX)):
+            flash("Compacted history records are read-only.", "warning")
+            return redirect(url_for('view_records', detail='1' if detail else None))
+        form_action = url_for('edit_record', record_index=record_index, detail='1' if detail else None)
 
         if request.method == 'POST':
-            updated_data = {
-                'date': request.form['date'],
-                'type': request.form['type'],
-                'category': request.form['category'],
-                'item': request.form['item'],
-                'quantity': request.form.get('quantity', ''),
-                'unit': request.form.get('unit', ''),
-                'amount': request.form.get('amount', ''),
-                'profit_per_unit': request.form.get('profit_per_unit', ''),
-                'total_profit': request.form.get('total_profit', '')
-            }
-            
-            for key in ['quantity', 'amount', 'profit_per_unit', 'total_profit']:
-                if updated_data[key]:
-                    try:
-                        updated_data[key] = float(updated_data[key])
-                        # Keep quantity as float to preserve decimal values if they exist
-                    except ValueError:
-                        flash(f"Invalid number for {key.replace('_', ' ').title()}. Please enter a valid number.", "danger")
-                        return render_template('edit_record.html', record=formatted_record, record_index=record_index)
-                else:
-                    updated_data[key] = '' # Ensure empty string for missing/invalid numeric fields
-
-            if updated_data.get('quantity') != '' and updated_data.get('profit_per_unit') != '':
-                try:
-                    updated_data['total_profit'] = float(updated_data['quantity']) * float(updated_data['profit_per_unit'])
-                except ValueError:
-                    updated_data['total_profit'] = '' # Set to empty if calculation fails
+            updated_data, error = record_from_form(request.form)
+            if error:
+                flash(error, "danger")
+                return render_template('edit_record.html', record=formatted_record, record_index=record_index, form_action=form_action)
 
-            # Pass record_index as df_record_index to update_record_in_sheet for CSV updates
-            success = update_record_in_sheet(sheet_row_number, updated_data, record_index)
+            submission_token = request.form.get(SUBMISSION_TOKEN_FIELD)
+            claimed, submission = claim_submission('edit_record', submission_token)
+            if not claimed:
+                return replay_submission(submission, url_for('view_records'))
+            success = False
+            try:
+                success = update_record_in_sheet(record_locator, updated_data, expected=record_to_edit)
+            finally:
+                if not success:
+                    release_submission(submission_token)
             if success:
                 flash('Record updated successfully!', 'success')
+                complete_submission('edit_record', submission_token,
+                                    {'message': 'Record updated successfully!', 'redirect': url_for('view_records')})
                 return redirect(url_for('view_records'))
             else:
                 # Flash message already handled inside update_record_in_sheet
-                pass
-                return render_template('edit_record.html', record=formatted_record, record_index=record_index)
+                return render_template('edit_record.html', record=formatted_record, record_index=record_index, form_action=form_action)
+
+        return render_template('edit_record.html', record=formatted_record, record_index=record_index, form_action=form_action)
+
+
+    @app_instance.route('/admin/quarantine')
+    def quarantine():
+        print("--- DEBUG: app.py: quarantine() route called.")
+        get_all_farm_records_df(copy=False) # Validates any new or changed partitions
+        return render_template('quarantine.html', quarantined=get_quarantined_records(),
+                               columns=RECORD_HEADERS)
+
+    @app_instance.route('/admin/quarantine/<locator>', methods=['GET', 'POST'])
+    def fix_quarantined_record(locator):
+        print(f"--- DEBUG: app.py: fix_quarantined_record() route called for {locator}.")
+        get_all_farm_records_df(copy=False)
+        entry = next((entry for entry in get_quarantined_records() if entry['locator'] == locator), None)
+        if entry is None:
+            flash("That record is no longer in quarantine. It may already have been fixed.", "info")
+            return redirect(url_for('quarantine'))
+        formatted_record = {str(k).replace(' ', '_').lower(): v for k, v in entry['record'].items()}
 
-        return render_template('edit_record.html', record=formatted_record, record_index=record_index)
+        def render():
+            return render_template('edit_record.html', record=formatted_record, record_index=locator,
+                                   form_action=url_for('fix_quarantined_record', locator=locator), problems=entry['problems'])
 
+        if request.method == 'POST':
+            updated_data, error = record_from_form(request.form)
+            if error:
+                flash(error, "danger")
+                return render()
+            submission_token = request.form.get(SUBMISSION_TOKEN_FIELD)
+            claimed, submission = claim_submission('fix_quarantined_record', submission_token)
+            if not claimed:
+                return replay_submission(submission, url_for('quarantine'))
+            success = False
+            try:
+                success = update_record_in_sheet(locator, updated_data, expected=entry['record'])
+            finally:
+                if not success:
+                    release_submission(submission_token)
+            if not success:
+                return render()
+            # The row is validated again when its partition is next read
+            flash('Record fixed. It leaves quarantine once it passes validation.', 'success')
+            complete_submission('fix_quarantined_record', submission_token,
+                                {'message': 'Record fixed.', 'redirect': url_for('quarantine')})
+            return redirect(url_for('quarantine'))
+
+        return render()
 
     @app_instance.route('/admin/export_records')
     def export_records():
@@ -851,59 +4042,209 @@ def create_app():
             flash('Please log in to export records.', 'warning')
             return redirect(url_for('login'))
 
-        df_records = get_all_farm_records_df()
+        detail = request.args.get('detail') == '1'
+        df_records = get_all_farm_records_df(detail=detail)
         if df_records.empty:
             flash("No records available to export.", "warning")
             return redirect(url_for('view_records'))
 
-        output = io.BytesIO()
-        workbook = openpyxl.Workbook()
-        sheet = workbook.active
-        sheet.title = "Farm Records"
+        # The workbook only changes when the data does
+        data_version = df_records.attrs.get('data_version')
+        export_cache = tenant_state()['export_cache']
+        with _cache_lock:
+            content = export_cache.get(data_version) if data_version else None
+        if content is None and len(df_records) > EXPORT_SYNC_MAX_ROWS:
+            # Too big to build inside a request: hand it to the background job runner, once per data version
+            os.makedirs(current_tenant()['jobs_dir'], exist_ok=True)
+            with file_lock(os.path.join(current_tenant()['jobs_dir'], 'export.lock')):
+                job = find_export_job(data_version, detail) if data_version else None
+                if job is None:
+                    enqueue_job('export', detail=detail, data_version=data_version)
+            if job is not None and job['status'] == 'done':
+                return redirect(url_for('download_job', job_id=job['id']))
+            if job is not None:
+                flash("This export is already being prepared in the background. Download it below when it is ready.", "info")
+            else:
+                flash(f"The export has {len(df_records)} records, so it is being prepared in the background. Download it below when it is ready.", "info")
+            return redirect(url_for('jobs'))
+        if content is None:
+            content = build_records_workbook(df_records)
+            if data_version:
+                with _cache_lock:
+                    export_cache.clear()
+                    export_cache[data_version] = content
+        else:
+            print(f"--- DEBUG: export_records: Reusing workbook built for data version {data_version}.")
+        output = io.BytesIO(content)
+
+        return send_file(
+            output,
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            as_attachment=True,
+            download_name=f'Farm_Records_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
+        )
+
+    @app_instance.route('/admin/jobs', methods=['GET', 'POST'])
+    def jobs():
+        print("--- DEBUG: app.py: jobs() route called.")
+        if request.method == 'POST':
+            kind = request.form.get('kind', '')
+            try:
+                start_date = parse_api_date(request.form.get('start_date'), 'start')
+                end_date = parse_api_date(request.form.get('end_date'), 'end')
+                job = enqueue_job(kind, start_date, end_date)
+                flash(f"{job['label']} queued. This page refreshes until it is ready.", 'success')
+            except ApiError as e:
+                flash(e.message, 'danger')
+            except ValueError as e:
+                flash(f'Could not queue job: {e}', 'danger')
+            return redirect(url_for('jobs'))
+
+        jobs_list = list_jobs()
+        any_active = any(job['status'] in ('queued', 'running') for job in jobs_list)
+        return render_template('jobs.html', jobs=jobs_list, job_kinds=JOB_KINDS, any_active=any_active,
+                               compaction_horizon_days=COMPACTION_HORIZON_DAYS)
 
-        headers = df_records.columns.tolist()
-        sheet.append(headers)
+    @app_instance.route('/admin/snapshots', methods=['GET', 'POST'])
+    def snapshots():
+        print("--- DEBUG: app.py: snapshots() route called.")
+        if request.method == 'POST':
+            df_records = get_all_farm_records_df(copy=False)
+            if df_records.empty:
+                flash("No records available to snapshot.", "warning")
+                return redirect(url_for('snapshots'))
+            try:
+                snapshot = write_records_snapshot(df_records, request.form.get('format', 'parquet'))
+                prune_snapshots()
+                flash(f"Snapshot {snapshot['file_name']} created with {snapshot['rows']} records.", 'success')
+            except (RuntimeError, ValueError) as e:
+                flash(f'Could not create snapshot: {e}', 'danger')
+            return redirect(url_for('snapshots'))
 
-        # Apply header styling
-        # Font and PatternFill need to be imported from openpyxl.styles
-        # Make sure these are imported at the top:
-        # from openpyxl.styles import Font, PatternFill, Alignment
+        return render_template('snapshots.html', snapshots=list_snapshots(), snapshot_formats=SNAPSHOT_FORMATS,
+                               snapshots_available=pyarrow is not None, latest_name=SNAPSHOT_LATEST_NAME)
 
-        header_font = Font(bold=True, color="FFFFFF")
-        header_fill = PatternFill(start_color="4CAF50", end_color="4CAF50", fill_type="solid")
-        header_alignment = Alignment(horizontal="center", vertical="center")
+    @app_instance.route('/admin/snapshots/<file_name>/download')
+    def download_snapshot(file_name):
+        print(f"--- DEBUG: app.py: download_snapshot() route called for {file_name}.")
+        snapshot_format = snapshot_format_of(file_name)
+        try:
+            path = snapshot_path(file_name[:-len(SNAPSHOT_FORMATS[snapshot_format])], snapshot_format) if snapshot_format else None
+        except ValueError:
+            path = None
+        if not path or not os.path.exists(path):
+            flash('That snapshot does not exist.', 'warning')
+            return redirect(url_for('snapshots'))
+        return send_file(path, mimetype='application/octet-stream', as_attachment=True, download_name=file_name)
 
-        for col_idx, header in enumerate(headers, 1):
-            cell = sheet.cell(row=1, column=col_idx, value=header)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = header_alignment
+    @app_instance.route('/admin/snapshots/import', methods=['POST'])
+    def import_snapshot():
+        print("--- DEBUG: app.py: import_snapshot() route called.")
+        upload = request.files.get('snapshot')
+        snapshot_format = snapshot_format_of(upload.filename.lower()) if upload and upload.filename else None
+        if not snapshot_format:
+            flash('Choose a .parquet or .arrow snapshot file to import.', 'warning')
+            return redirect(url_for('snapshots'))
+        try:
+            if pyarrow is None:
+                raise RuntimeError("Snapshots need the 'pyarrow' package. Install it with: pip install pyarrow")
+            path = snapshot_path(f"imported_{datetime.now().strftime('%Y%m%d_%H%M%S')}", snapshot_format)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            upload.save(path)
+            try:
+                snapshot = read_snapshot_metadata(path)
+            except ValueError:
+                os.remove(path)
+                raise
+            if request.form.get('restore'):
+                restored = restore_records_snapshot(path)
+                flash(f"Restored {restored} records from {upload.filename}.", 'success')
+            else:
+                flash(f"Imported {upload.filename} ({snapshot['rows']} records).", 'success')
+        except (RuntimeError, ValueError) as e:
+            flash(f'Could not import snapshot: {e}', 'danger')
+        return redirect(url_for('snapshots'))
 
-        for r_idx, row in df_records.iterrows():
-            row_data = row.tolist()
-            sheet.append(row_data)
+    @app_instance.route('/admin/profiles')
+    def profiles():
+        print("--- DEBUG: app.py: profiles() route called.")
+        return render_template('profiles.html', profiles=list_profiles(), query_flag=PROFILE_QUERY_FLAG, header_name=PROFILE_HEADER)
 
-        for column in sheet.columns:
-            max_length = 0
-            column_name = column[0].column_letter
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = (max_length + 2)
-            sheet.column_dimensions[column_name].width = adjusted_width
+    @app_instance.route('/admin/profiles/<profile_id>/<kind>')
+    def download_profile(profile_id, kind):
+        print(f"--- DEBUG: app.py: download_profile() route called for {profile_id} ({kind}).")
+        try:
+            path = profile_file_path(profile_id, kind) if kind in PROFILE_FILES else None
+        except ValueError:
+            path = None
+        if not path or not os.path.exists(path):
+            flash('That profile does not exist (it may have been pruned).', 'warning')
+            return redirect(url_for('profiles'))
+        suffix, mimetype = PROFILE_FILES[kind]
+        return send_file(path, mimetype=mimetype, as_attachment=True, download_name=f'profile_{profile_id}{suffix}')
+
+    @app_instance.route('/admin/feed', methods=['GET', 'POST'])
+    def feed_stock():
+        print("--- DEBUG: app.py: feed_stock() route called.")
+        if request.method == 'POST':
+            movement = request.form.get('movement', '')
+            category = request.form.get('category', '').strip()
+            feed_type = request.form.get('feed_type', '').strip()
+            try:
+                quantity = float(request.form.get('quantity_kg', ''))
+                if movement not in ('purchase', 'adjustment', FEED_COUNT_MOVEMENT):
+                    raise ValueError('unknown movement')
+                if not category or not feed_type:
+                    raise ValueError('category and feed type are required')
+                note = request.form.get('note', '').strip()
+                if record_feed_movements([{
+                    'date': request.form.get('date') or datetime.now().strftime('%Y-%m-%d'),
+                    'movement': movement,
+                    'category': category,
+                    'feed_type': feed_type,
+                    'quantity_kg': quantity,
+                    'note': note,
+                }]):
+                    if movement == FEED_COUNT_MOVEMENT:
+                        flash(f'Stock count of {quantity} kg recorded for {feed_type} ({category}).', 'success')
+                    else:
+                        flash(f'{FEED_MOVEMENTS[movement]} of {quantity} kg recorded for {feed_type} ({category}).', 'success')
+            except ValueError as e:
+                flash(f'Invalid feed movement: {e}. Enter a category, feed type and a number of kg.', 'danger')
+            return redirect(url_for('feed_stock'))
+
+        return render_template('feed.html', stock=get_feed_stock(), low_stock_days=FEED_LOW_STOCK_DAYS,
+                               burn_window_days=FEED_BURN_WINDOW_DAYS, today=datetime.now().strftime('%Y-%m-%d'))
 
+    @app_instance.route('/admin/feed/rebuild', methods=['POST'])
+    def rebuild_feed():
+        print("--- DEBUG: app.py: rebuild_feed() route called.")
+        if rebuild_feed_balances():
+            flash('Feed balances rebuilt from the ledger.', 'success')
+        else:
+            flash('Feed balances could not be rebuilt. Check server logs.', 'danger')
+        return redirect(url_for('feed_stock'))
 
-        workbook.save(output)
-        output.seek(0)
+    @app_instance.route('/admin/jobs/<job_id>')
+    def job_status(job_id):
+        job = read_job(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found.'}), 404
+        job = dict(job, download_url=url_for('download_job', job_id=job_id) if job['status'] == 'done' else None)
+        return jsonify(job)
 
+    @app_instance.route('/admin/jobs/<job_id>/download')
+    def download_job(job_id):
+        print(f"--- DEBUG: app.py: download_job() route called for {job_id}.")
+        job = read_job(job_id)
+        if job is None or job['status'] != 'done' or not job.get('artifact'):
+            flash('That job has no download available (it may still be running or have expired).', 'warning')
+            return redirect(url_for('jobs'))
         return send_file(
-            output,
+            os.path.join(current_tenant()['jobs_dir'], job['artifact']),
             mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
             as_attachment=True,
-            download_name=f'Farm_Records_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
+            download_name=job['download_name']
         )
 
     @app_instance.route('/admin/reports/monthly')
@@ -913,7 +4254,10 @@ def create_app():
             flash('Please log in to view reports.', 'warning')
             return redirect(url_for('login'))
 
-        df = get_all_farm_records_df()
+        # Only read the partitions that overlap the current month
+        month_start = datetime.now().replace(day=1)
+        month_end = (pd.Timestamp(month_start) + pd.offsets.MonthEnd(0)).to_pydatetime()
+        df = get_all_farm_records_df(month_start, month_end)
         if df.empty:
             flash("No records available for reports.", "info")
             return render_template('monthly_report.html', report_data={'month': datetime.now().strftime('%B %Y'), 'total_profit': 0.0, 'total_expenditure': 0.0, 'records': []}, report_title="Monthly Report")
@@ -932,22 +4276,23 @@ def create_app():
         current_year = datetime.now().year
         monthly_records = df[(df['Date'].dt.month == current_month) & (df['Date'].dt.year == current_year)]
 
-        # Ensure 'Type' column is lowercased for filtering
-        if 'Type' in monthly_records.columns:
-            monthly_records['Type'] = monthly_records['Type'].astype(str).str.lower()
 
 
-        total_monthly_profit = get_safe_sum(monthly_records[monthly_records['Type'] == 'profit'], 'Total Profit')
-        total_monthly_expenditure = get_safe_sum(monthly_records[monthly_records['Type'] == 'expenditure'], 'Amount')
+        # 'Type' is already a lowercased categorical, so filter on its codes
+        total_monthly_profit = get_safe_sum(monthly_records[category_mask(monthly_records['Type'], 'profit')], 'Total Profit')
+        total_monthly_expenditure = get_safe_sum(monthly_records[category_mask(monthly_records['Type'], 'expenditure')], 'Amount')
 
-        report_data = {
-            'month': datetime.now().strftime('%B %Y'),
-            'total_profit': total_monthly_profit,
-            'total_expenditure': total_monthly_expenditure,
-            'records': monthly_records.to_dict(orient='records')
-        }
+        def render():
+            report_data = {
+                'month': datetime.now().strftime('%B %Y'),
+                'total_profit': total_monthly_profit,
+                'total_expenditure': total_monthly_expenditure,
+                'records': frame_to_records(monthly_records)
+            }
+            return render_template('monthly_report.html', report_data=report_data, report_title="Monthly Profit & Expenditure Report")
 
-        return render_template('monthly_report.html', report_data=report_data, report_title="Monthly Profit & Expenditure Report")
+        etag = records_etag(df, 'monthly_report.html', current_year, current_month)
+        return conditional_response(etag, df.attrs.get('loaded_at'), render)
 
 
     @app_instance.route('/admin/reports/weekly')
@@ -957,7 +4302,12 @@ def create_app():
             flash('Please log in to view reports.', 'warning')
             return redirect(url_for('login'))
 
-        df = get_all_farm_records_df()
+        today = datetime.now().date()
+        start_of_week = today - timedelta(days=today.weekday())
+        end_of_week = start_of_week + timedelta(days=6)
+
+        # Only read the partitions that overlap the current week
+        df = get_all_farm_records_df(start_of_week, end_of_week)
         if df.empty:
             flash("No records available for reports.", "info")
             return render_template('weekly_report.html', report_data={'week_range': 'Current Week', 'total_profit': 0.0, 'total_expenditure': 0.0, 'records': []}, report_title="Weekly Report")
@@ -971,28 +4321,181 @@ def create_app():
             flash("No valid date records available for this report after filtering invalid dates.", "warning")
             return render_template('weekly_report.html', report_data={'week_range': 'Current Week', 'total_profit': 0.0, 'total_expenditure': 0.0, 'records': []}, report_title="Weekly Report")
 
+        weekly_records = df[(df['Date'].dt.date >= start_of_week) & (df['Date'].dt.date <= end_of_week)]
 
-        today = datetime.now().date()
-        start_of_week = today - timedelta(days=today.weekday())
-        end_of_week = start_of_week + timedelta(days=6)
 
-        weekly_records = df[(df['Date'].dt.date >= start_of_week) & (df['Date'].dt.date <= end_of_week)]
+        # 'Type' is already a lowercased categorical, so filter on its codes
+        total_weekly_profit = get_safe_sum(weekly_records[category_mask(weekly_records['Type'], 'profit')], 'Total Profit')
+        total_weekly_expenditure = get_safe_sum(weekly_records[category_mask(weekly_records['Type'], 'expenditure')], 'Amount')
 
-        # Ensure 'Type' column is lowercased for filtering
-        if 'Type' in weekly_records.columns:
-            weekly_records['Type'] = weekly_records['Type'].astype(str).str.lower()
+        def render():
+            report_data = {
+                'week_range': f"{start_of_week.strftime('%Y-%m-%d')} to {end_of_week.strftime('%Y-%m-%d')}",
+                'total_profit': total_weekly_profit,
+                'total_expenditure': total_weekly_expenditure,
+                'records': frame_to_records(weekly_records)
+            }
+            return render_template('weekly_report.html', report_data=report_data, report_title="Weekly Profit & Expenditure Report")
 
-        total_weekly_profit = get_safe_sum(weekly_records[weekly_records['Type'] == 'profit'], 'Total Profit')
-        total_weekly_expenditure = get_safe_sum(weekly_records[weekly_records['Type'] == 'expenditure'], 'Amount')
+        etag = records_etag(df, 'weekly_report.html', start_of_week)
+        return conditional_response(etag, df.attrs.get('loaded_at'), render)
 
-        report_data = {
-            'week_range': f"{start_of_week.strftime('%Y-%m-%d')} to {end_of_week.strftime('%Y-%m-%d')}",
-            'total_profit': total_weekly_profit,
-            'total_expenditure': total_weekly_expenditure,
-            'records': weekly_records.to_dict(orient='records')
-        }
+    # --- JSON API ---
+    @app_instance.route('/api/records', methods=['GET'])
+    def api_records():
+        print("--- DEBUG: app.py: api_records() route called.")
+        start_date = parse_api_date(request.args.get('start'), 'start')
+        end_date = parse_api_date(request.args.get('end'), 'end')
+        try:
+            limit = min(max(int(request.args.get('limit', API_DEFAULT_PAGE_SIZE)), 1), API_MAX_PAGE_SIZE)
+        except ValueError:
+            raise ApiError("'limit' must be an integer.")
+        last_key, cursor_version = decode_cursor(request.args.get('cursor'))
+
+        # Only the partitions overlapping the requested range are read
+        df = get_all_farm_records_df(start_date, end_date)
+        if df.empty:
+            return jsonify({'records': [], 'next_cursor': None, 'data_version': None})
+        matching = filter_records(df, start_date, end_date, request.args.get('type'), request.args.get('category'))
+        # Keyset paging: each page starts after the last record served, even if records changed in between
+        keys = record_page_keys(matching).sort_values(['date', 'partition', 'position'], kind='stable')
+        if last_key is not None:
+            last_date, last_partition = last_key[:2]
+            last_position = resume_position(matching, keys, last_key)
+            keys = keys[(keys['date'] > last_date) | ((keys['date'] == last_date) & (
+                (keys['partition'] > last_partition) | ((keys['partition'] == last_partition) & (keys['position'] > last_position))))]
+        page = matching.loc[keys.index[:limit]]
+        has_more = len(keys) > limit
+        data_version = df.attrs.get('data_version')
+
+        def render():
+            return jsonify({
+                'records': records_to_api_json(page),
+                'next_cursor': encode_cursor(tuple(keys.iloc[limit - 1]) + (record_fingerprints(page).iloc[-1],), data_version) if has_more else None,
+                'data_version': data_version,
+                # Lets the client restart if the data changed since its first page
+                'data_changed': bool(cursor_version and cursor_version != data_version),
+            })
+
+        etag = records_etag(df, None, 'api_records', request.query_string.decode('utf-8'))
+        return conditional_response(etag, df.attrs.get('loaded_at'), render)
+
+    @app_instance.route('/api/records', methods=['POST'])
+    def api_add_records():
+        print("--- DEBUG: app.py: api_add_records() route called.")
+        payload = request.get_json(silent=True)
+        raw_records = payload.get('records') if isinstance(payload, dict) else payload
+        if not isinstance(raw_records, list) or not raw_records:
+            raise ApiError("Send a JSON list of records, or an object with a 'records' list.")
+        if len(raw_records) > API_MAX_BATCH_SIZE:
+            raise ApiError(f"At most {API_MAX_BATCH_SIZE} records can be added per request.")
+
+        # Validate the whole batch first so a bad record never leaves a partial write
+        records, errors = [], []
+        for index, raw in enumerate(raw_records):
+            try:
+                records.append(validate_api_record(raw))
+            except ApiError as e:
+                errors.append({'index': index, 'error': e.message})
+        if errors:
+            return jsonify({'saved': 0, 'errors': errors}), 400
+
+        # Clients may send an Idempotency-Key header; a retry with the same key gets the first response back
+        idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
+        claimed, submission = claim_submission('api_records', idempotency_key)
+        if not claimed:
+            if submission['status'] != 'done':
+                raise ApiError("A request with this Idempotency-Key is still being processed.", 409)
+            response = jsonify(submission['outcome']['body'])
+            response.status_code = submission['outcome']['status_code']
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        saved = False
+        try:
+            saved = save_records(records)
+        finally:
+            if not saved:
+                release_submission(idempotency_key)
+        if not saved:
+            return jsonify({'saved': 0, 'errors': [{'index': None, 'error': 'Records could not be saved. Check server logs.'}]}), 502
+        feed_stock_updated = record_feed_movements(feed_consumption_movements(records))
+        body = {'saved': len(records), 'errors': [], 'feed_stock_updated': feed_stock_updated}
+        complete_submission('api_records', idempotency_key, {'status_code': 201, 'body': body})
+        return jsonify(body), 201
+
+    @app_instance.route('/api/records/search')
+    def api_search_records():
+        print("--- DEBUG: app.py: api_search_records() route called.")
+        query = request.args.get('q', '').strip()
+        field = request.args.get('field') or None
+        if not query:
+            raise ApiError("'q' is required.")
+        if field is not None and field not in SEARCH_FIELDS:
+            raise ApiError(f"'field' must be one of {', '.join(SEARCH_FIELDS)}.")
+        limit = min(max(request.args.get('limit', API_DEFAULT_PAGE_SIZE, type=int), 1), API_MAX_PAGE_SIZE)
+        df = get_all_farm_records_df(copy=False)
+        positions, corrections = search_records(df, query, field) if not df.empty else ([], {})
+        return jsonify({
+            'query': query,
+            'total': len(positions),
+            'corrections': corrections,
+            'records': records_to_api_json(df.iloc[positions[:limit]]) if positions else [],
+        })
+
+    @app_instance.route('/api/stats')
+    def api_stats():
+        print("--- DEBUG: app.py: api_stats() route called.")
+        return jsonify(get_farm_statistics())
+
+    @app_instance.route('/api/snapshot')
+    def api_snapshot():
+        print("--- DEBUG: app.py: api_snapshot() route called.")
+        snapshot_format = request.args.get('format', 'parquet').lower()
+        if snapshot_format not in SNAPSHOT_FORMATS:
+            raise ApiError(f"'format' must be one of {', '.join(SNAPSHOT_FORMATS)}.")
+        if pyarrow is None:
+            raise ApiError("Snapshots are unavailable: the server does not have pyarrow installed.", 501)
+        df = get_all_farm_records_df(copy=False)
+        if df.empty:
+            raise ApiError("No records available to snapshot.", 404)
+        # Any snapshot of the current data version will do; only write a new one when none exists
+        data_version = df.attrs.get('data_version')
+        snapshot = next((snapshot for snapshot in list_snapshots()
+                         if data_version and snapshot['data_version'] == data_version and snapshot['format'] == snapshot_format), None)
+        if snapshot is None:
+            snapshot = write_records_snapshot(df, snapshot_format)
+            prune_snapshots()
+        return send_file(snapshot_path(snapshot['name'], snapshot_format), mimetype='application/octet-stream',
+                         as_attachment=True, download_name=f"farm_records_{data_version or 'snapshot'}{SNAPSHOT_FORMATS[snapshot_format]}")
+
+    @app_instance.route('/api/feed')
+    def api_feed():
+        print("--- DEBUG: app.py: api_feed() route called.")
+        return jsonify({'stock': get_feed_stock(), 'low_stock_days': FEED_LOW_STOCK_DAYS})
+
+    @app_instance.route('/api/analytics')
+    def api_analytics():
+        print("--- DEBUG: app.py: api_analytics() route called.")
+        as_of = parse_api_date(request.args.get('date'), 'date')
+        df = get_all_farm_records_df(copy=False)
+        analytics = get_livestock_analytics(as_of)
+        etag = records_etag(df, None, 'api_analytics', analytics['as_of'])
+        return conditional_response(etag, df.attrs.get('loaded_at'), lambda: jsonify(analytics))
+
+    @app_instance.route('/api/reports')
+    def api_reports():
+        print("--- DEBUG: app.py: api_reports() route called.")
+        period = request.args.get('period', 'monthly').lower()
+        reference_date = parse_api_date(request.args.get('date'), 'date') or pd.Timestamp(datetime.now().date())
+        start_date, end_date, _ = report_range(period, reference_date)
+        df = get_all_farm_records_df(start_date, end_date)
+
+        def render():
+            return jsonify(build_report_payload(df, period, reference_date))
 
-        return render_template('weekly_report.html', report_data=report_data, report_title="Weekly Profit & Expenditure Report")
+        etag = records_etag(df, None, 'api_reports', period, start_date)
+        return conditional_response(etag, df.attrs.get('loaded_at'), render)
 
     return app_instance
 
@@ -0,0 +1,487 @@
+# loadtest.py
+"""
+Load-test harness for the farm app.
+
+Starts a local stand-in for the Google Sheets API (with configurable latency, errors and
+quota 429s), runs app.py under gunicorn against it, drives a weighted mix of dashboard,
+record, report and export requests from concurrent logged-in sessions, and reports
+throughput and p50/p95/p99 latency per route.
+
+Example:
+    python loadtest.py --sessions 20 --duration 60 --latency-ms 150 --jitter-ms 100 --error-rate 0.01 --read-quota 300
+
+Nothing here touches the real Google Sheet: the app is pointed at the stand-in through
+GOOGLE_SHEETS_API_URL, and CSV fallback and snapshots are switched off for the run.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, unquote, parse_qs
+
+import requests
+
+RECORD_HEADERS = ['Date', 'Type', 'Category', 'Item', 'Quantity', 'Unit', 'Amount', 'Profit Per Unit', 'Total Profit']
+LOADTEST_SHEET_ID = 'loadtest-sheet'
+LOADTEST_USERNAME = 'loadtest'
+LOADTEST_PASSWORD = 'loadtest-password'
+CATEGORIES = ['Layers', 'Broilers', 'Goats', 'Sheep']
+FEEDS = ['Layer Mash', 'Broiler Starter', 'Broiler Finisher', 'Goat Pellets']
+EXPENSES = [('Medication', 'Vet visit'), ('Labour', 'Wages'), ('Utilities', 'Electricity'), ('Equipment', 'Drinkers')]
+SALES = [('Layers', 'Eggs Sold', 'crates'), ('Broilers', 'Birds Sold', 'birds'), ('Goats', 'Goat Meat', 'kg'), ('Sheep', 'Wool', 'kg')]
+
+
+# --- Fake Google Sheets Service ---
+def column_index(letters):
+    """'A' -> 0, 'AA' -> 26."""
+    index = 0
+    for letter in letters.upper():
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
+
+def column_letters(index):
+    """0 -> 'A', 26 -> 'AA'."""
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+def parse_a1_range(range_name):
+    """Splits "'Title'!A2:I2" into (title or None, start row, start col, end row or None, end col or None), 0-indexed."""
+    title = None
+    if '!' in range_name:
+        title, range_name = range_name.rsplit('!', 1)
+        if title.startswith("'") and title.endswith("'"):
+            title = title[1:-1].replace("''", "'")
+    elif not re.fullmatch(r'[A-Za-z]*\d*(:[A-Za-z]*\d*)?', range_name):
+        # A bare sheet title
+        return range_name.strip("'").replace("''", "'"), 0, 0, None, None
+    cells = [re.fullmatch(r'([A-Za-z]*)(\d*)', part) for part in range_name.split(':')] if range_name else []
+    start_row = int(cells[0].group(2)) - 1 if cells and cells[0].group(2) else 0
+    start_col = column_index(cells[0].group(1)) if cells and cells[0].group(1) else 0
+    end_row = int(cells[1].group(2)) - 1 if len(cells) > 1 and cells[1].group(2) else None
+    end_col = column_index(cells[1].group(1)) if len(cells) > 1 and cells[1].group(1) else None
+    return title, start_row, start_col, end_row, end_col
+
+class FakeSheetsService:
+    """
+    In-memory spreadsheets behind the subset of the Sheets v4 REST API that gspread uses here:
+    spreadsheet metadata, values get/append/update/clear and batchUpdate addSheet/deleteDimension.
+    Every call can be delayed and failed to mimic Google under load.
+    """
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, throttle_rate=0.0, read_quota=0, write_quota=0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.read_quota = read_quota # Calls per minute, 0 for unlimited (Google's default is 300 per project)
+        self.write_quota = write_quota
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.spreadsheets = {}
+        self.recent_calls = {'read': deque(), 'write': deque()}
+        self.stats = defaultdict(int)
+        self.server = None
+
+    def spreadsheet(self, spreadsheet_id):
+        """Returns a spreadsheet, creating it with an empty Sheet1 on first use."""
+        if spreadsheet_id not in self.spreadsheets:
+            self.spreadsheets[spreadsheet_id] = {'title': spreadsheet_id, 'sheets': [], 'next_sheet_id': 0}
+            self.add_sheet(spreadsheet_id, 'Sheet1')
+        return self.spreadsheets[spreadsheet_id]
+
+    def add_sheet(self, spreadsheet_id, title):
+        spreadsheet = self.spreadsheet(spreadsheet_id)
+        sheet = {'sheetId': spreadsheet['next_sheet_id'], 'title': title, 'rows': []}
+        spreadsheet['next_sheet_id'] += 1
+        spreadsheet['sheets'].append(sheet)
+        return sheet
+
+    def seed_records(self, spreadsheet_id, count, days=400, seed=None):
+        """Fills Sheet1 with a header row and `count` plausible records spread over the last `days` days."""
+        rng = random.Random(seed)
+        sheet = self.spreadsheet(spreadsheet_id)['sheets'][0]
+        sheet['rows'] = [list(RECORD_HEADERS)]
+        today = datetime.now().date()
+        for _ in range(count):
+            record = random_record(rng, today - timedelta(days=rng.randrange(days)))
+            sheet['rows'].append([record.get(header.replace(' ', '_').lower(), '') for header in RECORD_HEADERS])
+
+    def sheet_properties(self, sheet, index):
+        return {
+            'sheetId': sheet['sheetId'], 'title': sheet['title'], 'index': index, 'sheetType': 'GRID',
+            'gridProperties': {'rowCount': max(len(sheet['rows']), 1000), 'columnCount': 26},
+        }
+
+    def find_sheet(self, spreadsheet, title):
+        if title is None:
+            return spreadsheet['sheets'][0]
+        for sheet in spreadsheet['sheets']:
+            if sheet['title'] == title:
+                return sheet
+        return None
+
+    def fault(self, kind):
+        """Sleeps for the configured latency, then returns (status, message) of an injected failure or None."""
+        delay = max(0.0, self.random.gauss(self.latency_ms, self.jitter_ms)) if self.jitter_ms else self.latency_ms
+        if delay:
+            time.sleep(delay / 1000.0)
+        quota = self.read_quota if kind == 'read' else self.write_quota
+        with self.lock:
+            self.stats[f'{kind}_calls'] += 1
+            if quota:
+                calls = self.recent_calls[kind]
+                now = time.monotonic()
+                while calls and now - calls[0] > 60:
+                    calls.popleft()
+                if len(calls) >= quota:
+                    self.stats['quota_429'] += 1
+                    return 429, f"Quota exceeded for quota metric '{kind.capitalize()} requests' per minute."
+                calls.append(now)
+            roll = self.random.random()
+            if roll < self.throttle_rate:
+                self.stats['injected_429'] += 1
+                return 429, 'Rate limit exceeded.'
+            if roll < self.throttle_rate + self.error_rate:
+                self.stats['injected_5xx'] += 1
+                return 503, 'The service is currently unavailable.'
+        return None
+
+    def handle(self, method, path, query, body):
+        """Dispatches one API call. Returns (status, payload)."""
+        match = re.fullmatch(r'/v4/spreadsheets/([^/:]+)(:batchUpdate|/values/(.+?)(:append|:clear)?)?', path)
+        if not match:
+            return 404, error_payload(404, f'Unknown endpoint {path}')
+        spreadsheet_id, suffix, range_name, action = match.group(1), match.group(2), match.group(3), match.group(4)
+        kind = 'read' if method == 'GET' else 'write'
+        failure = self.fault(kind)
+        if failure:
+            return failure[0], error_payload(*failure)
+
+        with self.lock:
+            spreadsheet = self.spreadsheet(spreadsheet_id)
+            if suffix is None:
+                return 200, {
+                    'spreadsheetId': spreadsheet_id,
+                    'properties': {'title': spreadsheet['title'], 'locale': 'en_US', 'timeZone': 'Etc/GMT'},
+                    'sheets': [{'properties': self.sheet_properties(sheet, index)} for index, sheet in enumerate(spreadsheet['sheets'])],
+                }
+            if suffix == ':batchUpdate':
+                return 200, {'spreadsheetId': spreadsheet_id, 'replies': [self.batch_request(spreadsheet_id, spreadsheet, request) for request in body.get('requests', [])]}
+
+            title, start_row, start_col, end_row, end_col = parse_a1_range(unquote(range_name))
+            sheet = self.find_sheet(spreadsheet, title)
+            if sheet is None:
+                return 400, error_payload(400, f'Unable to parse range: {range_name}')
+            label = f"'{sheet['title']}'"
+            rows = sheet['rows']
+            if method == 'GET':
+                selected = rows[start_row:None if end_row is None else end_row + 1]
+                selected = [row[start_col:None if end_col is None else end_col + 1] for row in selected]
+                return 200, {'range': label, 'majorDimension': 'ROWS', 'values': selected}
+            if action == ':clear':
+                if end_row is None and start_row == 0:
+                    sheet['rows'] = []
+                else:
+                    for row in rows[start_row:None if end_row is None else end_row + 1]:
+                        row[start_col:None if end_col is None else end_col + 1] = [''] * len(row[start_col:None if end_col is None else end_col + 1])
+                return 200, {'spreadsheetId': spreadsheet_id, 'clearedRange': label}
+            values = body.get('values', [])
+            if action == ':append':
+                start_row = len(rows)
+            while len(rows) < start_row + len(values):
+                rows.append([])
+            for offset, row_values in enumerate(values):
+                row = rows[start_row + offset]
+                row.extend([''] * (start_col + len(row_values) - len(row)))
+                row[start_col:start_col + len(row_values)] = [str(value) for value in row_values]
+            updated = {
+                'spreadsheetId': spreadsheet_id,
+                'updatedRange': f"{label}!{column_letters(start_col)}{start_row + 1}",
+                'updatedRows': len(values),
+                'updatedColumns': max((len(row) for row in values), default=0),
+                'updatedCells': sum(len(row) for row in values),
+            }
+            return 200, {'spreadsheetId': spreadsheet_id, 'tableRange': label, 'updates': updated} if action else updated
+
+    def batch_request(self, spreadsheet_id, spreadsheet, request):
+        if 'addSheet' in request:
+            sheet = self.add_sheet(spreadsheet_id, request['addSheet']['properties']['title'])
+            return {'addSheet': {'properties': self.sheet_properties(sheet, len(spreadsheet['sheets']) - 1)}}
+        if 'deleteDimension' in request:
+            dimension_range = request['deleteDimension']['range']
+            for sheet in spreadsheet['sheets']:
+                if sheet['sheetId'] == dimension_range.get('sheetId') and dimension_range.get('dimension') == 'ROWS':
+                    del sheet['rows'][dimension_range['startIndex']:dimension_range['endIndex']]
+        return {}
+
+    def start(self, port=0):
+        """Serves the API on 127.0.0.1 in a background thread and returns its base URL."""
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def dispatch(self):
+                parsed = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                raw_body = self.rfile.read(length) if length else b''
+                try:
+                    body = json.loads(raw_body) if raw_body else {}
+                except ValueError:
+                    body = {}
+                status, payload = service.handle(self.command, parsed.path, parse_qs(parsed.query), body)
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=UTF-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = dispatch
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='fake-sheets', daemon=True).start()
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+
+def error_payload(status, message):
+    statuses = {400: 'INVALID_ARGUMENT', 404: 'NOT_FOUND', 429: 'RESOURCE_EXHAUSTED', 503: 'UNAVAILABLE'}
+    return {'error': {'code': status, 'message': message, 'status': statuses.get(status, 'UNKNOWN')}}
+
+
+# --- Request Mix ---
+def random_record(rng, day):
+    """A random feed, expenditure or profit record as save_record() would store it."""
+    kind = rng.choices(['feed_input', 'expenditure', 'profit'], weights=[5, 2, 3])[0]
+    record = {'date': day.strftime('%Y-%m-%d'), 'type': kind}
+    if kind == 'feed_input':
+        record.update(category=rng.choice(CATEGORIES), item=rng.choice(FEEDS), quantity=rng.randint(5, 80), unit='kg')
+    elif kind == 'expenditure':
+        category, item = rng.choice(EXPENSES)
+        record.update(category=category, item=item, amount=round(rng.uniform(20, 600), 2))
+    else:
+        category, item, unit = rng.choice(SALES)
+        quantity, price = rng.randint(1, 40), round(rng.uniform(5, 60), 2)
+        record.update(category=category, item=item, quantity=quantity, unit=unit, profit_per_unit=price, total_profit=round(quantity * price, 2))
+    return record
+
+def add_record_form(rng):
+    """Form data for one of the three add_record forms on the dashboard."""
+    kind = rng.choice(['feed', 'expenditure', 'profit'])
+    if kind == 'feed':
+        return {'record_type': 'feed', 'feed_category': rng.choice(CATEGORIES), 'feed_type': rng.choice(FEEDS), 'feed_quantity': str(rng.randint(5, 80))}
+    if kind == 'expenditure':
+        category, item = rng.choice(EXPENSES)
+        return {'record_type': 'expenditure', 'exp_category': category, 'exp_item': item, 'exp_amount': str(round(rng.uniform(20, 600), 2))}
+    category, item, _ = rng.choice(SALES)
+    return {'record_type': 'profit', 'profit_category': category, 'profit_item': item, 'profit_quantity': str(rng.randint(1, 40)), 'profit_per_unit': str(round(rng.uniform(5, 60), 2))}
+
+# route name -> (method, path, form builder or None)
+ROUTES = {
+    'admin': ('GET', '/admin', None),
+    'add_record': ('POST', '/admin/add_record', add_record_form),
+    'view_records': ('GET', '/admin/view_records', None),
+    'monthly_report': ('GET', '/admin/reports/monthly', None),
+    'weekly_report': ('GET', '/admin/reports/weekly', None),
+    'export': ('GET', '/admin/export_records', None),
+}
+DEFAULT_MIX = 'admin=35,view_records=20,add_record=20,monthly_report=10,weekly_report=5,export=10'
+
+def parse_mix(mix):
+    """'admin=3,export=1' -> {'admin': 3.0, 'export': 1.0}."""
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ROUTES:
+            raise SystemExit(f"Unknown route {name!r} in --mix. Choose from: {', '.join(ROUTES)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+# --- Load Driver ---
+class Results:
+    """Thread-safe latency and status tallies per route."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def record(self, route, seconds, status):
+        with self.lock:
+            self.latencies[route].append(seconds)
+            self.statuses[route][status] += 1
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(fraction * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def run_session(base_url, weights, stop_at, measure_from, results, think_ms, seed):
+    """One logged-in admin clicking through the weighted route mix until stop_at."""
+    rng = random.Random(seed)
+    session = requests.Session()
+    session.post(f'{base_url}/login', data={'username': LOADTEST_USERNAME, 'password': LOADTEST_PASSWORD}, allow_redirects=False, timeout=120)
+    names, route_weights = list(weights), list(weights.values())
+    while time.monotonic() < stop_at:
+        route = rng.choices(names, weights=route_weights)[0]
+        method, path, form = ROUTES[route]
+        started = time.monotonic()
+        try:
+            # Redirects are not followed, so add_record is timed without the dashboard it redirects to
+            response = session.request(method, base_url + path, data=form(rng) if form else None, allow_redirects=False, timeout=120)
+            status = response.status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        if started >= measure_from:
+            results.record(route, time.monotonic() - started, status)
+        if think_ms:
+            time.sleep(rng.expovariate(1000.0 / think_ms))
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_app(sheets_url, workers, threads, port, log_path):
+    """Runs app:app under gunicorn against the fake Sheets service and waits until it answers."""
+    env = dict(os.environ)
+    for name in ('FARM_TENANTS', 'FARM_TENANTS_FILE', 'FARM_HOSTS'):
+        env.pop(name, None)
+    env.update({
+        'GOOGLE_SHEETS_API_URL': sheets_url,
+        'GOOGLE_SHEET_ID': LOADTEST_SHEET_ID,
+        'ADMIN_USERNAME': LOADTEST_USERNAME,
+        'ADMIN_PASSWORD': LOADTEST_PASSWORD,
+        'USE_CSV_FALLBACK': 'false',
+        'SNAPSHOT_AUTO': 'false',
+    })
+    command = [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+               '--threads', str(threads), '--timeout', '120', '--chdir', os.path.dirname(os.path.abspath(__file__))]
+    log_file = open(log_path, 'w')
+    process = subprocess.Popen(command, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"gunicorn exited with code {process.returncode}; see {log_path}. Is gunicorn installed (pip install gunicorn)?")
+        try:
+            if requests.get(f'{base_url}/login', timeout=2).status_code == 200:
+                return process, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    process.terminate()
+    raise SystemExit(f"gunicorn did not start within 60 seconds; see {log_path}.")
+
+def print_report(results, elapsed, service):
+    print()
+    print(f"{'Route':<16}{'Requests':>10}{'Req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'Max ms':>10}{'Errors':>9}  Statuses")
+    total = 0
+    report = {}
+    for route in sorted(results.latencies):
+        latencies = sorted(results.latencies[route])
+        statuses = dict(results.statuses[route])
+        errors = sum(count for status, count in statuses.items() if not isinstance(status, int) or status >= 500)
+        total += len(latencies)
+        row = {
+            'requests': len(latencies),
+            'rps': len(latencies) / elapsed,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'max_ms': latencies[-1] * 1000,
+            'errors': errors,
+            'statuses': {str(status): count for status, count in sorted(statuses.items(), key=lambda item: str(item[0]))},
+        }
+        report[route] = row
+        status_text = ' '.join(f'{status}x{count}' for status, count in row['statuses'].items())
+        print(f"{route:<16}{row['requests']:>10}{row['rps']:>9.1f}{row['p50_ms']:>10.0f}{row['p95_ms']:>10.0f}{row['p99_ms']:>10.0f}{row['max_ms']:>10.0f}{errors:>9}  {status_text}")
+    print(f"\nTotal: {total} requests in {elapsed:.1f}s ({total / elapsed:.1f} req/s)")
+    print(f"Fake Sheets API: {dict(service.stats)}")
+    return {'elapsed_seconds': elapsed, 'total_requests': total, 'routes': report, 'sheets_api': dict(service.stats)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=10, help='concurrent logged-in admin sessions')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to measure')
+    parser.add_argument('--warmup', type=float, default=5, help='seconds of load before measuring starts')
+    parser.add_argument('--think-ms', type=float, default=200, help='mean pause between a session\'s requests')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'route weights (default: {DEFAULT_MIX})')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn threads per worker')
+    parser.add_argument('--seed-records', type=int, default=2000, help='records in the fake sheet at the start')
+    parser.add_argument('--latency-ms', type=float, default=120, help='mean Sheets API latency')
+    parser.add_argument('--jitter-ms', type=float, default=60, help='standard deviation of the Sheets API latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of Sheets API calls failing with 503')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='fraction of Sheets API calls failing with 429')
+    parser.add_argument('--read-quota', type=int, default=0, help='Sheets read calls allowed per minute (0 = unlimited)')
+    parser.add_argument('--write-quota', type=int, default=0, help='Sheets write calls allowed per minute (0 = unlimited)')
+    parser.add_argument('--seed', type=int, default=None, help='random seed for repeatable runs')
+    parser.add_argument('--json', dest='json_path', help='also write the results as JSON to this file')
+    parser.add_argument('--server-log', default='loadtest_server.log', help='where gunicorn output goes')
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix)
+    service = FakeSheetsService(args.latency_ms, args.jitter_ms, args.error_rate, args.throttle_rate,
+                                args.read_quota, args.write_quota, seed=args.seed)
+    service.seed_records(LOADTEST_SHEET_ID, args.seed_records, seed=args.seed)
+    sheets_url = service.start()
+    print(f"Fake Sheets API at {sheets_url} with {args.seed_records} records.")
+    process, base_url = start_app(sheets_url, args.workers, args.threads, free_port(), args.server_log)
+    print(f"App under gunicorn at {base_url} ({args.workers} workers x {args.threads} threads).")
+    print(f"Running {args.sessions} sessions for {args.warmup:.0f}s warm-up + {args.duration:.0f}s...")
+
+    results = Results()
+    started = time.monotonic()
+    measure_from = started + args.warmup
+    stop_at = measure_from + args.duration
+    seeds = random.Random(args.seed)
+    sessions = [threading.Thread(target=run_session, args=(base_url, weights, stop_at, measure_from, results, args.think_ms, seeds.random()), daemon=True)
+                for _ in range(args.sessions)]
+    try:
+        for session_thread in sessions:
+            session_thread.start()
+        for session_thread in sessions:
+            session_thread.join()
+        # Measured until the last in-flight request returned, before the servers are torn down
+        elapsed = time.monotonic() - measure_from
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        service.stop()
+
+    report = print_report(results, elapsed, service)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as json_file:
+            json.dump(dict(report, settings=vars(args)), json_file, indent=2)
+        print(f"Results written to {args.json_path}.")
+
+if __name__ == '__main__':
+    main()
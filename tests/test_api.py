@@ -0,0 +1,117 @@
+"""The JSON records API: keyset paging while records change, and batch posts."""
+import base64
+import json
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+os.environ['USE_CSV_FALLBACK'] = 'true'
+os.environ.setdefault('GOOGLE_SHEET_ID', '')
+
+import app as farm_app  # noqa: E402
+
+
+@pytest.fixture
+def farm(tmp_path, monkeypatch):
+    """Points the default farm at an empty directory with fresh in-memory state. Past years stay writable."""
+    monkeypatch.setattr(farm_app, 'TENANTS', farm_app.load_tenants(str(tmp_path)))
+    monkeypatch.setattr(farm_app, 'USE_CSV_FALLBACK', True)
+    monkeypatch.setattr(farm_app, 'PARTITION_ARCHIVE_AFTER_DAYS', 100000)
+    farm_app._tenant_states.clear()
+    yield tmp_path
+    farm_app._tenant_states.clear()
+
+
+@pytest.fixture
+def client(farm):
+    client = farm_app.app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = True
+        session['tenant'] = farm_app.DEFAULT_TENANT_ID
+    return client
+
+
+def expense(date, item, amount=5):
+    return {'date': date, 'type': 'expenditure', 'category': 'Medication', 'item': item, 'amount': amount}
+
+
+def save(*records):
+    with farm_app.app.test_request_context():
+        assert farm_app.save_records(list(records))
+
+
+def next_page(client, cursor=None):
+    response = client.get('/api/records', query_string={'limit': 2, **({'cursor': cursor} if cursor else {})})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def test_pages_neither_skip_nor_repeat_inserted_records(client):
+    save(*[expense('2025-03-01', item) for item in 'abc'], *[expense('2026-01-01', item) for item in 'def'])
+    page = next_page(client)
+    served = [record['item'] for record in page['records']]
+
+    # Behind the cursor (never served), on the cursor's own date, and ahead of it
+    save(expense('2025-02-01', 'behind'), expense('2025-03-01', 'g'), expense('2026-02-01', 'h'))
+    page = next_page(client, page['next_cursor'])
+    assert page['data_changed']
+    served += [record['item'] for record in page['records']]
+    while page['next_cursor']:
+        page = next_page(client, page['next_cursor'])
+        served += [record['item'] for record in page['records']]
+
+    assert sorted(served) == sorted('abcdefgh')
+
+
+@pytest.mark.parametrize('moved', ['a', 'b'])
+def test_pages_neither_skip_nor_repeat_after_a_row_is_removed(client, moved):
+    save(*[expense('2025-03-01', item) for item in 'abcd'], expense('2026-01-01', 'e'))
+    page = next_page(client)
+    served = [record['item'] for record in page['records']]
+    assert served == ['a', 'b']
+
+    # Moving a served record to another year deletes its row, so the later rows of its partition shift up
+    record_id = next(record['id'] for record in page['records'] if record['item'] == moved)
+    with farm_app.app.test_request_context():
+        assert farm_app.update_partition_record('csv', record_id, expense('2024-03-01', moved))
+    while page['next_cursor']:
+        page = next_page(client, page['next_cursor'])
+        served += [record['item'] for record in page['records']]
+
+    assert served == ['a', 'b', 'c', 'd', 'e']
+
+
+def test_offset_cursors_from_the_old_api_are_rejected(client):
+    save(expense('2025-03-01', 'a'))
+    offset_cursor = base64.urlsafe_b64encode(json.dumps({'o': 2, 'v': 'x'}).encode('utf-8')).decode('ascii').rstrip('=')
+    response = client.get('/api/records', query_string={'cursor': offset_cursor})
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Invalid cursor.'
+
+
+def test_batch_with_an_invalid_record_saves_nothing(client):
+    response = client.post('/api/records', json=[expense('2025-03-01', 'a'), {'type': 'expenditure', 'date': '2025-03-01'}])
+    assert response.status_code == 400
+    assert response.get_json()['saved'] == 0
+    assert [error['index'] for error in response.get_json()['errors']] == [1]
+    assert client.get('/api/records').get_json()['records'] == []
+
+
+def test_failed_batch_save_can_be_retried_with_the_same_key(client, monkeypatch):
+    headers = {farm_app.IDEMPOTENCY_HEADER: 'batch-1'}
+    batch = [expense('2025-03-01', 'a'), expense('2025-03-02', 'b')]
+    save_records = farm_app.save_records
+    monkeypatch.setattr(farm_app, 'save_records', lambda records: False)
+    assert client.post('/api/records', json=batch, headers=headers).status_code == 502
+
+    monkeypatch.setattr(farm_app, 'save_records', save_records)
+    response = client.post('/api/records', json=batch, headers=headers)
+    assert response.status_code == 201
+    assert response.get_json()['saved'] == 2
+    replayed = client.post('/api/records', json=batch, headers=headers)
+    assert replayed.status_code == 201
+    assert replayed.headers['Idempotent-Replayed'] == 'true'
+    assert len(client.get('/api/records').get_json()['records']) == 2
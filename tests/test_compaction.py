@@ -0,0 +1,109 @@
+"""
+History compaction across workers. Each worker is a separate process with its own record caches;
+the second worker here is a subprocess sharing the farm's files.
+"""
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+os.environ['USE_CSV_FALLBACK'] = 'true'
+os.environ.setdefault('GOOGLE_SHEET_ID', '')
+
+import app as farm_app  # noqa: E402
+
+
+@pytest.fixture
+def farm(tmp_path, monkeypatch):
+    """Points the default farm at an empty directory with fresh in-memory state."""
+    monkeypatch.setattr(farm_app, 'TENANTS', farm_app.load_tenants(str(tmp_path)))
+    monkeypatch.setattr(farm_app, 'USE_CSV_FALLBACK', True)
+    farm_app._tenant_states.clear()
+    yield tmp_path
+    farm_app._tenant_states.clear()
+
+
+def run_in_other_worker(root_path, code):
+    """Runs code in a separate worker process for the farm stored under root_path."""
+    script = textwrap.dedent(f"""
+        import sys
+        sys.path.insert(0, {REPO_DIR!r})
+        import app as farm_app
+        farm_app.TENANTS = farm_app.load_tenants({str(root_path)!r})
+    """) + textwrap.dedent(code)
+    result = subprocess.run([sys.executable, '-c', script], cwd=str(root_path), env=dict(os.environ),
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+
+
+def profit_record(date, quantity, price):
+    return {'date': date, 'type': 'profit', 'category': 'layers', 'item': 'eggs sold',
+            'quantity': quantity, 'profit_per_unit': price, 'total_profit': quantity * price, 'unit': 'crates'}
+
+
+def test_compaction_in_another_worker_refreshes_archived_partitions(farm):
+    with farm_app.app.test_request_context():
+        assert farm_app.save_records([profit_record('2022-03-01', 2, 25.0), profit_record('2022-09-01', 2, 25.0),
+                                      profit_record('2025-06-01', 1, 10.0)])
+        manifest = farm_app.load_partition_manifest('csv')
+        assert any(entry.get('archived') for key, entry in manifest.items() if key.startswith('2022'))
+        # Warm this worker's caches, including the archived 2022 partition
+        assert farm_app.get_farm_statistics()['total_profit'] == pytest.approx(110.0)
+
+    run_in_other_worker(farm, """
+        with farm_app.app.test_request_context():
+            # Only the March row moves; the rest of the archived 2022 partition is rewritten
+            farm_app.compact_all_history('2022-06-01')
+    """)
+
+    with farm_app.app.test_request_context():
+        assert farm_app.get_farm_statistics()['total_profit'] == pytest.approx(110.0)
+        detail = farm_app.get_all_farm_records_df(detail=True)
+        assert len(detail) == 3
+
+
+def test_archive_rewrite_bumps_generation(farm):
+    with farm_app.app.test_request_context():
+        farm_app.save_records([profit_record('2022-03-01', 2, 25.0)])
+        key, entry = next((key, entry) for key, entry in farm_app.load_partition_manifest('csv').items() if entry.get('archived'))
+        stamp = farm_app.partition_source_stamp('csv', key, entry)
+        assert farm_app.rewrite_partition_rows('csv', key, entry, farm_app.CSV_COLUMNS, [])
+        assert entry['generation'] == 1
+        assert farm_app.partition_source_stamp('csv', key, entry) != stamp
+        assert os.path.exists(farm_app.partition_archive_path('csv', key, 1))
+        assert not os.path.exists(farm_app.partition_archive_path('csv', key, 0))
+
+
+def test_edit_of_a_row_moved_by_compaction_is_refused(farm):
+    with farm_app.app.test_request_context():
+        # The legacy farm_records.csv stays writable; compaction shortens it in place
+        with open(farm_app.current_tenant()['csv_file_path'], 'w', encoding='utf-8') as legacy_file:
+            legacy_file.write(','.join(farm_app.CSV_COLUMNS) + '\n'
+                              '2021-01-05,expenditure,Medication,Vet,,,5,,\n'
+                              '2025-01-05,expenditure,Medication,Dewormer,,,7,,\n'
+                              '2025-01-06,expenditure,Medication,Vaccine,,,9,,\n')
+        records = farm_app.frame_to_records(farm_app.get_all_farm_records_df())
+        dewormer = next(record for record in records if record['Item'] == 'dewormer')
+        farm_app.compact_all_history('2024-01-01')
+
+        edit = {'date': '2025-01-05', 'type': 'expenditure', 'category': 'Medication', 'item': 'Dewormer', 'amount': 8}
+        assert not farm_app.update_partition_record('csv', 'legacy:1', edit, expected=dewormer)
+        assert farm_app.update_partition_record('csv', 'legacy:0', edit, expected=dewormer)
+        assert farm_app.get_farm_statistics()['total_expenditure'] == pytest.approx(5 + 8 + 9)
+
+
+def test_appends_wait_for_the_write_lock_of_another_worker(farm):
+    with farm_app.app.test_request_context():
+        with farm_app.records_write_lock('csv'):
+            run_in_other_worker(farm, """
+                farm_app.FILE_LOCK_TIMEOUT_SECONDS = 0.2
+                with farm_app.app.test_request_context():
+                    record = {'date': '2025-06-01', 'type': 'expenditure', 'category': 'Medication', 'item': 'Vet', 'amount': 3}
+                    assert not farm_app.append_partition_record('csv', record)
+            """)
+        assert farm_app.append_partition_record('csv', {'date': '2025-06-01', 'type': 'expenditure',
+                                                        'category': 'Medication', 'item': 'Vet', 'amount': 3})
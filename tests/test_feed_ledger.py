@@ -0,0 +1,82 @@
+"""Feed balances posted by several workers at once."""
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+os.environ['USE_CSV_FALLBACK'] = 'true'
+os.environ.setdefault('GOOGLE_SHEET_ID', '')
+
+import app as farm_app  # noqa: E402
+
+
+@pytest.fixture
+def farm(tmp_path, monkeypatch):
+    """Points the default farm at an empty directory with fresh in-memory state."""
+    monkeypatch.setattr(farm_app, 'TENANTS', farm_app.load_tenants(str(tmp_path)))
+    monkeypatch.setattr(farm_app, 'USE_CSV_FALLBACK', True)
+    farm_app._tenant_states.clear()
+    yield tmp_path
+    farm_app._tenant_states.clear()
+
+
+def start_worker(root_path, movement, count):
+    """Starts a worker process posting count movements of 1 kg to the farm stored under root_path."""
+    script = textwrap.dedent(f"""
+        import sys
+        sys.path.insert(0, {REPO_DIR!r})
+        import app as farm_app
+        farm_app.TENANTS = farm_app.load_tenants({str(root_path)!r})
+        with farm_app.app.test_request_context():
+            for _ in range({count}):
+                assert farm_app.post_feed_movements('csv', [{{'date': '2026-01-05', 'movement': {movement!r},
+                    'category': 'Layers', 'feed_type': 'Layer Mash', 'quantity_kg': 1.0, 'note': ''}}])
+    """)
+    return subprocess.Popen([sys.executable, '-c', script], cwd=str(root_path), env=dict(os.environ),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+
+
+def test_concurrent_workers_do_not_lose_balance_updates(farm):
+    workers = [start_worker(farm, 'purchase', 25), start_worker(farm, 'consumption', 15)]
+    for worker in workers:
+        _, errors = worker.communicate(timeout=300)
+        assert worker.returncode == 0, errors
+
+    with farm_app.app.test_request_context():
+        balances = farm_app.load_feed_balances('csv')
+        assert list(balances) == [farm_app.feed_balance_key('Layers', 'Layer Mash')]
+        entry = balances[farm_app.feed_balance_key('Layers', 'Layer Mash')]
+        assert entry['purchased_kg'] == pytest.approx(25.0)
+        assert entry['consumed_kg'] == pytest.approx(15.0)
+        assert entry['balance_kg'] == pytest.approx(10.0)
+
+
+def test_stock_count_adjusts_from_the_backends_own_balance(farm):
+    with farm_app.app.test_request_context():
+        movement = {'date': '2026-01-05', 'category': 'Layers', 'feed_type': 'Layer Mash', 'note': ''}
+        assert farm_app.post_feed_movements('csv', [dict(movement, movement='purchase', quantity_kg=40.0)])
+        assert farm_app.post_feed_movements('csv', [dict(movement, movement='count', quantity_kg=32.5)])
+        assert farm_app.load_feed_balances('csv')[farm_app.feed_balance_key('Layers', 'Layer Mash')]['balance_kg'] == pytest.approx(32.5)
+        assert farm_app.read_feed_ledger('csv')[-1]['movement'] == 'adjustment'
+        assert farm_app.read_feed_ledger('csv')[-1]['quantity_kg'] == pytest.approx(-7.5)
+
+
+def test_failed_balance_save_is_rebuilt_from_the_ledger(farm, monkeypatch):
+    movement = {'date': '2026-01-05', 'movement': 'purchase', 'category': 'Layers', 'feed_type': 'Layer Mash',
+                'quantity_kg': 40.0, 'note': ''}
+    save_feed_balances = farm_app.save_feed_balances
+    with farm_app.app.test_request_context():
+        monkeypatch.setattr(farm_app, 'save_feed_balances', lambda *args, **kwargs: False)
+        assert not farm_app.record_feed_movements([movement])
+        # The ledger has the purchase, the stored balances don't yet
+        assert len(farm_app.read_feed_ledger('csv')) == 1
+        assert os.path.exists(farm_app.feed_rebuild_flag_path('csv'))
+
+        monkeypatch.setattr(farm_app, 'save_feed_balances', save_feed_balances)
+        assert farm_app.post_feed_movements('csv', [dict(movement, movement='consumption', quantity_kg=5.0)])
+        assert not os.path.exists(farm_app.feed_rebuild_flag_path('csv'))
+        assert farm_app.load_feed_balances('csv')[farm_app.feed_balance_key('Layers', 'Layer Mash')]['balance_kg'] == pytest.approx(35.0)
@@ -0,0 +1,106 @@
+"""Conditional GETs (ETag / 304) and response compression."""
+import gzip
+import json
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+os.environ['USE_CSV_FALLBACK'] = 'true'
+os.environ.setdefault('GOOGLE_SHEET_ID', '')
+
+import app as farm_app  # noqa: E402
+
+HILLTOP = 'http://hilltop.example'
+
+
+@pytest.fixture
+def farms(tmp_path, monkeypatch):
+    """The default farm plus a 'hilltop' farm on its own host, both holding the same records."""
+    monkeypatch.setenv('FARM_TENANTS', json.dumps({'hilltop': {'hosts': ['hilltop.example']}}))
+    monkeypatch.setattr(farm_app, 'TENANTS', farm_app.load_tenants(str(tmp_path)))
+    monkeypatch.setattr(farm_app, 'USE_CSV_FALLBACK', True)
+    farm_app._tenant_states.clear()
+    for tenant_id in farm_app.TENANTS:
+        with farm_app.app.test_request_context():
+            farm_app.set_current_tenant(tenant_id)
+            assert farm_app.save_records([{'date': '2026-01-05', 'type': 'expenditure', 'category': 'Medication',
+                                           'item': f"Vet visit {number}", 'amount': number} for number in range(40)])
+    yield farm_app.TENANTS
+    farm_app._tenant_states.clear()
+
+
+@pytest.fixture
+def client(farms):
+    """A client logged in to each farm on its own host."""
+    client = farm_app.app.test_client()
+    for base_url, tenant_id in (('http://localhost', farm_app.DEFAULT_TENANT_ID), (HILLTOP, 'hilltop')):
+        with client.session_transaction(base_url=base_url) as session:
+            session['logged_in'] = True
+            session['tenant'] = tenant_id
+    return client
+
+
+def test_matching_etag_gets_304(client):
+    first = client.get('/api/records')
+    assert first.status_code == 200 and first.headers['ETag']
+    second = client.get('/api/records', headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 304
+    assert second.data == b''
+    assert second.headers['ETag'] == first.headers['ETag']
+
+
+def test_write_changes_the_etag(client):
+    etag = client.get('/api/records').headers['ETag']
+    assert client.post('/api/records', json=[{'date': '2026-01-06', 'type': 'expenditure', 'category': 'Medication',
+                                              'item': 'Dewormer', 'amount': 3}]).status_code == 201
+    response = client.get('/api/records', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_etag_differs_between_farms_with_the_same_records(client):
+    etag = client.get('/api/records').headers['ETag']
+    response = client.get('/api/records', base_url=HILLTOP, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_pending_flashes_force_a_full_page(client):
+    etag = client.get('/admin/view_records').headers['ETag']
+    assert client.get('/admin/view_records', headers={'If-None-Match': etag}).status_code == 304
+
+    with client.session_transaction() as session:
+        session['_flashes'] = [('success', 'Record updated successfully!')]
+    response = client.get('/admin/view_records', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'Record updated successfully!' in response.data
+
+
+def test_gzip_is_negotiated_and_varies_on_accept_encoding(client):
+    plain = client.get('/api/records')
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+    assert len(plain.data) > farm_app.COMPRESS_MIN_BYTES
+
+    compressed = client.get('/api/records', headers={'Accept-Encoding': 'gzip, deflate'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in compressed.headers['Vary']
+    assert gzip.decompress(compressed.data) == plain.data
+
+
+def test_brotli_is_preferred_when_installed(client):
+    response = client.get('/api/records', headers={'Accept-Encoding': 'gzip, br'})
+    if farm_app.brotli is None:
+        assert response.headers['Content-Encoding'] == 'gzip'
+    else:
+        assert response.headers['Content-Encoding'] == 'br'
+        assert json.loads(farm_app.brotli.decompress(response.data))['records']
+
+
+def test_small_and_not_modified_responses_are_not_compressed(client):
+    etag = client.get('/api/records').headers['ETag']
+    assert 'Content-Encoding' not in client.get('/api/records', headers={'If-None-Match': etag, 'Accept-Encoding': 'gzip'}).headers
+    assert 'Content-Encoding' not in client.get('/api/records?limit=1', headers={'Accept-Encoding': 'gzip'}).headers
@@ -0,0 +1,63 @@
+"""The Google partition manifest, against the Sheets API stand-in from loadtest.py."""
+import os
+import sys
+
+import gspread
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+os.environ['USE_CSV_FALLBACK'] = 'true'
+os.environ.setdefault('GOOGLE_SHEET_ID', '')
+
+import app as farm_app  # noqa: E402
+import loadtest  # noqa: E402
+
+
+@pytest.fixture
+def sheets(tmp_path, monkeypatch):
+    """Serves the default farm's spreadsheet from a fresh FakeSheetsService."""
+    service = loadtest.FakeSheetsService()
+    monkeypatch.setattr(farm_app, 'GOOGLE_SHEETS_API_URL', service.start())
+    monkeypatch.setattr(farm_app, 'GOOGLE_SHEET_ID', loadtest.LOADTEST_SHEET_ID)
+    monkeypatch.setattr(farm_app, 'TENANTS', farm_app.load_tenants(str(tmp_path)))
+    farm_app._tenant_states.clear()
+    yield service
+    farm_app._tenant_states.clear()
+    service.stop()
+
+
+def month_entry(key):
+    return {'storage': f"Records {key}", 'min_date': f"{key}-01", 'max_date': f"{key}-28", 'archived': False, 'generation': 0}
+
+
+def test_manifest_survives_a_failed_update(sheets, monkeypatch):
+    with farm_app.app.test_request_context():
+        client = farm_app.get_sheets_client()
+        manifest = farm_app.load_partition_manifest('google', client, fresh=True)
+        manifest.update({key: month_entry(key) for key in ('2026-01', '2026-02', '2026-03')})
+        assert farm_app.save_partition_manifest('google', manifest, client)
+
+        def failing_update(*args, **kwargs):
+            raise gspread.exceptions.APIError(type('Response', (), {
+                'json': lambda self: {'error': {'code': 503, 'message': 'The service is currently unavailable.'}},
+                'text': 'unavailable', 'status_code': 503})())
+        monkeypatch.setattr(gspread.worksheet.Worksheet, 'update', failing_update)
+        manifest['2026-04'] = month_entry('2026-04')
+        assert not farm_app.save_partition_manifest('google', manifest, client)
+
+        stored = farm_app.load_partition_manifest('google', client, fresh=True)
+        assert sorted(stored) == ['2026-01', '2026-02', '2026-03', farm_app.LEGACY_PARTITION_KEY]
+
+
+def test_shrunk_manifest_leaves_no_stale_rows(sheets):
+    with farm_app.app.test_request_context():
+        client = farm_app.get_sheets_client()
+        manifest = farm_app.load_partition_manifest('google', client, fresh=True)
+        manifest.update({key: month_entry(key) for key in ('2026-01', '2026-02', '2026-03')})
+        assert farm_app.save_partition_manifest('google', manifest, client)
+        del manifest['2026-01'], manifest['2026-02']
+        assert farm_app.save_partition_manifest('google', manifest, client)
+
+        stored = farm_app.load_partition_manifest('google', client, fresh=True)
+        assert sorted(stored) == ['2026-03', farm_app.LEGACY_PARTITION_KEY]
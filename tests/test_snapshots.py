@@ -0,0 +1,94 @@
+"""Snapshot round trips and the guard that only lets a restore write into an empty farm."""
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+os.environ['USE_CSV_FALLBACK'] = 'true'
+os.environ.setdefault('GOOGLE_SHEET_ID', '')
+
+import app as farm_app  # noqa: E402
+import loadtest  # noqa: E402
+
+pytest.importorskip('pyarrow')
+
+RECORDS = [
+    {'date': '2026-01-05', 'type': 'expenditure', 'category': 'Medication', 'item': 'Vet', 'amount': 12.5},
+    {'date': '2026-01-06', 'type': 'feed_input', 'category': 'Layers', 'item': 'Layer Mash', 'quantity': 40.0, 'unit': 'kg'},
+    {'date': '2025-11-02', 'type': 'profit', 'category': 'Layers', 'item': 'Eggs Sold', 'quantity': 3.0,
+     'profit_per_unit': 25.0, 'total_profit': 75.0, 'unit': 'crates'},
+]
+
+
+def use_farm(root_path, monkeypatch):
+    """Points the default farm at root_path with fresh in-memory state."""
+    monkeypatch.setattr(farm_app, 'TENANTS', farm_app.load_tenants(str(root_path)))
+    farm_app._tenant_states.clear()
+
+
+@pytest.fixture
+def farm(tmp_path, monkeypatch):
+    monkeypatch.setattr(farm_app, 'USE_CSV_FALLBACK', True)
+    monkeypatch.setattr(farm_app, 'SNAPSHOT_AUTO', False)
+    use_farm(tmp_path / 'source', monkeypatch)
+    with farm_app.app.test_request_context():
+        assert farm_app.save_records(RECORDS)
+        df = farm_app.get_all_farm_records_df()
+        snapshot = farm_app.write_records_snapshot(df, name='backup')
+        path = farm_app.snapshot_path(snapshot['name'])
+    yield df, path
+    farm_app._tenant_states.clear()
+
+
+def test_round_trip_keeps_rows_and_dtypes(farm, tmp_path, monkeypatch):
+    original, path = farm
+    use_farm(tmp_path / 'restored', monkeypatch)
+    with farm_app.app.test_request_context():
+        snapshot = farm_app.read_records_snapshot(path)
+        pd.testing.assert_frame_equal(snapshot, original)
+        assert farm_app.restore_records_snapshot(path) == len(RECORDS)
+        restored = farm_app.get_all_farm_records_df()
+    assert len(restored) == len(original)
+    assert restored.dtypes.to_dict() == original.dtypes.to_dict()
+    key = ['Date', 'Item']
+    pd.testing.assert_frame_equal(restored.sort_values(key).reset_index(drop=True),
+                                  original.sort_values(key).reset_index(drop=True))
+
+
+def test_restore_into_a_farm_with_records_is_refused(farm):
+    _, path = farm
+    with farm_app.app.test_request_context():
+        with pytest.raises(ValueError, match='already has records'):
+            farm_app.restore_records_snapshot(path)
+        assert farm_app.count_stored_records('csv') == len(RECORDS)
+
+
+def test_restore_is_refused_when_the_farm_cannot_be_read(farm, tmp_path, monkeypatch):
+    _, path = farm
+    use_farm(tmp_path / 'unreadable', monkeypatch)
+    with farm_app.app.test_request_context():
+        # A damaged manifest must not read as an empty farm
+        os.makedirs(farm_app.current_tenant()['partition_dir'])
+        with open(os.path.join(farm_app.current_tenant()['partition_dir'], farm_app.PARTITION_MANIFEST_FILE_NAME), 'w') as manifest_file:
+            manifest_file.write('{"2026": ')
+        with pytest.raises(ValueError, match='could not be read'):
+            farm_app.restore_records_snapshot(path)
+        assert not os.path.exists(os.path.join(farm_app.current_tenant()['partition_dir'], 'records_2026.csv'))
+
+
+def test_restore_is_refused_when_google_cannot_be_read(farm, tmp_path, monkeypatch):
+    _, path = farm
+    service = loadtest.FakeSheetsService(error_rate=1.0)
+    monkeypatch.setattr(farm_app, 'GOOGLE_SHEETS_API_URL', service.start())
+    monkeypatch.setattr(farm_app, 'GOOGLE_SHEET_ID', loadtest.LOADTEST_SHEET_ID)
+    try:
+        use_farm(tmp_path / 'google', monkeypatch)
+        with farm_app.app.test_request_context():
+            with pytest.raises(ValueError, match='could not be read'):
+                farm_app.restore_records_snapshot(path)
+            assert farm_app.count_stored_records('csv') == 0
+    finally:
+        service.stop()
@@ -0,0 +1,129 @@
+"""Idempotent form and API submissions: a token's write runs once, retries are answered from its outcome."""
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+os.environ['USE_CSV_FALLBACK'] = 'true'
+os.environ.setdefault('GOOGLE_SHEET_ID', '')
+
+import app as farm_app  # noqa: E402
+
+TOKEN = 'a' * 32
+
+
+@pytest.fixture
+def farm(tmp_path, monkeypatch):
+    """Points the default farm at an empty directory with fresh in-memory state."""
+    monkeypatch.setattr(farm_app, 'TENANTS', farm_app.load_tenants(str(tmp_path)))
+    monkeypatch.setattr(farm_app, 'USE_CSV_FALLBACK', True)
+    farm_app._tenant_states.clear()
+    yield tmp_path
+    farm_app._tenant_states.clear()
+
+
+@pytest.fixture
+def client(farm):
+    client = farm_app.app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = True
+        session['tenant'] = farm_app.DEFAULT_TENANT_ID
+    return client
+
+
+@pytest.fixture
+def appends(monkeypatch):
+    """Counts the record appends that reach storage."""
+    calls = []
+    append_partition_record = farm_app.append_partition_record
+
+    def counting_append(backend, data, client=None):
+        calls.append(data)
+        return append_partition_record(backend, data, client)
+    monkeypatch.setattr(farm_app, 'append_partition_record', counting_append)
+    return calls
+
+
+def expenditure_form(token=TOKEN):
+    return {'record_type': 'expenditure', 'exp_category': 'Medication', 'exp_item': 'Vet', 'exp_amount': '12',
+            farm_app.SUBMISSION_TOKEN_FIELD: token}
+
+
+def claim_path(token=TOKEN):
+    with farm_app.app.test_request_context():
+        return farm_app.submission_path(farm_app.submission_key(token))
+
+
+def write_claim(claim, token=TOKEN):
+    path = claim_path(token)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as claim_file:
+        if claim is not None:
+            json.dump(claim, claim_file)
+    return path
+
+
+def test_replayed_token_is_not_written_again(client, appends):
+    assert client.post('/admin/add_record', data=expenditure_form()).status_code == 302
+    response = client.post('/admin/add_record', data=expenditure_form(), follow_redirects=True)
+    assert len(appends) == 1
+    assert b'already submitted' in response.data
+
+    # Another worker has an empty index and replays from the claim file
+    farm_app._tenant_states.clear()
+    client.post('/admin/add_record', data=expenditure_form())
+    assert len(appends) == 1
+
+
+def test_failed_write_releases_the_claim(client, appends, monkeypatch):
+    save_record = farm_app.save_record
+    monkeypatch.setattr(farm_app, 'save_record', lambda record_type, data: False)
+    client.post('/admin/add_record', data=expenditure_form())
+    assert not os.path.exists(claim_path())
+
+    monkeypatch.setattr(farm_app, 'save_record', save_record)
+    client.post('/admin/add_record', data=expenditure_form())
+    assert len(appends) == 1
+
+
+def test_missing_form_field_releases_the_claim(client, appends):
+    form = expenditure_form()
+    del form['record_type']
+    response = client.post('/admin/add_record', data=form, follow_redirects=True)
+    assert b'Missing form field' in response.data
+    assert not os.path.exists(claim_path())
+    client.post('/admin/add_record', data=expenditure_form())
+    assert len(appends) == 1
+
+
+def test_claim_of_a_dead_worker_is_taken_over(client, appends):
+    worker = subprocess.Popen([sys.executable, '-c', 'pass'])
+    worker.wait()
+    write_claim({'scope': 'add_record', 'status': 'pending', 'at': time.time(), 'pid': worker.pid})
+    client.post('/admin/add_record', data=expenditure_form())
+    assert len(appends) == 1
+
+
+def test_empty_claim_file_does_not_block_retries(client, appends, monkeypatch):
+    monkeypatch.setattr(farm_app, 'SUBMISSION_PENDING_WAIT_SECONDS', 0.3)
+    path = write_claim(None)
+
+    # Possibly still being written by a live worker: wait, then report it as pending instead of spinning
+    started = time.time()
+    with farm_app.app.test_request_context():
+        claimed, submission = farm_app.claim_submission('add_record', TOKEN)
+    assert not claimed and submission['status'] == 'pending'
+    assert time.time() - started < 5
+
+    # Left behind by a worker that died mid-create: released and processed normally
+    stale = time.time() - farm_app.SUBMISSION_UNREADABLE_CLAIM_SECONDS - 1
+    os.utime(path, (stale, stale))
+    client.post('/admin/add_record', data=expenditure_form())
+    assert len(appends) == 1
+    with open(path, 'r', encoding='utf-8') as claim_file:
+        assert json.load(claim_file)['status'] == 'done'
@@ -0,0 +1,64 @@
+"""Sessions are bound to the farm they logged in to."""
+import json
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+os.environ['USE_CSV_FALLBACK'] = 'true'
+os.environ.setdefault('GOOGLE_SHEET_ID', '')
+
+import app as farm_app  # noqa: E402
+
+HILLTOP = 'http://hilltop.example'
+
+
+@pytest.fixture
+def farms(tmp_path, monkeypatch):
+    """The default farm plus a 'hilltop' farm served on its own host, each with one record."""
+    monkeypatch.setenv('FARM_TENANTS', json.dumps({'hilltop': {'hosts': ['hilltop.example'],
+                                                               'admin_username': 'hill', 'admin_password': 'top'}}))
+    monkeypatch.setattr(farm_app, 'TENANTS', farm_app.load_tenants(str(tmp_path)))
+    monkeypatch.setattr(farm_app, 'USE_CSV_FALLBACK', True)
+    farm_app._tenant_states.clear()
+    for tenant_id in ('hilltop', farm_app.DEFAULT_TENANT_ID):
+        with farm_app.app.test_request_context():
+            farm_app.set_current_tenant(tenant_id)
+            assert farm_app.save_records([{'date': '2026-01-05', 'type': 'expenditure', 'category': 'Medication',
+                                           'item': f"{tenant_id} vet", 'amount': 5}])
+    yield farm_app.TENANTS
+    farm_app._tenant_states.clear()
+
+
+@pytest.fixture
+def client(farms):
+    """A client logged in to the default farm, with its session cookie also sent to the hilltop host."""
+    client = farm_app.app.test_client()
+    for base_url in ('http://localhost', HILLTOP):
+        with client.session_transaction(base_url=base_url) as session:
+            session['logged_in'] = True
+            session['tenant'] = farm_app.DEFAULT_TENANT_ID
+    return client
+
+
+def test_session_of_another_farm_is_logged_out(client):
+    response = client.get('/api/records', base_url=HILLTOP)
+    assert response.status_code == 401
+    with client.session_transaction(base_url=HILLTOP) as session:
+        assert 'logged_in' not in session
+    assert client.get('/admin', base_url=HILLTOP).status_code == 302
+
+
+def test_session_of_another_farm_cannot_profile_it(client, farms):
+    response = client.get('/api/records?_profile=1', base_url=HILLTOP)
+    assert response.status_code == 401
+    assert 'X-Profile-Id' not in response.headers
+    assert not os.path.exists(farms['hilltop']['profiles_dir'])
+    assert not os.path.exists(farms[farm_app.DEFAULT_TENANT_ID]['profiles_dir'])
+
+
+def test_session_reads_only_its_own_farm(client):
+    records = client.get('/api/records').get_json()['records']
+    assert [record['item'] for record in records] == ['default vet']
@@ -0,0 +1,112 @@
+"""Record validation: which rows are quarantined, and that each partition version is validated once."""
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+os.environ['USE_CSV_FALLBACK'] = 'true'
+os.environ.setdefault('GOOGLE_SHEET_ID', '')
+
+import app as farm_app  # noqa: E402
+
+LEGACY_ROWS = [
+    '2025-01-05,expenditure,Medication,Vet,,,5,,',
+    '2025-01-06,Sales,Layers,Eggs,2,crates,,25,50',  # Legacy free-text type
+    '2025-01-07,,Layers,Grit,,,3,,',  # No type
+    'not a date,expenditure,Medication,Dewormer,,,7,,',
+    '2025-01-08,expenditure,Medication,Vaccine,,,seven,,',
+]
+
+
+@pytest.fixture
+def farm(tmp_path, monkeypatch):
+    """Points the default farm at a directory whose legacy farm_records.csv holds LEGACY_ROWS."""
+    monkeypatch.setattr(farm_app, 'TENANTS', farm_app.load_tenants(str(tmp_path)))
+    monkeypatch.setattr(farm_app, 'USE_CSV_FALLBACK', True)
+    farm_app._tenant_states.clear()
+    write_legacy_rows(LEGACY_ROWS)
+    yield tmp_path
+    farm_app._tenant_states.clear()
+
+
+@pytest.fixture
+def checks(monkeypatch):
+    """Counts the rows record_problems() actually checks."""
+    calls = []
+    record_problems = farm_app.record_problems
+
+    def counting_record_problems(values, columns):
+        calls.append(values)
+        return record_problems(values, columns)
+    monkeypatch.setattr(farm_app, 'record_problems', counting_record_problems)
+    return calls
+
+
+@pytest.fixture
+def alerts(monkeypatch):
+    """Collects the quarantine alerts shown to the user."""
+    messages = []
+
+    def collecting_notify(message, category='info'):
+        if 'quarantined' in message:
+            messages.append(message)
+    monkeypatch.setattr(farm_app, 'notify', collecting_notify)
+    return messages
+
+
+def write_legacy_rows(rows):
+    with open(farm_app.TENANTS[farm_app.DEFAULT_TENANT_ID]['csv_file_path'], 'w', encoding='utf-8') as legacy_file:
+        legacy_file.write(','.join(farm_app.CSV_COLUMNS) + '\n' + '\n'.join(rows) + '\n')
+
+
+def test_only_unusable_rows_are_quarantined(farm):
+    with farm_app.app.test_request_context():
+        df = farm_app.get_all_farm_records_df()
+        quarantined = farm_app.get_quarantined_records()
+    # Rows with legacy or missing types keep counting, as they did before validation existed
+    assert sorted(df['Item'].astype(str)) == ['eggs', 'grit', 'vet']
+    assert sorted(entry['locator'] for entry in quarantined) == ['legacy:3', 'legacy:4']
+    assert [len(entry['problems']) for entry in quarantined] == [1, 1]
+
+
+def test_each_partition_version_is_validated_once(farm, checks, alerts):
+    with farm_app.app.test_request_context():
+        farm_app.get_all_farm_records_df()
+        assert len(checks) == len(LEGACY_ROWS)
+        assert len(alerts) == 1
+
+        farm_app.invalidate_partition_cache('csv')
+        farm_app.get_all_farm_records_df()
+        assert len(checks) == len(LEGACY_ROWS)
+
+        # Only the changed row is checked again, and the known bad rows are not alerted about twice
+        write_legacy_rows(LEGACY_ROWS + ['2025-01-09,expenditure,Feed,Hay,,,4,,'])
+        farm_app.invalidate_partition_cache('csv')
+        assert len(farm_app.get_all_farm_records_df()) == 4
+        assert len(checks) == len(LEGACY_ROWS) + 1
+        assert len(alerts) == 1
+
+
+def test_workers_share_one_validation_per_partition_version(farm, checks, alerts):
+    script = textwrap.dedent(f"""
+        import sys
+        sys.path.insert(0, {REPO_DIR!r})
+        import app as farm_app
+        farm_app.TENANTS = farm_app.load_tenants({str(farm)!r})
+        with farm_app.app.test_request_context():
+            farm_app.get_all_farm_records_df()
+    """)
+    result = subprocess.run([sys.executable, '-c', script], cwd=str(farm), env=dict(os.environ),
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert os.path.exists(os.path.join(farm, farm_app.PARTITION_DIR_NAME, 'quarantine_csv_legacy.json'))
+
+    with farm_app.app.test_request_context():
+        assert len(farm_app.get_all_farm_records_df()) == 3
+        assert len(farm_app.get_quarantined_records()) == 2
+    assert checks == []
+    assert alerts == []